@@ -3,12 +3,15 @@
 """
 AGI скрипт для умного выбора SIM-карты
 Определяет оператора абонента и выбирает SIM того же оператора
+
+Запускается отдельным процессом на каждый звонок. Dialplan использует
+FastAGI-вариант в campaign-manager (docker/scripts/sim_selector.py):
+AGI(agi://127.0.0.1:4573/select_sim,<номер>) - тот же протокол SIM_ID/OPERATOR.
 """
 
 import sys
 import psycopg2
-import random
-from datetime import datetime, timedelta
+from datetime import datetime
 
 # Конфигурация БД
 DB_CONFIG = {
@@ -48,7 +51,7 @@ class AGI:
 
 def detect_operator(phone_number):
     """
-    Определяет оператора по номеру телефона
+    Определяет оператора по номеру телефона и резервирует SIM
     Возвращает: (operator_name, sim_number) или (None, None)
     """
     try:
@@ -58,102 +61,21 @@ def detect_operator(phone_number):
         # Извлекаем префикс (первые 3 цифры после 7)
         prefix = phone_number[1:4] if phone_number.startswith('7') else phone_number[:3]
 
-        # Ищем оператора
+        # Оператор, выбор SIM и счетчики - один атомарный вызов (reserve_sim в init.sql)
         cur.execute("""
-            SELECT operator FROM operator_ranges
-            WHERE prefix = %s LIMIT 1
-        """, (prefix,))
+            SELECT reserved_operator, reserved_sim
+            FROM reserve_sim(
+                (SELECT operator FROM operator_ranges WHERE prefix = %s LIMIT 1),
+                %s
+            )
+        """, (prefix, datetime.now()))
 
         result = cur.fetchone()
-        operator = result[0] if result else None
-
-        if not operator:
-            cur.close()
-            conn.close()
-            return None, None
-
-        # Ищем доступную SIM этого оператора
-        cur.execute("""
-            SELECT sim_number, calls_today, calls_this_hour, last_call_time
-            FROM sim_cards
-            WHERE operator = %s AND status = 'active'
-            ORDER BY calls_today ASC, calls_this_hour ASC, RANDOM()
-            LIMIT 1
-        """, (operator,))
-
-        sim_data = cur.fetchone()
-
-        if not sim_data:
-            # Нет активных SIM этого оператора - берем любую доступную
-            cur.execute("""
-                SELECT sim_number, operator, calls_today, calls_this_hour
-                FROM sim_cards
-                WHERE status = 'active'
-                ORDER BY calls_today ASC, calls_this_hour ASC, RANDOM()
-                LIMIT 1
-            """)
-            fallback = cur.fetchone()
-            if fallback:
-                sim_number, operator = fallback[0], fallback[1]
-            else:
-                cur.close()
-                conn.close()
-                return None, None
-        else:
-            sim_number = sim_data[0]
-            calls_today = sim_data[1]
-            calls_this_hour = sim_data[2]
-            last_call = sim_data[3]
-
-            # Проверка лимитов
-            cur.execute("""
-                SELECT daily_call_limit, hourly_call_limit
-                FROM sim_cards WHERE sim_number = %s
-            """, (sim_number,))
-
-            limits = cur.fetchone()
-            daily_limit, hourly_limit = limits
-
-            # Проверяем превышение лимитов
-            if calls_today >= daily_limit or calls_this_hour >= hourly_limit:
-                # Превышен лимит - берем другую SIM
-                cur.execute("""
-                    SELECT sim_number, operator
-                    FROM sim_cards
-                    WHERE status = 'active'
-                        AND calls_today < daily_call_limit
-                        AND calls_this_hour < hourly_call_limit
-                    ORDER BY calls_today ASC, RANDOM()
-                    LIMIT 1
-                """)
-                fallback = cur.fetchone()
-                if fallback:
-                    sim_number, operator = fallback[0], fallback[1]
-                else:
-                    cur.close()
-                    conn.close()
-                    return None, None
-
-        # Обновляем счетчики
-        now = datetime.now()
-        hour_ago = now - timedelta(hours=1)
-
-        cur.execute("""
-            UPDATE sim_cards
-            SET calls_today = calls_today + 1,
-                calls_this_hour = CASE
-                    WHEN last_call_time > %s THEN calls_this_hour + 1
-                    ELSE 1
-                END,
-                last_call_time = %s
-            WHERE sim_number = %s
-        """, (hour_ago, now, sim_number))
-
         conn.commit()
         cur.close()
         conn.close()
 
-        return operator, sim_number
+        return result if result else (None, None)
 
     except Exception as e:
         sys.stderr.write(f"ERROR in detect_operator: {e}\n")
@@ -21,9 +21,15 @@ CREATE TABLE IF NOT EXISTS sim_cards (
     status VARCHAR(20) DEFAULT 'active',  -- active, blocked, disabled
     daily_call_limit INTEGER DEFAULT 80,
     hourly_call_limit INTEGER DEFAULT 15,
+    daily_sms_limit INTEGER DEFAULT 100,
+    hourly_sms_limit INTEGER DEFAULT 20,
+    -- Счётчики скользящих окон (24 ч / 1 ч), записывает campaign-manager (sim_capacity.py)
     calls_today INTEGER DEFAULT 0,
     calls_this_hour INTEGER DEFAULT 0,
     last_call_time TIMESTAMP,
+    sms_today INTEGER DEFAULT 0,
+    sms_this_hour INTEGER DEFAULT 0,
+    last_sms_time TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     UNIQUE(sim_number)
 );
@@ -43,29 +49,44 @@ CREATE TABLE IF NOT EXISTS campaigns (
     scheduled_start_time TIMESTAMP,  -- Запланированное время старта (UTC)
     use_timezones BOOLEAN DEFAULT FALSE,  -- Использовать ли часовые пояса
     timezone_mode VARCHAR(20) DEFAULT 'none',  -- none, manual, auto
+    call_window_start TIME DEFAULT '09:00',  -- Окно обзвона по местному времени абонента
+    call_window_end TIME DEFAULT '21:00',
+    -- Повторные звонки (redial.py): 1 - без повторов
+    max_attempts INTEGER DEFAULT 1,
+    retry_busy_minutes INTEGER DEFAULT 10,       -- Пауза после "занято"
+    retry_no_answer_minutes INTEGER DEFAULT 60,  -- Пауза после "не ответил"
+    retry_failed_minutes INTEGER DEFAULT 30,     -- Пауза после ошибки
+    retry_backoff REAL DEFAULT 1.0,              -- Множитель паузы на каждую следующую попытку
+    retry_window_start TIME,                     -- Окно повторов по местному времени
+    retry_window_end TIME,                       -- (NULL - окно обзвона кампании)
     total_numbers INTEGER DEFAULT 0,
     processed_numbers INTEGER DEFAULT 0,
     successful_calls INTEGER DEFAULT 0,
     failed_calls INTEGER DEFAULT 0,
     sms_sent INTEGER DEFAULT 0,      -- Количество отправленных СМС
     sms_failed INTEGER DEFAULT 0,    -- Количество неудачных СМС
+    suppressed_numbers INTEGER DEFAULT 0,  -- Отсеяно стоп-листом при загрузке
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     started_at TIMESTAMP,
     completed_at TIMESTAMP,
     cancelled_at TIMESTAMP           -- Время отмены запланированного запуска
 );
 
+-- Список кампаний с фильтром по статусу (keyset-пагинация по id)
+CREATE INDEX IF NOT EXISTS idx_campaigns_status_id ON campaigns(status, id);
+
 -- Таблица номеров для обзвона
 CREATE TABLE IF NOT EXISTS campaign_numbers (
     id SERIAL PRIMARY KEY,
     campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
-    phone_number VARCHAR(20) NOT NULL,
+    phone_number BIGINT NOT NULL,    -- E.164 без '+': 79161234567 (phones.py; старые БД - migrations/002_phone_bigint.sql)
     operator VARCHAR(50),            -- Определенный оператор
     timezone VARCHAR(50),            -- Часовой пояс контакта (Europe/Moscow, Asia/Yekaterinburg и т.д.)
-    status VARCHAR(20) DEFAULT 'pending',  -- pending, calling, answered, busy, failed, no_answer
+    status VARCHAR(20) DEFAULT 'pending',  -- pending, calling, answered, busy, failed, no_answer, retry, suppressed, processed (СМС)
     sim_used INTEGER,                -- Какая SIM использовалась
     call_attempts INTEGER DEFAULT 0,
     last_attempt_time TIMESTAMP,
+    next_attempt_at TIMESTAMP,       -- Время повтора (status = 'retry')
     answer_time TIMESTAMP,
     duration INTEGER,                -- Длительность в секундах
     sms_status VARCHAR(20),          -- pending, sent, failed (статус отправки СМС)
@@ -75,38 +96,115 @@ CREATE TABLE IF NOT EXISTS campaign_numbers (
 );
 
 -- Индексы для campaign_numbers
-CREATE INDEX IF NOT EXISTS idx_campaign_status ON campaign_numbers(campaign_id, status);
 CREATE INDEX IF NOT EXISTS idx_phone ON campaign_numbers(phone_number);
+-- Очереди по часовым поясам (NumberFeed в campaign_manager)
+CREATE INDEX IF NOT EXISTS idx_campaign_tz_pending ON campaign_numbers(campaign_id, timezone, id)
+    WHERE status = 'pending';
+-- Просмотр номеров кампании с фильтрами и keyset-пагинацией по id
+-- (GET /api/campaigns/{id}/numbers, выгрузка CSV)
+CREATE INDEX IF NOT EXISTS idx_cn_campaign_id ON campaign_numbers(campaign_id, id);
+-- (campaign_id, status, id) заменяет прежний idx_campaign_status (campaign_id, status)
+CREATE INDEX IF NOT EXISTS idx_cn_campaign_status_id ON campaign_numbers(campaign_id, status, id);
+CREATE INDEX IF NOT EXISTS idx_cn_campaign_operator_id ON campaign_numbers(campaign_id, operator, id);
+CREATE INDEX IF NOT EXISTS idx_cn_campaign_tz_id ON campaign_numbers(campaign_id, timezone, id);
+CREATE INDEX IF NOT EXISTS idx_cn_campaign_sim_id ON campaign_numbers(campaign_id, sim_used, id);
+-- Очередь повторных звонков (RetryQueue в redial.py)
+CREATE INDEX IF NOT EXISTS idx_cn_retry_due ON campaign_numbers(campaign_id, next_attempt_at)
+    WHERE status = 'retry';
+
+-- Счётчики номеров кампании по статусам (ведутся триггерами, см. ниже)
+-- Статистика кампании читается отсюда вместо COUNT по campaign_numbers
+CREATE TABLE IF NOT EXISTS campaign_status_counts (
+    campaign_id INTEGER REFERENCES campaigns(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign_id, status)
+);
+
+-- История контактов по номеру во всех кампаниях (contact_frequency.py)
+-- Лимит "не больше N контактов на номер за 24 часа": хранятся только
+-- последние N контактов, строка на номер
+CREATE TABLE IF NOT EXISTS contact_history (
+    phone_number BIGINT PRIMARY KEY,
+    last_contact_at TIMESTAMP NOT NULL,
+    recent_contacts TIMESTAMP[] NOT NULL DEFAULT '{}'
+);
+
+-- Номера с контактом в пределах окна (перестроение Bloom-фильтра)
+CREATE INDEX IF NOT EXISTS idx_contact_history_last ON contact_history(last_contact_at);
+
+-- Стоп-лист: отказ от звонков, чёрный список (suppression.py)
+-- Номер - BIGINT (79161234567): компактнее строки и сразу в числовом порядке
+CREATE TABLE IF NOT EXISTS suppression_list (
+    phone BIGINT PRIMARY KEY,
+    reason VARCHAR(50) DEFAULT 'opt_out',  -- opt_out, blacklist, complaint
+    source VARCHAR(100),                   -- Откуда номер (файл, API)
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Журналы call_logs и sms_log разбиты на помесячные партиции по времени
+-- записи (call_logs_p202610, ...). Запросы за период читают только свои
+-- месяцы, старые месяцы удаляются целиком (DROP TABLE вместо DELETE и
+-- VACUUM). Партиции создаёт и удаляет log_partitions_maintain() (ниже),
+-- её вызывает log_partitions.py. Строки вне созданных месяцев попадают
+-- в партицию _default. Существующую БД переводит
+-- migrations/001_partition_logs.sql.
 
 -- Таблица логов звонков
 CREATE TABLE IF NOT EXISTS call_logs (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     campaign_id INTEGER REFERENCES campaigns(id),
-    phone_number VARCHAR(20) NOT NULL,
+    phone_number BIGINT NOT NULL,
     sim_number INTEGER,
     operator VARCHAR(50),
     status VARCHAR(50),              -- ANSWER, BUSY, NOANSWER, FAILED
     duration INTEGER,
-    call_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    error_message TEXT
-);
+    call_time TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+    error_message TEXT,
+    PRIMARY KEY (id, call_time)      -- ключ партиционирования входит в первичный ключ
+) PARTITION BY RANGE (call_time);
 
--- Индексы для call_logs
+CREATE TABLE IF NOT EXISTS call_logs_default PARTITION OF call_logs DEFAULT;
+
+-- Индексы для call_logs (создаются в каждой партиции)
 CREATE INDEX IF NOT EXISTS idx_call_time ON call_logs(call_time);
 CREATE INDEX IF NOT EXISTS idx_campaign ON call_logs(campaign_id);
 
--- Таблица SMS (для будущего функционала)
+-- Журнал СМС (пишет sms_dispatcher.py пачками)
 CREATE TABLE IF NOT EXISTS sms_log (
-    id SERIAL PRIMARY KEY,
+    id BIGSERIAL,
     campaign_id INTEGER REFERENCES campaigns(id),
-    phone_number VARCHAR(20) NOT NULL,
+    phone_number BIGINT NOT NULL,
     sim_number INTEGER,
     message TEXT NOT NULL,
     status VARCHAR(20) DEFAULT 'pending',  -- pending, sent, failed
     sent_at TIMESTAMP,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP NOT NULL DEFAULT LOCALTIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE TABLE IF NOT EXISTS sms_log_default PARTITION OF sms_log DEFAULT;
+
+CREATE INDEX IF NOT EXISTS idx_sms_log_created ON sms_log(created_at);
+CREATE INDEX IF NOT EXISTS idx_sms_log_campaign ON sms_log(campaign_id);
+
+-- Почасовые агрегаты звонков для отчётов (/api/reports/..., пишет write_behind.py
+-- вместе с call_logs). Отчёт за любой период читает только эти строки,
+-- а не campaign_numbers и call_logs.
+CREATE TABLE IF NOT EXISTS report_hourly (
+    hour TIMESTAMP NOT NULL,                 -- Начало часа (время приложения)
+    campaign_id INTEGER NOT NULL REFERENCES campaigns(id),
+    sim_number INTEGER NOT NULL DEFAULT 0,   -- 0 - звонок не дошёл до SIM
+    operator VARCHAR(50) NOT NULL DEFAULT '',
+    timezone VARCHAR(50) NOT NULL DEFAULT '',
+    outcome VARCHAR(20) NOT NULL,            -- answered, busy, no_answer, failed
+    calls BIGINT NOT NULL DEFAULT 0,
+    duration BIGINT NOT NULL DEFAULT 0,      -- Суммарная длительность, сек
+    PRIMARY KEY (hour, campaign_id, sim_number, operator, timezone, outcome)
 );
 
+CREATE INDEX IF NOT EXISTS idx_report_hourly_campaign ON report_hourly(campaign_id, hour);
+
 -- Таблица шаблонов СМС
 CREATE TABLE IF NOT EXISTS sms_templates (
     id SERIAL PRIMARY KEY,
@@ -265,14 +363,14 @@ ON CONFLICT DO NOTHING;
 -- =================================================================
 
 -- Функция для определения оператора по номеру
-CREATE OR REPLACE FUNCTION detect_operator(phone VARCHAR(20))
+CREATE OR REPLACE FUNCTION detect_operator(phone BIGINT)
 RETURNS VARCHAR(50) AS $$
 DECLARE
     phone_prefix VARCHAR(10);
     operator_name VARCHAR(50);
 BEGIN
-    -- Извлекаем первые 3 цифры после +7
-    phone_prefix := SUBSTRING(phone FROM 2 FOR 3);
+    -- Первые 3 цифры после 7: 79161234567 / 10^7 % 1000 -> 916
+    phone_prefix := (phone / 10000000 % 1000)::text;
 
     -- Ищем оператора
     SELECT operator INTO operator_name
@@ -300,4 +398,323 @@ BEFORE INSERT ON campaign_numbers
 FOR EACH ROW
 EXECUTE FUNCTION set_operator_on_insert();
 
+-- Уведомление планировщика кампаний (LISTEN campaign_schedule в campaign_manager)
+-- при создании, переносе, запуске и отмене запланированной кампании
+CREATE OR REPLACE FUNCTION notify_campaign_schedule()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF OLD.status = 'scheduled' THEN
+            PERFORM pg_notify('campaign_schedule', OLD.id::text);
+        END IF;
+        RETURN OLD;
+    END IF;
+
+    IF NEW.status = 'scheduled' OR (TG_OP = 'UPDATE' AND OLD.status = 'scheduled') THEN
+        PERFORM pg_notify('campaign_schedule', NEW.id::text);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER campaigns_notify_schedule
+AFTER INSERT OR UPDATE OF status, scheduled_start_time OR DELETE ON campaigns
+FOR EACH ROW
+EXECUTE FUNCTION notify_campaign_schedule();
+
+-- Инкрементальные счётчики campaign_status_counts
+-- Триггеры уровня оператора с transition tables: одна пачка INSERT/UPDATE
+-- (загрузка CSV, write-behind исполнителя) даёт одно обновление на статус
+CREATE OR REPLACE FUNCTION campaign_status_counts_apply()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO campaign_status_counts (campaign_id, status, count)
+        SELECT campaign_id, COALESCE(status, 'unknown'), COUNT(*)
+        FROM new_rows
+        WHERE campaign_id IS NOT NULL
+        GROUP BY 1, 2
+        ON CONFLICT (campaign_id, status)
+        DO UPDATE SET count = campaign_status_counts.count + EXCLUDED.count;
+
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO campaign_status_counts (campaign_id, status, count)
+        SELECT campaign_id, status, SUM(delta)
+        FROM (
+            SELECT o.campaign_id, COALESCE(o.status, 'unknown') AS status, -1 AS delta
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE n.status IS DISTINCT FROM o.status
+            UNION ALL
+            SELECT n.campaign_id, COALESCE(n.status, 'unknown'), 1
+            FROM old_rows o JOIN new_rows n ON n.id = o.id
+            WHERE n.status IS DISTINCT FROM o.status
+        ) d
+        WHERE campaign_id IS NOT NULL
+        GROUP BY 1, 2
+        HAVING SUM(delta) <> 0
+        ON CONFLICT (campaign_id, status)
+        DO UPDATE SET count = campaign_status_counts.count + EXCLUDED.count;
+
+    ELSIF TG_OP = 'DELETE' THEN
+        -- При удалении кампании строки счётчиков уже удалены каскадом
+        UPDATE campaign_status_counts c
+        SET count = c.count - d.cnt
+        FROM (
+            SELECT campaign_id, COALESCE(status, 'unknown') AS status, COUNT(*) AS cnt
+            FROM old_rows
+            GROUP BY 1, 2
+        ) d
+        WHERE c.campaign_id = d.campaign_id AND c.status = d.status;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER campaign_numbers_counts_insert
+AFTER INSERT ON campaign_numbers
+REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION campaign_status_counts_apply();
+
+CREATE TRIGGER campaign_numbers_counts_update
+AFTER UPDATE ON campaign_numbers
+REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION campaign_status_counts_apply();
+
+CREATE TRIGGER campaign_numbers_counts_delete
+AFTER DELETE ON campaign_numbers
+REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT
+EXECUTE FUNCTION campaign_status_counts_apply();
+
+-- Сверка счётчиков с campaign_numbers (фоновая проверка согласованности)
+-- Блокирует строки счётчиков кампании, поэтому параллельные изменения
+-- применяются до или после сверки, но не теряются. Возвращает число исправлений.
+CREATE OR REPLACE FUNCTION campaign_status_counts_recheck(p_campaign_id INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    fixed INTEGER;
+BEGIN
+    PERFORM 1 FROM campaign_status_counts
+    WHERE campaign_id = p_campaign_id
+    FOR UPDATE;
+
+    INSERT INTO campaign_status_counts (campaign_id, status, count)
+    SELECT p_campaign_id, m.status, m.actual
+    FROM (
+        SELECT COALESCE(a.status, s.status) AS status,
+               COALESCE(a.cnt, 0) AS actual,
+               s.count AS stored
+        FROM (
+            SELECT COALESCE(status, 'unknown') AS status, COUNT(*) AS cnt
+            FROM campaign_numbers
+            WHERE campaign_id = p_campaign_id
+            GROUP BY 1
+        ) a
+        FULL JOIN (
+            SELECT status, count FROM campaign_status_counts
+            WHERE campaign_id = p_campaign_id
+        ) s ON s.status = a.status
+    ) m
+    WHERE m.stored IS DISTINCT FROM m.actual
+    ON CONFLICT (campaign_id, status)
+    DO UPDATE SET count = EXCLUDED.count;
+
+    GET DIAGNOSTICS fixed = ROW_COUNT;
+    RETURN fixed;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Резервирование SIM для звонка за один запрос (FastAGI select_sim)
+-- Берёт наименее загруженную SIM с запасом по дневному и часовому лимиту:
+-- сначала того же оператора, затем любого - и сразу увеличивает её счётчики.
+-- Строка SIM блокируется до конца транзакции: параллельные резервирования
+-- берут другие SIM (SKIP LOCKED), а если свободных нет - ждут и перепроверяют
+-- лимиты после блокировки, поэтому лимиты не превышаются.
+-- calls_this_hour старше часа и calls_today за прошлые дни считаются нулём
+-- (как при обновлении счётчика).
+CREATE OR REPLACE FUNCTION reserve_sim(p_operator VARCHAR(50), p_now TIMESTAMP DEFAULT LOCALTIMESTAMP)
+RETURNS TABLE (reserved_sim INTEGER, reserved_operator VARCHAR(50)) AS $$
+DECLARE
+    candidate_id INTEGER;
+BEGIN
+    FOR attempt IN 1..3 LOOP
+        SELECT s.id INTO candidate_id
+        FROM sim_cards s
+        WHERE s.status = 'active'
+          AND CASE WHEN s.last_call_time >= date_trunc('day', p_now)
+                   THEN s.calls_today ELSE 0 END < s.daily_call_limit
+          AND CASE WHEN s.last_call_time > p_now - INTERVAL '1 hour'
+                   THEN s.calls_this_hour ELSE 0 END < s.hourly_call_limit
+        ORDER BY (s.operator = p_operator) IS TRUE DESC,
+                 s.calls_today, s.calls_this_hour, RANDOM()
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED;
+
+        IF candidate_id IS NULL THEN
+            -- Все подходящие SIM заняты параллельными резервированиями - ждём
+            SELECT s.id INTO candidate_id
+            FROM sim_cards s
+            WHERE s.status = 'active'
+              AND CASE WHEN s.last_call_time >= date_trunc('day', p_now)
+                       THEN s.calls_today ELSE 0 END < s.daily_call_limit
+              AND CASE WHEN s.last_call_time > p_now - INTERVAL '1 hour'
+                       THEN s.calls_this_hour ELSE 0 END < s.hourly_call_limit
+            ORDER BY (s.operator = p_operator) IS TRUE DESC,
+                     s.calls_today, s.calls_this_hour
+            LIMIT 1
+            FOR UPDATE;
+        END IF;
+
+        IF candidate_id IS NOT NULL THEN
+            RETURN QUERY
+            UPDATE sim_cards s
+            SET calls_today = CASE
+                    WHEN s.last_call_time >= date_trunc('day', p_now) THEN s.calls_today + 1
+                    ELSE 1
+                END,
+                calls_this_hour = CASE
+                    WHEN s.last_call_time > p_now - INTERVAL '1 hour' THEN s.calls_this_hour + 1
+                    ELSE 1
+                END,
+                last_call_time = p_now
+            WHERE s.id = candidate_id
+            RETURNING s.sim_number, s.operator;
+            RETURN;
+        END IF;
+        -- Пусто: подходящих SIM нет или дождались SIM, исчерпавшей лимит - ещё попытка
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Резервирование слота конкретной SIM: p_kind 'call' или 'sms'
+-- (sim_capacity.py - SIM выбрана по счётчикам в памяти, здесь атомарная
+-- проверка лимита и увеличение счётчиков в одном UPDATE: параллельные
+-- резервирования других процессов перепроверяются после блокировки строки).
+-- Возвращает признак резервирования и счётчики SIM после попытки - при
+-- отказе процесс обновляет по ним свою копию.
+CREATE OR REPLACE FUNCTION reserve_sim_slot(p_sim INTEGER, p_kind VARCHAR(10),
+                                            p_now TIMESTAMP DEFAULT LOCALTIMESTAMP)
+RETURNS TABLE (reserved BOOLEAN, slot_this_hour INTEGER, slot_today INTEGER,
+               slot_last_time TIMESTAMP) AS $$
+BEGIN
+    IF p_kind = 'sms' THEN
+        RETURN QUERY
+        UPDATE sim_cards s
+        SET sms_today = CASE
+                WHEN s.last_sms_time >= date_trunc('day', p_now) THEN s.sms_today + 1
+                ELSE 1
+            END,
+            sms_this_hour = CASE
+                WHEN s.last_sms_time > p_now - INTERVAL '1 hour' THEN s.sms_this_hour + 1
+                ELSE 1
+            END,
+            last_sms_time = p_now
+        WHERE s.sim_number = p_sim
+          AND s.status = 'active'
+          AND CASE WHEN s.last_sms_time >= date_trunc('day', p_now)
+                   THEN s.sms_today ELSE 0 END < s.daily_sms_limit
+          AND CASE WHEN s.last_sms_time > p_now - INTERVAL '1 hour'
+                   THEN s.sms_this_hour ELSE 0 END < s.hourly_sms_limit
+        RETURNING TRUE, s.sms_this_hour, s.sms_today, s.last_sms_time;
+
+        IF NOT FOUND THEN
+            RETURN QUERY
+            SELECT FALSE, s.sms_this_hour, s.sms_today, s.last_sms_time
+            FROM sim_cards s WHERE s.sim_number = p_sim;
+        END IF;
+    ELSE
+        RETURN QUERY
+        UPDATE sim_cards s
+        SET calls_today = CASE
+                WHEN s.last_call_time >= date_trunc('day', p_now) THEN s.calls_today + 1
+                ELSE 1
+            END,
+            calls_this_hour = CASE
+                WHEN s.last_call_time > p_now - INTERVAL '1 hour' THEN s.calls_this_hour + 1
+                ELSE 1
+            END,
+            last_call_time = p_now
+        WHERE s.sim_number = p_sim
+          AND s.status = 'active'
+          AND CASE WHEN s.last_call_time >= date_trunc('day', p_now)
+                   THEN s.calls_today ELSE 0 END < s.daily_call_limit
+          AND CASE WHEN s.last_call_time > p_now - INTERVAL '1 hour'
+                   THEN s.calls_this_hour ELSE 0 END < s.hourly_call_limit
+        RETURNING TRUE, s.calls_this_hour, s.calls_today, s.last_call_time;
+
+        IF NOT FOUND THEN
+            RETURN QUERY
+            SELECT FALSE, s.calls_this_hour, s.calls_today, s.last_call_time
+            FROM sim_cards s WHERE s.sim_number = p_sim;
+        END IF;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Помесячные партиции журнала: создание на p_months_ahead месяцев вперёд
+-- и удаление месяцев старше p_keep_months (0 - хранить всё).
+-- Возвращает список выполненных действий.
+CREATE OR REPLACE FUNCTION log_partitions_maintain(
+    p_table TEXT,
+    p_now TIMESTAMP DEFAULT LOCALTIMESTAMP,
+    p_months_ahead INTEGER DEFAULT 2,
+    p_keep_months INTEGER DEFAULT 0
+)
+RETURNS TEXT[] AS $$
+DECLARE
+    actions TEXT[] := '{}';
+    month_start DATE;
+    part_name TEXT;
+    deleted BIGINT;
+    cutoff DATE := (date_trunc('month', p_now) - make_interval(months => p_keep_months))::date;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        month_start := (date_trunc('month', p_now) + make_interval(months => i))::date;
+        part_name := p_table || '_p' || to_char(month_start, 'YYYYMM');
+        CONTINUE WHEN to_regclass(part_name) IS NOT NULL;
+        BEGIN
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           part_name, p_table, month_start, (month_start + INTERVAL '1 month')::date);
+            actions := actions || ('created ' || part_name);
+        EXCEPTION WHEN others THEN
+            -- Например, в _default уже есть строки этого месяца
+            actions := actions || ('failed ' || part_name || ': ' || SQLERRM);
+        END;
+    END LOOP;
+
+    IF p_keep_months > 0 THEN
+        FOR part_name IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = p_table::regclass
+              AND CASE WHEN c.relname ~ ('^' || p_table || '_p[0-9]{6}$')
+                       THEN to_date(right(c.relname, 6), 'YYYYMM') < cutoff
+                       ELSE FALSE END
+            ORDER BY c.relname
+        LOOP
+            EXECUTE format('DROP TABLE %I', part_name);
+            actions := actions || ('dropped ' || part_name);
+        END LOOP;
+
+        -- Старые строки, попавшие в _default (столбец - из ключа партиционирования)
+        EXECUTE format('DELETE FROM %I WHERE %s < %L', p_table || '_default',
+                       substring(pg_get_partkeydef(p_table::regclass) FROM '\((.*)\)'), cutoff);
+        GET DIAGNOSTICS deleted = ROW_COUNT;
+        IF deleted > 0 THEN
+            actions := actions || ('deleted ' || deleted || ' rows from ' || p_table || '_default');
+        END IF;
+    END IF;
+
+    RETURN actions;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Партиции на текущий и следующие месяцы сразу при создании БД
+SELECT log_partitions_maintain('call_logs');
+SELECT log_partitions_maintain('sms_log');
+
 COMMENT ON DATABASE phone_campaigns IS 'База данных для управления телефонными кампаниями через GoIP-4';
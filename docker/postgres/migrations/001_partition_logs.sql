@@ -0,0 +1,149 @@
+-- Миграция: call_logs и sms_log -> помесячные партиции
+--
+-- Для БД, созданных до перехода на партиции: init.sql выполняется только
+-- при первом запуске тома postgres, а CREATE TABLE IF NOT EXISTS не трогает
+-- существующие таблицы. Без миграции log_partitions_maintain() падает на
+-- каждом запуске.
+--
+-- Применение (одна транзакция; повторный запуск ничего не делает):
+--   docker compose exec -T postgres psql -U phone_user -d phone_campaigns \
+--       -v ON_ERROR_STOP=1 < docker/postgres/migrations/001_partition_logs.sql
+--
+-- Старая таблица переименовывается в <журнал>_unpartitioned, создаётся
+-- партиционированная с партицией _default и партициями на каждый месяц,
+-- за который есть строки; строки копируются, старая таблица удаляется.
+-- Запись в журналы на время миграции блокируется - лучше останавливать
+-- campaign-manager.
+
+BEGIN;
+
+-- Та же функция, что в init.sql
+-- Помесячные партиции журнала: создание на p_months_ahead месяцев вперёд
+-- и удаление месяцев старше p_keep_months (0 - хранить всё).
+-- Возвращает список выполненных действий.
+CREATE OR REPLACE FUNCTION log_partitions_maintain(
+    p_table TEXT,
+    p_now TIMESTAMP DEFAULT LOCALTIMESTAMP,
+    p_months_ahead INTEGER DEFAULT 2,
+    p_keep_months INTEGER DEFAULT 0
+)
+RETURNS TEXT[] AS $$
+DECLARE
+    actions TEXT[] := '{}';
+    month_start DATE;
+    part_name TEXT;
+    deleted BIGINT;
+    cutoff DATE := (date_trunc('month', p_now) - make_interval(months => p_keep_months))::date;
+BEGIN
+    FOR i IN 0..p_months_ahead LOOP
+        month_start := (date_trunc('month', p_now) + make_interval(months => i))::date;
+        part_name := p_table || '_p' || to_char(month_start, 'YYYYMM');
+        CONTINUE WHEN to_regclass(part_name) IS NOT NULL;
+        BEGIN
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           part_name, p_table, month_start, (month_start + INTERVAL '1 month')::date);
+            actions := actions || ('created ' || part_name);
+        EXCEPTION WHEN others THEN
+            -- Например, в _default уже есть строки этого месяца
+            actions := actions || ('failed ' || part_name || ': ' || SQLERRM);
+        END;
+    END LOOP;
+
+    IF p_keep_months > 0 THEN
+        FOR part_name IN
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = p_table::regclass
+              AND CASE WHEN c.relname ~ ('^' || p_table || '_p[0-9]{6}$')
+                       THEN to_date(right(c.relname, 6), 'YYYYMM') < cutoff
+                       ELSE FALSE END
+            ORDER BY c.relname
+        LOOP
+            EXECUTE format('DROP TABLE %I', part_name);
+            actions := actions || ('dropped ' || part_name);
+        END LOOP;
+
+        -- Старые строки, попавшие в _default (столбец - из ключа партиционирования)
+        EXECUTE format('DELETE FROM %I WHERE %s < %L', p_table || '_default',
+                       substring(pg_get_partkeydef(p_table::regclass) FROM '\((.*)\)'), cutoff);
+        GET DIAGNOSTICS deleted = ROW_COUNT;
+        IF deleted > 0 THEN
+            actions := actions || ('deleted ' || deleted || ' rows from ' || p_table || '_default');
+        END IF;
+    END IF;
+
+    RETURN actions;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    journal RECORD;
+    old_name TEXT;
+    seq TEXT;
+    month_start DATE;
+    copied BIGINT;
+BEGIN
+    FOR journal IN
+        SELECT * FROM (VALUES ('call_logs', 'call_time'), ('sms_log', 'created_at')) AS v(tbl, col)
+    LOOP
+        IF (SELECT relkind FROM pg_class WHERE oid = journal.tbl::regclass) = 'p' THEN
+            RAISE NOTICE '%: уже разбит на партиции', journal.tbl;
+            CONTINUE;
+        END IF;
+
+        old_name := journal.tbl || '_unpartitioned';
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', journal.tbl, old_name);
+
+        -- Те же столбцы и значения по умолчанию; id - BIGINT, время записи обязательно
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS) PARTITION BY RANGE (%I)',
+                       journal.tbl, old_name, journal.col);
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN id TYPE BIGINT, '
+                       'ALTER COLUMN %I SET DEFAULT LOCALTIMESTAMP, ALTER COLUMN %I SET NOT NULL',
+                       journal.tbl, journal.col, journal.col);
+        EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', journal.tbl || '_default', journal.tbl);
+
+        -- Строки без времени (до DEFAULT ... NOT NULL) - временем миграции
+        EXECUTE format('UPDATE %I SET %I = LOCALTIMESTAMP WHERE %I IS NULL', old_name, journal.col, journal.col);
+
+        -- Каждый месяц со строками - своя партиция (иначе всё осело бы в _default
+        -- и log_partitions_maintain() не смог бы создать эти месяцы)
+        FOR month_start IN
+            EXECUTE format('SELECT DISTINCT date_trunc(''month'', %I)::date FROM %I ORDER BY 1',
+                           journal.col, old_name)
+        LOOP
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           journal.tbl || '_p' || to_char(month_start, 'YYYYMM'), journal.tbl,
+                           month_start, (month_start + INTERVAL '1 month')::date);
+        END LOOP;
+
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', journal.tbl, old_name);
+        GET DIAGNOSTICS copied = ROW_COUNT;
+
+        -- Последовательность id переходит к новой таблице (иначе удалится вместе со старой)
+        seq := pg_get_serial_sequence(old_name, 'id');
+        IF seq IS NOT NULL THEN
+            EXECUTE format('ALTER SEQUENCE %s AS BIGINT OWNED BY %I.id', seq, journal.tbl);
+        END IF;
+
+        EXECUTE format('DROP TABLE %I', old_name);
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id, %I)', journal.tbl, journal.col);
+        EXECUTE format('ALTER TABLE %I ADD FOREIGN KEY (campaign_id) REFERENCES campaigns(id)', journal.tbl);
+
+        RAISE NOTICE '%: перенесено % строк', journal.tbl, copied;
+    END LOOP;
+END;
+$$;
+
+-- Индексы старых таблиц удалены вместе с ними
+CREATE INDEX IF NOT EXISTS idx_call_time ON call_logs(call_time);
+CREATE INDEX IF NOT EXISTS idx_campaign ON call_logs(campaign_id);
+CREATE INDEX IF NOT EXISTS idx_sms_log_created ON sms_log(created_at);
+CREATE INDEX IF NOT EXISTS idx_sms_log_campaign ON sms_log(campaign_id);
+
+-- Текущий и следующие месяцы
+SELECT log_partitions_maintain('call_logs');
+SELECT log_partitions_maintain('sms_log');
+
+COMMIT;
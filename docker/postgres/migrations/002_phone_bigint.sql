@@ -0,0 +1,133 @@
+-- Миграция: phone_number -> BIGINT (E.164 без '+', как phones.parse_phone())
+--
+-- Для БД, созданных до перехода на числовые номера: CREATE TABLE IF NOT
+-- EXISTS в init.sql не меняет тип существующих столбцов, а приложение
+-- передаёт номера числами (phone_number = ANY(%s) с массивом int и т.п.).
+--
+-- Применяется после 001_partition_logs.sql, одной транзакцией; повторный
+-- запуск ничего не делает:
+--   docker compose exec -T postgres psql -U phone_user -d phone_campaigns \
+--       -v ON_ERROR_STOP=1 < docker/postgres/migrations/002_phone_bigint.sql
+--
+-- Номера приводятся к каноническому виду: '+7 (916) 123-45-67',
+-- '89161234567' и '9161234567' -> 79161234567. Строки с номером, который
+-- не разбирается, удаляются (их число - в NOTICE).
+
+BEGIN;
+
+-- Те же правила, что phones.parse_phone(); NULL - не номер
+CREATE FUNCTION pg_temp.phone_to_bigint(p TEXT)
+RETURNS BIGINT AS $$
+DECLARE
+    digits TEXT := regexp_replace(COALESCE(p, ''), '[^0-9]', '', 'g');
+BEGIN
+    IF left(btrim(COALESCE(p, '')), 1) <> '+' THEN
+        IF length(digits) = 10 THEN
+            digits := '7' || digits;
+        ELSIF length(digits) = 11 AND left(digits, 1) = '8' THEN
+            digits := '7' || substr(digits, 2);
+        END IF;
+    END IF;
+    IF length(digits) NOT BETWEEN 10 AND 15 OR left(digits, 1) = '0' THEN
+        RETURN NULL;
+    END IF;
+    RETURN digits::bigint;
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+DO $$
+DECLARE
+    tbl TEXT;
+    removed BIGINT;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY['campaign_numbers', 'call_logs', 'sms_log', 'contact_history'] LOOP
+        IF to_regclass(tbl) IS NULL THEN
+            RAISE NOTICE '%: таблицы нет', tbl;
+            CONTINUE;
+        END IF;
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = tbl
+              AND column_name = 'phone_number') = 'bigint' THEN
+            RAISE NOTICE '%: phone_number уже BIGINT', tbl;
+            CONTINUE;
+        END IF;
+
+        IF tbl = 'campaign_numbers' THEN
+            -- Удаляемые номера уходят и из total_numbers (campaign_status_counts
+            -- поправит триггер на DELETE)
+            UPDATE campaigns c
+            SET total_numbers = GREATEST(0, c.total_numbers - d.invalid)
+            FROM (
+                SELECT campaign_id, COUNT(*) AS invalid
+                FROM campaign_numbers
+                WHERE pg_temp.phone_to_bigint(phone_number) IS NULL
+                GROUP BY campaign_id
+            ) d
+            WHERE c.id = d.campaign_id;
+        END IF;
+
+        IF tbl = 'contact_history' THEN
+            -- Записи одного номера в разном написании ('8916...', '+7916...')
+            -- сливаются в одну: контакты всех записей, последний контакт - наибольший
+            UPDATE contact_history h
+            SET recent_contacts = ARRAY(
+                    SELECT DISTINCT t
+                    FROM contact_history o, unnest(o.recent_contacts) AS t
+                    WHERE pg_temp.phone_to_bigint(o.phone_number) = pg_temp.phone_to_bigint(h.phone_number)
+                    ORDER BY t DESC
+                ),
+                last_contact_at = (
+                    SELECT MAX(o.last_contact_at) FROM contact_history o
+                    WHERE pg_temp.phone_to_bigint(o.phone_number) = pg_temp.phone_to_bigint(h.phone_number)
+                )
+            WHERE EXISTS (
+                SELECT 1 FROM contact_history o
+                WHERE o.phone_number <> h.phone_number
+                  AND pg_temp.phone_to_bigint(o.phone_number) = pg_temp.phone_to_bigint(h.phone_number)
+            );
+
+            DELETE FROM contact_history h
+            USING contact_history o
+            WHERE o.phone_number > h.phone_number
+              AND pg_temp.phone_to_bigint(o.phone_number) = pg_temp.phone_to_bigint(h.phone_number);
+        END IF;
+
+        -- Нераспознанный номер BIGINT не вместит
+        EXECUTE format('DELETE FROM %I WHERE pg_temp.phone_to_bigint(phone_number) IS NULL', tbl);
+        GET DIAGNOSTICS removed = ROW_COUNT;
+        IF removed > 0 THEN
+            RAISE NOTICE '%: удалено % строк с некорректным номером', tbl, removed;
+        END IF;
+
+        -- Индексы по phone_number перестраиваются, партиции меняются вместе с таблицей
+        EXECUTE format('ALTER TABLE %I ALTER COLUMN phone_number TYPE BIGINT '
+                       'USING pg_temp.phone_to_bigint(phone_number)', tbl);
+        RAISE NOTICE '%: phone_number -> BIGINT', tbl;
+    END LOOP;
+END;
+$$;
+
+-- detect_operator(VARCHAR) заменяется версией для BIGINT, а не остаётся перегрузкой
+DROP FUNCTION IF EXISTS detect_operator(VARCHAR);
+
+-- Функция для определения оператора по номеру
+CREATE OR REPLACE FUNCTION detect_operator(phone BIGINT)
+RETURNS VARCHAR(50) AS $$
+DECLARE
+    phone_prefix VARCHAR(10);
+    operator_name VARCHAR(50);
+BEGIN
+    -- Первые 3 цифры после 7: 79161234567 / 10^7 % 1000 -> 916
+    phone_prefix := (phone / 10000000 % 1000)::text;
+
+    -- Ищем оператора
+    SELECT operator INTO operator_name
+    FROM operator_ranges
+    WHERE prefix = phone_prefix
+    LIMIT 1;
+
+    RETURN COALESCE(operator_name, 'Неизвестно');
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,142 @@
+-- Миграция: резервирование слотов SIM в БД (reserve_sim_slot)
+--
+-- Для БД, созданных до перехода sim_capacity.py на счётчики в БД: процесс
+-- выбирает SIM по копии счётчиков в памяти, а резервирует её атомарно через
+-- reserve_sim_slot(). reserve_sim() теперь тоже обнуляет calls_today с
+-- началом нового дня.
+--
+-- Применяется после 002_phone_bigint.sql, одной транзакцией; повторный
+-- запуск ничего не меняет:
+--   docker compose exec -T postgres psql -U phone_user -d phone_campaigns \
+--       -v ON_ERROR_STOP=1 < docker/postgres/migrations/003_sim_slots.sql
+
+BEGIN;
+
+-- Резервирование SIM для звонка за один запрос (FastAGI select_sim)
+-- Берёт наименее загруженную SIM с запасом по дневному и часовому лимиту:
+-- сначала того же оператора, затем любого - и сразу увеличивает её счётчики.
+-- Строка SIM блокируется до конца транзакции: параллельные резервирования
+-- берут другие SIM (SKIP LOCKED), а если свободных нет - ждут и перепроверяют
+-- лимиты после блокировки, поэтому лимиты не превышаются.
+-- calls_this_hour старше часа и calls_today за прошлые дни считаются нулём
+-- (как при обновлении счётчика).
+CREATE OR REPLACE FUNCTION reserve_sim(p_operator VARCHAR(50), p_now TIMESTAMP DEFAULT LOCALTIMESTAMP)
+RETURNS TABLE (reserved_sim INTEGER, reserved_operator VARCHAR(50)) AS $$
+DECLARE
+    candidate_id INTEGER;
+BEGIN
+    FOR attempt IN 1..3 LOOP
+        SELECT s.id INTO candidate_id
+        FROM sim_cards s
+        WHERE s.status = 'active'
+          AND CASE WHEN s.last_call_time >= date_trunc('day', p_now)
+                   THEN s.calls_today ELSE 0 END < s.daily_call_limit
+          AND CASE WHEN s.last_call_time > p_now - INTERVAL '1 hour'
+                   THEN s.calls_this_hour ELSE 0 END < s.hourly_call_limit
+        ORDER BY (s.operator = p_operator) IS TRUE DESC,
+                 s.calls_today, s.calls_this_hour, RANDOM()
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED;
+
+        IF candidate_id IS NULL THEN
+            -- Все подходящие SIM заняты параллельными резервированиями - ждём
+            SELECT s.id INTO candidate_id
+            FROM sim_cards s
+            WHERE s.status = 'active'
+              AND CASE WHEN s.last_call_time >= date_trunc('day', p_now)
+                       THEN s.calls_today ELSE 0 END < s.daily_call_limit
+              AND CASE WHEN s.last_call_time > p_now - INTERVAL '1 hour'
+                       THEN s.calls_this_hour ELSE 0 END < s.hourly_call_limit
+            ORDER BY (s.operator = p_operator) IS TRUE DESC,
+                     s.calls_today, s.calls_this_hour
+            LIMIT 1
+            FOR UPDATE;
+        END IF;
+
+        IF candidate_id IS NOT NULL THEN
+            RETURN QUERY
+            UPDATE sim_cards s
+            SET calls_today = CASE
+                    WHEN s.last_call_time >= date_trunc('day', p_now) THEN s.calls_today + 1
+                    ELSE 1
+                END,
+                calls_this_hour = CASE
+                    WHEN s.last_call_time > p_now - INTERVAL '1 hour' THEN s.calls_this_hour + 1
+                    ELSE 1
+                END,
+                last_call_time = p_now
+            WHERE s.id = candidate_id
+            RETURNING s.sim_number, s.operator;
+            RETURN;
+        END IF;
+        -- Пусто: подходящих SIM нет или дождались SIM, исчерпавшей лимит - ещё попытка
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Резервирование слота конкретной SIM: p_kind 'call' или 'sms'
+-- (sim_capacity.py - SIM выбрана по счётчикам в памяти, здесь атомарная
+-- проверка лимита и увеличение счётчиков в одном UPDATE: параллельные
+-- резервирования других процессов перепроверяются после блокировки строки).
+-- Возвращает признак резервирования и счётчики SIM после попытки - при
+-- отказе процесс обновляет по ним свою копию.
+CREATE OR REPLACE FUNCTION reserve_sim_slot(p_sim INTEGER, p_kind VARCHAR(10),
+                                            p_now TIMESTAMP DEFAULT LOCALTIMESTAMP)
+RETURNS TABLE (reserved BOOLEAN, slot_this_hour INTEGER, slot_today INTEGER,
+               slot_last_time TIMESTAMP) AS $$
+BEGIN
+    IF p_kind = 'sms' THEN
+        RETURN QUERY
+        UPDATE sim_cards s
+        SET sms_today = CASE
+                WHEN s.last_sms_time >= date_trunc('day', p_now) THEN s.sms_today + 1
+                ELSE 1
+            END,
+            sms_this_hour = CASE
+                WHEN s.last_sms_time > p_now - INTERVAL '1 hour' THEN s.sms_this_hour + 1
+                ELSE 1
+            END,
+            last_sms_time = p_now
+        WHERE s.sim_number = p_sim
+          AND s.status = 'active'
+          AND CASE WHEN s.last_sms_time >= date_trunc('day', p_now)
+                   THEN s.sms_today ELSE 0 END < s.daily_sms_limit
+          AND CASE WHEN s.last_sms_time > p_now - INTERVAL '1 hour'
+                   THEN s.sms_this_hour ELSE 0 END < s.hourly_sms_limit
+        RETURNING TRUE, s.sms_this_hour, s.sms_today, s.last_sms_time;
+
+        IF NOT FOUND THEN
+            RETURN QUERY
+            SELECT FALSE, s.sms_this_hour, s.sms_today, s.last_sms_time
+            FROM sim_cards s WHERE s.sim_number = p_sim;
+        END IF;
+    ELSE
+        RETURN QUERY
+        UPDATE sim_cards s
+        SET calls_today = CASE
+                WHEN s.last_call_time >= date_trunc('day', p_now) THEN s.calls_today + 1
+                ELSE 1
+            END,
+            calls_this_hour = CASE
+                WHEN s.last_call_time > p_now - INTERVAL '1 hour' THEN s.calls_this_hour + 1
+                ELSE 1
+            END,
+            last_call_time = p_now
+        WHERE s.sim_number = p_sim
+          AND s.status = 'active'
+          AND CASE WHEN s.last_call_time >= date_trunc('day', p_now)
+                   THEN s.calls_today ELSE 0 END < s.daily_call_limit
+          AND CASE WHEN s.last_call_time > p_now - INTERVAL '1 hour'
+                   THEN s.calls_this_hour ELSE 0 END < s.hourly_call_limit
+        RETURNING TRUE, s.calls_this_hour, s.calls_today, s.last_call_time;
+
+        IF NOT FOUND THEN
+            RETURN QUERY
+            SELECT FALSE, s.calls_this_hour, s.calls_today, s.last_call_time
+            FROM sim_cards s WHERE s.sim_number = p_sim;
+        END IF;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AMI Session Manager - постоянное подключение к Asterisk AMI
+
+Одна долгоживущая AMI-сессия на весь процесс вместо login/logout на каждый
+звонок. Исход звонка определяется по событиям OriginateResponse / DialEnd /
+Hangup, которые сопоставляются со звонком по ActionID (он же ChannelId
+исходящего канала, поэтому все события звонка несут его в Linkedid).
+"""
+
+import asyncio
+import re
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, Optional
+
+import panoramisk
+
+
+# DialStatus (событие DialEnd) -> статус номера в campaign_numbers
+DIAL_STATUS_MAP = {
+    'ANSWER': 'answered',
+    'BUSY': 'busy',
+    'NOANSWER': 'no_answer',
+    'CANCEL': 'no_answer',
+    'CONGESTION': 'failed',
+    'CHANUNAVAIL': 'failed',
+    'DONTCALL': 'failed',
+    'TORTURE': 'failed',
+    'INVALIDARGS': 'failed',
+}
+
+# Reason из OriginateResponse (Response: Failure) -> статус номера
+ORIGINATE_REASON_MAP = {
+    '1': 'failed',      # Hangup до ответа
+    '3': 'no_answer',   # Ringing, не ответили
+    '5': 'busy',
+    '8': 'failed',      # Congestion
+}
+
+# Hangup Cause (Q.850) -> статус номера (если DialEnd не пришёл)
+HANGUP_CAUSE_MAP = {
+    '17': 'busy',
+    '18': 'no_answer',
+    '19': 'no_answer',
+    '21': 'failed',
+    '34': 'failed',
+}
+
+# Статус номера -> статус в call_logs
+CALL_LOG_STATUS = {
+    'answered': 'ANSWER',
+    'busy': 'BUSY',
+    'no_answer': 'NOANSWER',
+    'failed': 'FAILED',
+}
+
+GOIP_LINE_RE = re.compile(r'goip-line(\d+)')
+
+
+class AMIError(Exception):
+    """Asterisk отклонил действие или AMI недоступен"""
+
+
+class PendingCall:
+    """Исходящий звонок, ожидающий финального события"""
+
+    def __init__(self, action_id: str, phone_number: str):
+        self.action_id = action_id
+        self.phone_number = phone_number
+        self.started_at = time.monotonic()
+        self.answered_at: Optional[float] = None
+        self.answer_time: Optional[datetime] = None
+        self.dial_status: Optional[str] = None
+        self.sim_number: Optional[int] = None
+        self.status: Optional[str] = None
+        self.outcome: asyncio.Future = asyncio.get_event_loop().create_future()
+
+    def finish(self, status: str, error: Optional[str] = None):
+        """Фиксирует исход звонка (повторные вызовы игнорируются)"""
+        if self.outcome.done():
+            return
+
+        duration = 0
+        if status == 'answered' and self.answered_at is not None:
+            duration = int(time.monotonic() - self.answered_at)
+
+        self.status = status
+        self.outcome.set_result({
+            'action_id': self.action_id,
+            'phone_number': self.phone_number,
+            'status': status,
+            'call_log_status': CALL_LOG_STATUS.get(status, 'FAILED'),
+            'dial_status': self.dial_status,
+            'answer_time': self.answer_time,
+            'duration': duration,
+            'sim_number': self.sim_number,
+            'error': error,
+        })
+
+
+class AMISessionManager:
+    """
+    Долгоживущая AMI-сессия с автоматическим переподключением
+
+    Использование:
+        call = await ami.originate('79991234567', 'message.wav')
+        outcome = await ami.wait_outcome(call)
+        # outcome['status'] in ('answered', 'busy', 'no_answer', 'failed')
+    """
+
+    def __init__(self, config: dict, originate_timeout: int = 60,
+                 reconnect_delay: float = 5.0):
+        self.config = config
+        self.originate_timeout = originate_timeout
+        self.reconnect_delay = reconnect_delay
+
+        self._manager: Optional[panoramisk.Manager] = None
+        self._connect_lock = asyncio.Lock()
+        self._calls: Dict[str, PendingCall] = {}
+        self._watchdog: Optional[asyncio.Task] = None
+        self._stopped = False
+
+    # ---------- подключение ----------
+
+    def _is_connected(self) -> bool:
+        protocol = getattr(self._manager, 'protocol', None) if self._manager else None
+        transport = getattr(protocol, 'transport', None)
+        return transport is not None and not transport.is_closing()
+
+    async def _connect(self):
+        """Подключение (или переподключение) к AMI"""
+        async with self._connect_lock:
+            if self._is_connected():
+                return
+
+            if self._manager is not None:
+                try:
+                    self._manager.close()
+                except Exception:
+                    pass
+
+            manager = panoramisk.Manager(
+                loop=asyncio.get_event_loop(),
+                reconnect_timeout=self.reconnect_delay,
+                **self.config
+            )
+            manager.register_event('OriginateResponse', self._on_originate_response)
+            manager.register_event('DialEnd', self._on_dial_end)
+            manager.register_event('Hangup', self._on_hangup)
+
+            await manager.connect()
+            self._manager = manager
+            print(f"[AMI] ✅ Подключено к {self.config['host']}:{self.config['port']}")
+
+    async def _watchdog_loop(self):
+        """Следит за соединением и истекшими звонками"""
+        while not self._stopped:
+            try:
+                if not self._is_connected():
+                    await self._connect()
+            except Exception as e:
+                print(f"[AMI] Ошибка подключения: {e}")
+
+            self._expire_calls()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def start(self):
+        """Запуск фонового поддержания сессии"""
+        self._stopped = False
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watchdog_loop())
+
+    async def stop(self):
+        """Закрытие сессии; незавершённые звонки помечаются failed"""
+        self._stopped = True
+        if self._watchdog:
+            self._watchdog.cancel()
+            self._watchdog = None
+
+        for call in list(self._calls.values()):
+            call.finish('failed', 'AMI session closed')
+        self._calls.clear()
+
+        if self._manager is not None:
+            self._manager.close()
+            self._manager = None
+
+    # ---------- звонки ----------
+
+    async def originate(self, phone_number: str, audio_file: Optional[str] = None,
+                        variables: Optional[Dict[str, str]] = None) -> PendingCall:
+        """
+        Отправляет Originate и регистрирует звонок для отслеживания
+
+        Raises:
+            AMIError: AMI недоступен или Asterisk отклонил действие
+        """
+        if not self._is_connected():
+            try:
+                await self._connect()
+            except Exception as e:
+                raise AMIError(f'AMI connection error: {e}')
+
+        action_id = f'call-{uuid.uuid4().hex}'
+        call = PendingCall(action_id, phone_number)
+        self._calls[action_id] = call
+
+        channel_vars = dict(variables or {})
+        if audio_file:
+            channel_vars['AUDIO_FILE'] = audio_file
+
+        action = {
+            'Action': 'Originate',
+            'ActionID': action_id,
+            'ChannelId': action_id,
+            'Channel': f'Local/{phone_number}@outbound-calls',
+            'Context': 'campaign-playback',
+            'Exten': 's',
+            'Priority': '1',
+            'Timeout': str(self.originate_timeout * 1000),
+            'CallerID': phone_number,
+            'Async': 'true',
+        }
+        if channel_vars:
+            action['Variable'] = ','.join(f'{k}={v}' for k, v in channel_vars.items())
+
+        try:
+            response = await self._manager.send_action(action)
+        except Exception as e:
+            self._calls.pop(action_id, None)
+            raise AMIError(f'AMI send error: {e}')
+
+        # panoramisk может вернуть как сам ответ, так и список сообщений
+        # вместе с OriginateResponse - обрабатываем их теми же обработчиками
+        messages = response if isinstance(response, list) else [response]
+        for message in messages:
+            if message.get('Event') == 'OriginateResponse':
+                self._on_originate_response(self._manager, message)
+            elif message.get('Response') == 'Error':
+                self._calls.pop(action_id, None)
+                call.finish('failed', message.get('Message'))
+                raise AMIError(message.get('Message') or 'Originate rejected')
+
+        return call
+
+    async def wait_outcome(self, call: PendingCall, timeout: Optional[float] = None) -> dict:
+        """Ожидает финальный исход звонка"""
+        if timeout is None:
+            # Время на дозвон + разумный запас на разговор
+            timeout = self.originate_timeout + 600
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(call.outcome), timeout)
+        except asyncio.TimeoutError:
+            self._calls.pop(call.action_id, None)
+            call.finish('answered' if call.answered_at else 'failed', 'Outcome timeout')
+            return call.outcome.result()
+
+    def _expire_calls(self):
+        """Закрывает звонки, по которым Asterisk так и не прислал событие"""
+        deadline = self.originate_timeout + 600
+        now = time.monotonic()
+        for action_id, call in list(self._calls.items()):
+            if now - call.started_at > deadline:
+                self._calls.pop(action_id, None)
+                call.finish('answered' if call.answered_at else 'failed', 'Outcome timeout')
+
+    # ---------- обработчики событий ----------
+
+    def _on_originate_response(self, manager, message):
+        call = self._calls.get(message.get('ActionID'))
+        if call is None:
+            return
+
+        if message.get('Response') == 'Failure':
+            self._calls.pop(call.action_id, None)
+            reason = str(message.get('Reason', ''))
+            status = DIAL_STATUS_MAP.get(call.dial_status) or ORIGINATE_REASON_MAP.get(reason, 'failed')
+            call.finish(status, f'Originate failure, reason {reason}')
+
+    def _on_dial_end(self, manager, message):
+        call = self._calls.get(message.get('Linkedid'))
+        if call is None or call.dial_status:
+            return
+
+        call.dial_status = message.get('DialStatus')
+        match = GOIP_LINE_RE.search(message.get('DestChannel', ''))
+        if match:
+            call.sim_number = int(match.group(1))
+
+        if call.dial_status == 'ANSWER':
+            call.answered_at = time.monotonic()
+            call.answer_time = datetime.now()
+
+    def _on_hangup(self, manager, message):
+        # Финализируем по завершению исходного канала (Local/...;1)
+        call = self._calls.get(message.get('Uniqueid'))
+        if call is None:
+            return
+
+        self._calls.pop(call.action_id, None)
+        if call.dial_status:
+            status = DIAL_STATUS_MAP.get(call.dial_status, 'failed')
+        else:
+            status = HANGUP_CAUSE_MAP.get(str(message.get('Cause', '')), 'failed')
+        call.finish(status)
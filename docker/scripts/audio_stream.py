@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Отдача аудиофайлов без буферизации целиком в памяти
+
+- Файл есть на общем томе /audio - отдаём с диска кусками (FileResponse),
+  с поддержкой Range (перемотка в плеере, докачка)
+- Файла нет локально - проксируем из tts-service потоком через общий
+  httpx.AsyncClient, заголовок Range передаётся дальше
+Память на один запрос ограничена размером куска, а не размером файла.
+"""
+
+import os
+from typing import Optional, Tuple
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+CHUNK_SIZE = 64 * 1024
+
+AUDIO_MEDIA_TYPES = {
+    '.wav': 'audio/wav',
+    '.mp3': 'audio/mpeg',
+    '.ulaw': 'audio/basic',
+    '.alaw': 'audio/x-alaw-basic',
+    '.sln': 'audio/L16;rate=8000',
+    '.gsm': 'audio/x-gsm',
+}
+
+# Заголовки ответа tts-service, которые передаём клиенту
+PROXY_HEADERS = ('content-length', 'content-range', 'accept-ranges', 'last-modified', 'etag',
+                 'x-audio-filename', 'x-sentences')
+
+
+def media_type_for(filename: str) -> str:
+    return AUDIO_MEDIA_TYPES.get(os.path.splitext(filename)[1].lower(), 'application/octet-stream')
+
+
+def safe_audio_path(audio_dir: str, filename: str) -> str:
+    """Путь к файлу внутри audio_dir (без ../ и подкаталогов)"""
+    if not filename or os.path.basename(filename) != filename or filename.startswith('.'):
+        raise HTTPException(status_code=400, detail="Некорректное имя файла")
+    return os.path.join(audio_dir, filename)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    'bytes=start-end' -> (start, end) включительно; None - Range не задан
+
+    Поддерживается один диапазон (плееры браузеров другого не присылают).
+    ValueError - диапазон не удовлетворим (416).
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    spec = header[len('bytes='):].split(',')[0].strip()
+    start_str, _, end_str = spec.partition('-')
+
+    if not start_str:
+        # bytes=-500 - последние 500 байт
+        length = int(end_str)
+        if length <= 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, min(end, size - 1)
+
+
+def _read_range(path: str, start: int, end: int):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_response(path: str, filename: str, range_header: Optional[str] = None) -> Response:
+    """Ответ с файлом с диска (200 целиком или 206 по Range)"""
+    media_type = media_type_for(filename)
+    size = os.path.getsize(path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename={filename}",
+    }
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    headers.update({
+        "Content-Range": f"bytes {start}-{end}/{size}",
+        "Content-Length": str(end - start + 1),
+    })
+    return StreamingResponse(_read_range(path, start, end), status_code=206,
+                             media_type=media_type, headers=headers)
+
+
+async def proxy_response(client: httpx.AsyncClient, url: str, filename: str,
+                         range_header: Optional[str] = None, method: str = "GET",
+                         json: Optional[dict] = None, timeout: Optional[float] = None) -> Response:
+    """Потоковый прокси файла из tts-service (соединение возвращается в пул по окончании)"""
+    request_headers = {"Range": range_header} if range_header else {}
+    upstream = await client.send(
+        client.build_request(method, url, headers=request_headers, json=json,
+                             timeout=timeout if timeout is not None else client.timeout),
+        stream=True
+    )
+
+    if upstream.status_code not in (200, 206):
+        await upstream.aclose()
+        if upstream.status_code == 416:
+            return Response(status_code=416)
+        if upstream.status_code == 400:
+            raise HTTPException(status_code=400, detail="Invalid TTS request")
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() in PROXY_HEADERS}
+    headers["Content-Disposition"] = f"inline; filename={filename}"
+
+    return StreamingResponse(
+        upstream.aiter_raw(CHUNK_SIZE),
+        status_code=upstream.status_code,
+        media_type=media_type_for(filename),
+        headers=headers,
+        background=BackgroundTask(upstream.aclose)
+    )
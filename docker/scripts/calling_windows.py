@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Окна обзвона по местному времени и очереди номеров по часовым поясам
+
+Для кампаний с use_timezones номера кампании делятся на очереди по
+campaign_numbers.timezone. Номер выдаётся только из тех поясов, где сейчас
+местное время попадает в окно обзвона (call_window_start - call_window_end).
+Среди открытых поясов первым обслуживается тот, чьё окно закроется раньше,
+поэтому мощность уходит на пояса, которые можно обзванивать прямо сейчас.
+"""
+
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def parse_window_time(value, default: time) -> time:
+    """'09:00' / time / None -> time"""
+    if value is None:
+        return default
+    if isinstance(value, time):
+        return value
+    try:
+        return time.fromisoformat(str(value))
+    except ValueError:
+        return default
+
+
+class CallingWindow:
+    """Ежедневное окно обзвона по местному времени абонента"""
+
+    def __init__(self, start: time, end: time):
+        self.start = start
+        self.end = end
+
+    def _local_now(self, tz: ZoneInfo, now_utc: datetime) -> datetime:
+        return now_utc.astimezone(tz)
+
+    def _contains(self, t: time) -> bool:
+        if self.start <= self.end:
+            return self.start <= t < self.end
+        # Окно через полночь (например 22:00 - 02:00)
+        return t >= self.start or t < self.end
+
+    def is_open(self, tz: ZoneInfo, now_utc: datetime) -> bool:
+        return self._contains(self._local_now(tz, now_utc).time())
+
+    def _seconds_until(self, tz: ZoneInfo, now_utc: datetime, target: time) -> float:
+        local = self._local_now(tz, now_utc)
+        candidate = datetime.combine(local.date(), target, tzinfo=tz)
+        if candidate <= local:
+            candidate = datetime.combine(local.date() + timedelta(days=1), target, tzinfo=tz)
+        return (candidate - local).total_seconds()
+
+    def seconds_until_open(self, tz: ZoneInfo, now_utc: datetime) -> float:
+        if self.is_open(tz, now_utc):
+            return 0.0
+        return self._seconds_until(tz, now_utc, self.start)
+
+    def seconds_until_close(self, tz: ZoneInfo, now_utc: datetime) -> float:
+        if not self.is_open(tz, now_utc):
+            return 0.0
+        return self._seconds_until(tz, now_utc, self.end)
+
+
+class _ZoneQueue:
+    """Очередь номеров одного часового пояса (курсор по id + буфер)"""
+
+    def __init__(self, tz_name: Optional[str], tz: Optional[ZoneInfo]):
+        self.tz_name = tz_name
+        self.tz = tz
+        self.last_id = 0
+        self.buffer: List[dict] = []
+        self.exhausted = False
+
+
+class NumberFeed:
+    """
+    Источник pending-номеров для исполнителя кампании
+
+    Без часовых поясов - одна очередь по id. С часовыми поясами - очередь на
+    каждый timezone, выдача только из открытых окон.
+
+    next_number() возвращает (номер, None), (None, секунд_до_открытия_окна)
+    или (None, None), если pending-номеров не осталось.
+    """
+
+    def __init__(self, campaign_id: int, use_timezones: bool,
+                 window: Optional[CallingWindow] = None,
+                 default_timezone: str = 'Europe/Moscow', prefetch: int = 100):
+        self.campaign_id = campaign_id
+        self.use_timezones = use_timezones
+        self.window = window
+        self.default_tz = ZoneInfo(default_timezone)
+        self.prefetch = prefetch
+
+        self._zones: Dict[Optional[str], _ZoneQueue] = {}
+        self._discovered = False
+
+    # ---------- очереди ----------
+
+    def _resolve_tz(self, tz_name: Optional[str]) -> ZoneInfo:
+        if not tz_name:
+            return self.default_tz
+        try:
+            return ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            return self.default_tz
+
+    def _discover(self, cur):
+        """Находит часовые пояса, в которых ещё есть pending-номера"""
+        if not self.use_timezones:
+            self._zones.setdefault(None, _ZoneQueue(None, None)).exhausted = False
+            self._discovered = True
+            return
+
+        cur.execute("""
+            SELECT DISTINCT timezone FROM campaign_numbers
+            WHERE campaign_id = %s AND status = 'pending'
+        """, (self.campaign_id,))
+        for row in cur.fetchall():
+            tz_name = row['timezone']
+            zone = self._zones.get(tz_name)
+            if zone is None:
+                self._zones[tz_name] = _ZoneQueue(tz_name, self._resolve_tz(tz_name))
+            else:
+                zone.exhausted = False
+        self._discovered = True
+
+    def _fill(self, cur, zone: _ZoneQueue):
+        if not self.use_timezones:
+            cur.execute("""
+                SELECT id, phone_number, operator, timezone FROM campaign_numbers
+                WHERE campaign_id = %s AND status = 'pending' AND id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """, (self.campaign_id, zone.last_id, self.prefetch))
+        elif zone.tz_name is None:
+            cur.execute("""
+                SELECT id, phone_number, operator, timezone FROM campaign_numbers
+                WHERE campaign_id = %s AND status = 'pending'
+                  AND timezone IS NULL AND id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """, (self.campaign_id, zone.last_id, self.prefetch))
+        else:
+            cur.execute("""
+                SELECT id, phone_number, operator, timezone FROM campaign_numbers
+                WHERE campaign_id = %s AND status = 'pending'
+                  AND timezone = %s AND id > %s
+                ORDER BY id ASC
+                LIMIT %s
+            """, (self.campaign_id, zone.tz_name, zone.last_id, self.prefetch))
+
+        zone.buffer = cur.fetchall()
+        zone.exhausted = not zone.buffer
+
+    def _ordered_zones(self, now_utc: datetime) -> Tuple[List[_ZoneQueue], Optional[float]]:
+        """Открытые пояса (раньше закрывается - раньше в очереди) и ожидание до ближайшего открытия"""
+        active = [zone for zone in self._zones.values() if not zone.exhausted]
+        if not self.use_timezones or self.window is None:
+            return active, None
+
+        open_zones = []
+        next_open = None
+        for zone in active:
+            if self.window.is_open(zone.tz, now_utc):
+                open_zones.append((self.window.seconds_until_close(zone.tz, now_utc), zone))
+            else:
+                wait = self.window.seconds_until_open(zone.tz, now_utc)
+                next_open = wait if next_open is None else min(next_open, wait)
+
+        open_zones.sort(key=lambda item: item[0])
+        return [zone for _, zone in open_zones], next_open
+
+    # ---------- выдача ----------
+
+    def next_number(self, cur) -> Tuple[Optional[dict], Optional[float]]:
+        if not self._discovered:
+            self._discover(cur)
+
+        rediscovered = False
+        while True:
+            zones, next_open = self._ordered_zones(datetime.now(dt_timezone.utc))
+
+            for zone in zones:
+                if not zone.buffer:
+                    self._fill(cur, zone)
+                if zone.buffer:
+                    number = zone.buffer.pop(0)
+                    zone.last_id = number['id']
+                    return number, None
+
+            if next_open is not None:
+                return None, next_open
+
+            # Все очереди пусты - перепроверяем один раз (номера могли догрузить).
+            # Курсоры не сбрасываем: выданные номера могут ещё числиться pending,
+            # пока их результат лежит в write-behind буфере
+            if rediscovered:
+                return None, None
+            self._discover(cur)
+            rediscovered = True
+
+    def zone_summary(self) -> List[dict]:
+        """Состояние очередей (для логов)"""
+        now_utc = datetime.now(dt_timezone.utc)
+        return [
+            {
+                'timezone': zone.tz_name,
+                'open': zone.tz is None or self.window is None or self.window.is_open(zone.tz, now_utc),
+                'exhausted': zone.exhausted,
+            }
+            for zone in self._zones.values()
+        ]
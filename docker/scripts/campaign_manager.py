@@ -4,22 +4,38 @@
 Campaign Manager - API для управления телефонными кампаниями
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, Query
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import psycopg2
 import psycopg2.extras
-import panoramisk
 import asyncio
 import csv
 import io
 import os
-from datetime import datetime
+from datetime import datetime, time, timedelta
 import random
 import httpx
 
+from ami_manager import AMISessionManager, AMIError
+from sms_dispatcher import SMSDispatcher
+from write_behind import CampaignWriteBehind
+from scheduler import CampaignScheduler
+from calling_windows import CallingWindow, NumberFeed, parse_window_time
+from redial import RedialPolicy, RetryQueue
+from live_hub import LiveHub
+from audio_stream import file_response, proxy_response, safe_audio_path
+from fastagi import FastAGIServer, AGI_PORT
+from sim_selector import SimSelector
+from sim_capacity import SimCapacity
+from sim_routing import SimRouter
+from contact_frequency import ContactFrequency
+from suppression import SuppressionList
+from log_partitions import LogPartitions
+from phones import format_phone, parse_phone, phone_prefix
+
 app = FastAPI(title="Phone Campaign Manager API")
 
 # Монтируем статические файлы
@@ -40,7 +56,23 @@ AMI_CONFIG = {
     'secret': os.getenv('ASTERISK_AMI_SECRET', 'asterisk_secret')
 }
 
+# Одна AMI-сессия на весь процесс (см. ami_manager.py)
+ami_manager = AMISessionManager(AMI_CONFIG)
+
 TTS_SERVICE_URL = os.getenv('TTS_SERVICE_URL', 'http://tts-service:5000')
+AUDIO_DIR = os.getenv('AUDIO_DIR', '/audio')
+# Формат, в котором транк GoIP принимает звук (pjsip.conf: allow=ulaw,alaw)
+TELEPHONY_FORMAT = os.getenv('TELEPHONY_FORMAT', 'ulaw')
+
+# FastAGI: выбор SIM для Asterisk без запуска процесса на каждый звонок
+FASTAGI_PORT = int(os.getenv('FASTAGI_PORT', AGI_PORT))
+
+# Один пул соединений к TTS сервису на все запросы (закрывается в shutdown)
+tts_client = httpx.AsyncClient(
+    base_url=TTS_SERVICE_URL,
+    timeout=30.0,
+    limits=httpx.Limits(max_connections=20, max_keepalive_connections=10)
+)
 
 GOIP_CONFIG = {
     'host': os.getenv('GOIP_HOST', '192.168.8.1'),
@@ -49,6 +81,38 @@ GOIP_CONFIG = {
     'use_ssl': os.getenv('GOIP_SSL', 'false').lower() == 'true'
 }
 
+# Минимальный интервал между СМС с одной SIM (сек)
+SMS_MIN_INTERVAL = float(os.getenv('SMS_MIN_INTERVAL', 5))
+SIM_CHECKPOINT_INTERVAL = float(os.getenv('SIM_CHECKPOINT_INTERVAL', 30))  # запись счётчиков SIM (сек)
+SIM_COOLDOWN = float(os.getenv('SIM_COOLDOWN', 60))  # желательная пауза между звонками SIM (сек)
+
+# Исполнитель кампаний
+WRITE_BEHIND_INTERVAL = float(os.getenv('WRITE_BEHIND_INTERVAL', 2))  # сброс буфера (сек)
+STATUS_CHECK_INTERVAL = float(os.getenv('STATUS_CHECK_INTERVAL', 5))  # проверка паузы (сек)
+NUMBERS_PREFETCH = 100  # номеров за один SELECT
+STATS_RECHECK_INTERVAL = float(os.getenv('STATS_RECHECK_INTERVAL', 0))  # сверка счётчиков (сек, 0 - выкл.)
+
+# Списки и выгрузки
+MAX_PAGE_SIZE = 1000  # максимум записей на страницу
+EXPORT_BATCH_SIZE = 5000  # строк за одну выборку при выгрузке CSV
+
+# Окно обзвона по местному времени абонента (для кампаний с use_timezones)
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'Europe/Moscow')
+CALL_WINDOW_START = parse_window_time(os.getenv('CALL_WINDOW_START'), time(9, 0))
+CALL_WINDOW_END = parse_window_time(os.getenv('CALL_WINDOW_END'), time(21, 0))
+
+# Лимит контактов с номером по всем кампаниям (0 - без лимита)
+CONTACT_MAX_PER_WINDOW = int(os.getenv('CONTACT_MAX_PER_WINDOW', 3))
+CONTACT_WINDOW_HOURS = float(os.getenv('CONTACT_WINDOW_HOURS', 24))
+DEDUP_BATCH_SIZE = 10000  # номеров на один запрос дедупликации при загрузке
+SUPPRESSION_RELOAD_INTERVAL = float(os.getenv('SUPPRESSION_RELOAD_INTERVAL', 600))  # перечитывание стоп-листа (сек)
+
+# Отчёты по почасовым агрегатам (report_hourly): период по умолчанию (дней)
+REPORT_DEFAULT_DAYS = 30
+
+# Журналы call_logs / sms_log: помесячные партиции, месяцы старше - удаляются (0 - хранить всё)
+LOG_RETENTION_MONTHS = int(os.getenv('LOG_RETENTION_MONTHS', 12))
+
 
 # ============== MODELS ==============
 
@@ -64,6 +128,16 @@ class Campaign(BaseModel):
     scheduled_start_time: Optional[str] = None  # ISO format datetime string (UTC)
     use_timezones: bool = False
     timezone_mode: str = "none"  # none, manual, auto
+    call_window_start: Optional[str] = None  # HH:MM местного времени (по умолчанию CALL_WINDOW_START)
+    call_window_end: Optional[str] = None  # HH:MM местного времени (по умолчанию CALL_WINDOW_END)
+    # Повторные звонки при недозвоне (1 - без повторов)
+    max_attempts: int = 1
+    retry_busy_minutes: int = 10
+    retry_no_answer_minutes: int = 60
+    retry_failed_minutes: int = 30
+    retry_backoff: float = 1.0  # множитель паузы на каждую следующую попытку
+    retry_window_start: Optional[str] = None  # HH:MM местного времени (по умолчанию - окно обзвона)
+    retry_window_end: Optional[str] = None
 
 
 class CampaignNumbers(BaseModel):
@@ -83,6 +157,10 @@ class TTSRequest(BaseModel):
     speed: float = 1.0  # 0.5 - 2.0
 
 
+class TTSBatchRequest(BaseModel):
+    items: List[TTSRequest]
+
+
 class SMSTemplate(BaseModel):
     name: str
     text: str
@@ -95,6 +173,11 @@ class SMSRequest(BaseModel):
     sim_number: Optional[int] = None
 
 
+class SuppressionRequest(BaseModel):
+    phone_numbers: List[str]
+    reason: str = "opt_out"  # opt_out, blacklist, complaint
+
+
 # ============== DATABASE ==============
 
 def get_db():
@@ -102,125 +185,114 @@ def get_db():
     return psycopg2.connect(**DB_CONFIG)
 
 
-def detect_timezone_from_phone(phone_number: str, cursor):
+# Live-обновления веб-интерфейса: один опрос БД на всех зрителей (см. live_hub.py)
+live_hub = LiveHub(
+    {'campaigns': lambda: fetch_campaigns(), 'sims': lambda: fetch_sims()},
+    lambda campaign_ids: fetch_campaign_stats(campaign_ids)
+)
+
+# Буфер результатов кампаний: пишется пачками (см. write_behind.py)
+write_behind = CampaignWriteBehind(
+    get_db, flush_interval=WRITE_BEHIND_INTERVAL,
+    on_flush=live_hub.campaigns_changed
+)
+
+# Лимиты SIM: счётчики в БД, копия окон в памяти (см. sim_capacity.py)
+sim_capacity = SimCapacity(get_db, checkpoint_interval=SIM_CHECKPOINT_INTERVAL)
+
+# Партиции журналов: создание вперёд и удаление старых месяцев (см. log_partitions.py)
+log_partitions = LogPartitions(get_db, retention_months=LOG_RETENTION_MONTHS)
+
+# Стоп-лист номеров в памяти (см. suppression.py)
+suppression = SuppressionList(get_db, reload_interval=SUPPRESSION_RELOAD_INTERVAL)
+
+# Частота контактов с абонентом по всем кампаниям (см. contact_frequency.py)
+contact_frequency = ContactFrequency(
+    get_db, max_contacts=CONTACT_MAX_PER_WINDOW, window=CONTACT_WINDOW_HOURS * 3600
+)
+
+# AGI(agi://127.0.0.1:4573/select_sim,${EXTEN}) в extensions.conf (см. fastagi.py)
+# Выбор SIM по оценке: своя сеть, ASR по call_logs, запас лимитов (см. sim_routing.py)
+sim_router = SimRouter(get_db, sim_capacity, cooldown=SIM_COOLDOWN)
+
+sim_selector = SimSelector(DB_CONFIG, capacity=sim_capacity, router=sim_router)
+fastagi_server = FastAGIServer(port=FASTAGI_PORT)
+fastagi_server.route('select_sim', sim_selector.handle_agi)
+
+# Очереди СМС по SIM-картам с общим HTTP-клиентом (см. sms_dispatcher.py)
+sms_dispatcher = SMSDispatcher(
+    GOIP_CONFIG, get_db,
+    min_interval=SMS_MIN_INTERVAL,
+    on_campaign_result=write_behind.record_sms,
+    capacity=sim_capacity
+)
+
+
+def require_phone(value: str) -> int:
+    """Номер из запроса API -> канонический (phones.py); не номер - 400"""
+    phone = parse_phone(value)
+    if phone is None:
+        raise HTTPException(status_code=400, detail=f"Некорректный номер телефона: {value}")
+    return phone
+
+
+def detect_timezone_from_phone(phone_number: int, cursor):
     """
     Определить часовой пояс по префиксу номера телефона
 
     Args:
-        phone_number: Номер в формате 79991234567
+        phone_number: Канонический номер 79991234567
         cursor: Database cursor
 
     Returns:
         str: Timezone name (e.g. 'Europe/Moscow') или None
     """
-    # Извлекаем префикс (первые 3 цифры после +7)
-    if len(phone_number) >= 4:
-        prefix = phone_number[1:4]  # 79991234567 -> 999
+    prefix = str(phone_prefix(phone_number))  # 79991234567 -> 999
 
-        # Ищем в справочнике
-        cursor.execute("""
-            SELECT timezone FROM phone_prefix_info
-            WHERE prefix = %s
-            LIMIT 1
-        """, (prefix,))
+    # Ищем в справочнике
+    cursor.execute("""
+        SELECT timezone FROM phone_prefix_info
+        WHERE prefix = %s
+        LIMIT 1
+    """, (prefix,))
 
-        result = cursor.fetchone()
-        if result:
-            return result[0]
+    result = cursor.fetchone()
+    if result:
+        return result[0]
 
     return None  # Не найдено - вернём None
 
 
-# ============== ASTERISK AMI ==============
-
-async def make_call_via_ami(phone_number: str, audio_file: Optional[str] = None):
-    """
-    Инициирует звонок через Asterisk AMI
+def telephony_audio_file(audio_file: Optional[str]) -> Optional[str]:
     """
-    try:
-        manager = panoramisk.Manager(
-            loop=asyncio.get_event_loop(),
-            **AMI_CONFIG
-        )
+    message.wav -> message.ulaw, если tts-service подготовил телефонный вариант
 
-        await manager.connect()
-
-        # Originate call
-        response = await manager.send_action({
-            'Action': 'Originate',
-            'Channel': f'Local/{phone_number}@outbound-calls',
-            'Context': 'outbound-calls',
-            'Exten': phone_number,
-            'Priority': '1',
-            'Timeout': '60000',
-            'CallerID': phone_number,
-            'Async': 'true',
-            'Variable': f'AUDIO_FILE={audio_file}' if audio_file else ''
-        })
-
-        manager.close()
-
-        return {'success': True, 'response': str(response)}
+    Asterisk проигрывает его без перекодирования; нет варианта - имя без изменений.
+    """
+    if not audio_file:
+        return audio_file
+    native = f"{os.path.splitext(audio_file)[0]}.{TELEPHONY_FORMAT}"
+    if native != audio_file and os.path.exists(os.path.join(AUDIO_DIR, native)):
+        return native
+    return audio_file
 
-    except Exception as e:
-        return {'success': False, 'error': str(e)}
 
+# ============== ASTERISK AMI ==============
 
-async def send_sms_via_goip(phone_number: str, message: str, sim_number: int = 1):
+async def make_call_via_ami(phone_number: int, audio_file: Optional[str] = None):
     """
-    Отправить СМС через GoIP HTTP API
-
-    Args:
-        phone_number: Номер телефона (79991234567)
-        message: Текст сообщения (кириллица будет закодирована в URL)
-        sim_number: Номер SIM-карты (1-4)
+    Инициирует звонок через постоянную AMI-сессию
 
     Returns:
-        dict: {'success': True/False, 'response': str, 'error': str}
+        dict: {'success': True, 'call': PendingCall} или {'success': False, 'error': str}
+        Исход звонка ждём через ami_manager.wait_outcome(result['call'])
     """
     try:
-        protocol = 'https' if GOIP_CONFIG['use_ssl'] else 'http'
-        base_url = f"{protocol}://{GOIP_CONFIG['host']}"
-
-        # GoIP SMS API endpoint
-        # Формат: /default/en_US/send.html?username=admin&password=admin&smsnum=1&Memo=message&telnum=79991234567
-        url = f"{base_url}/default/en_US/send.html"
-
-        params = {
-            'username': GOIP_CONFIG['username'],
-            'password': GOIP_CONFIG['password'],
-            'smsnum': str(sim_number),
-            'Memo': message,
-            'telnum': phone_number
-        }
+        call = await ami_manager.originate(format_phone(phone_number), telephony_audio_file(audio_file))
+        return {'success': True, 'call': call, 'action_id': call.action_id}
 
-        async with httpx.AsyncClient(timeout=30.0, verify=False) as client:
-            response = await client.get(url, params=params)
-
-            # GoIP возвращает "send success" при успехе
-            if response.status_code == 200 and 'success' in response.text.lower():
-                return {
-                    'success': True,
-                    'response': response.text,
-                    'sim_number': sim_number
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f"GoIP response: {response.text}",
-                    'status_code': response.status_code
-                }
-
-    except httpx.RequestError as e:
-        return {
-            'success': False,
-            'error': f'GoIP connection error: {str(e)}'
-        }
-    except Exception as e:
-        return {
-            'success': False,
-            'error': f'SMS send error: {str(e)}'
-        }
+    except AMIError as e:
+        return {'success': False, 'error': str(e)}
 
 
 # ============== API ENDPOINTS ==============
@@ -242,31 +314,93 @@ async def api_root():
 
 
 @app.get("/api/campaigns")
-async def list_campaigns():
-    """Список всех кампаний"""
+async def list_campaigns(status: Optional[str] = None, limit: Optional[int] = None,
+                         cursor: Optional[int] = None):
+    """
+    Список кампаний (новые первыми)
+
+    GET /api/campaigns                          - все кампании
+    GET /api/campaigns?status=running&limit=50  - первая страница
+    GET /api/campaigns?limit=50&cursor=<next_cursor> - следующая страница
+    """
+    if limit is None:
+        return {"campaigns": fetch_campaigns(status)}
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    campaigns = fetch_campaigns(status, limit + 1, cursor)
+    has_more = len(campaigns) > limit
+    campaigns = campaigns[:limit]
+
+    return {
+        "campaigns": campaigns,
+        "next_cursor": campaigns[-1]['id'] if has_more else None
+    }
+
+
+def fetch_campaigns(status: Optional[str] = None, limit: Optional[int] = None,
+                    before_id: Optional[int] = None):
+    """Список кампаний (API и live-обновления); keyset-пагинация по id"""
+    conditions = []
+    params = []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if before_id is not None:
+        conditions.append("id < %s")
+        params.append(before_id)
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    limit_sql = "LIMIT %s" if limit is not None else ""
+    if limit is not None:
+        params.append(limit)
+
     conn = get_db()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    cur.execute("""
+    cur.execute(f"""
         SELECT id, name, description, status,
                total_numbers, processed_numbers,
                successful_calls, failed_calls,
                created_at, started_at, completed_at,
-               scheduled_start_time, use_timezones, timezone_mode
+               scheduled_start_time, use_timezones, timezone_mode,
+               call_window_start, call_window_end
         FROM campaigns
-        ORDER BY created_at DESC
-    """)
+        {where}
+        ORDER BY id DESC
+        {limit_sql}
+    """, params)
 
     campaigns = cur.fetchall()
     cur.close()
     conn.close()
 
-    return {"campaigns": campaigns}
+    return campaigns
 
 
 @app.post("/api/campaigns")
 async def create_campaign(campaign: Campaign):
     """Создать новую кампанию"""
+    call_window = (
+        parse_window_time(campaign.call_window_start, CALL_WINDOW_START),
+        parse_window_time(campaign.call_window_end, CALL_WINDOW_END),
+    )
+
+    # Окно повторов задаётся только целиком
+    retry_window = (
+        parse_window_time(campaign.retry_window_start, None),
+        parse_window_time(campaign.retry_window_end, None),
+    )
+    if None in retry_window:
+        retry_window = (None, None)
+
+    # Пустое окно никогда не открывается - кампания ждала бы его бесконечно
+    for name, (start, end) in (('call_window', call_window), ('retry_window', retry_window)):
+        if start is not None and start == end:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{name}: начало и конец окна совпадают ({start.strftime('%H:%M')})"
+            )
+
     conn = get_db()
     cur = conn.cursor()
 
@@ -287,15 +421,23 @@ async def create_campaign(campaign: Campaign):
             sms_on_no_answer, sms_on_success,
             send_sms_on_no_answer, send_sms_on_success,
             scheduled_start_time, use_timezones, timezone_mode,
+            call_window_start, call_window_end,
+            max_attempts, retry_busy_minutes, retry_no_answer_minutes, retry_failed_minutes,
+            retry_backoff, retry_window_start, retry_window_end,
             status
         )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                %s, %s, %s, %s, %s, %s, %s, %s)
         RETURNING id
     """, (
         campaign.name, campaign.description, campaign.campaign_type,
-        campaign.audio_file, campaign.sms_on_no_answer, campaign.sms_on_success,
+        telephony_audio_file(campaign.audio_file), campaign.sms_on_no_answer, campaign.sms_on_success,
         campaign.send_sms_on_no_answer, campaign.send_sms_on_success,
         scheduled_dt, campaign.use_timezones, campaign.timezone_mode,
+        *call_window,
+        max(1, campaign.max_attempts), campaign.retry_busy_minutes,
+        campaign.retry_no_answer_minutes, campaign.retry_failed_minutes, campaign.retry_backoff,
+        *retry_window,
         status
     ))
 
@@ -305,22 +447,34 @@ async def create_campaign(campaign: Campaign):
     cur.close()
     conn.close()
 
+    if status == 'scheduled':
+        scheduler.notify_changed(campaign_id)
+
     return {"campaign_id": campaign_id, "status": status}
 
 
 @app.post("/api/campaigns/{campaign_id}/numbers")
-async def add_numbers(campaign_id: int, file: UploadFile = File(...)):
+async def add_numbers(campaign_id: int, file: UploadFile = File(...), dedup: bool = True):
     """
     Загрузить список номеров из CSV файла
     Формат CSV:
     - Обязательная колонка: phone_number
     - Опциональная колонка: timezone (для timezone_mode='manual')
+
+    Номера приводятся к каноническому виду (79161234567, phones.py), строки
+    без корректного номера считаются в invalid.
+    Номера из стоп-листа и повторы внутри файла пропускаются всегда, а при
+    dedup=true - и номера, которые уже ждут звонка в этой или другой
+    незавершённой кампании.
+    contact_limited - номера, у которых сейчас исчерпан лимит контактов
+    (при обзвоне они будут отложены)
     """
     contents = await file.read()
     csv_data = io.StringIO(contents.decode('utf-8'))
 
     reader = csv.DictReader(csv_data)
     phone_numbers = []
+    invalid = 0
 
     conn = get_db()
     cur = conn.cursor()
@@ -340,7 +494,10 @@ async def add_numbers(campaign_id: int, file: UploadFile = File(...)):
         if 'phone_number' not in row:
             continue
 
-        phone = row['phone_number'].strip()
+        phone = parse_phone(row['phone_number'] or '')
+        if phone is None:
+            invalid += 1
+            continue
         timezone = None
 
         if use_timezones:
@@ -356,8 +513,33 @@ async def add_numbers(campaign_id: int, file: UploadFile = File(...)):
     if not phone_numbers:
         raise HTTPException(status_code=400, detail="Нет номеров в файле")
 
-    # Добавляем номера
+    unique = {}
+    suppressed = 0
     for phone, tz in phone_numbers:
+        if suppression.contains(phone):
+            suppressed += 1
+            continue
+        unique.setdefault(phone, tz)
+
+    if dedup:
+        # Номера в очереди незавершённых кампаний (по idx_phone)
+        phones = list(unique)
+        for i in range(0, len(phones), DEDUP_BATCH_SIZE):
+            cur.execute("""
+                SELECT DISTINCT cn.phone_number
+                FROM campaign_numbers cn
+                JOIN campaigns c ON c.id = cn.campaign_id
+                WHERE cn.phone_number = ANY(%s)
+                  AND cn.status IN ('pending', 'retry')
+                  AND c.status IN ('draft', 'scheduled', 'running', 'paused')
+            """, (phones[i:i + DEDUP_BATCH_SIZE],))
+            for (phone,) in cur.fetchall():
+                del unique[phone]
+
+    contact_limited = len(contact_frequency.wait_times(cur, unique))
+
+    # Добавляем номера
+    for phone, tz in unique.items():
         cur.execute("""
             INSERT INTO campaign_numbers (campaign_id, phone_number, timezone, status)
             VALUES (%s, %s, %s, 'pending')
@@ -368,11 +550,12 @@ async def add_numbers(campaign_id: int, file: UploadFile = File(...)):
     cur.execute("""
         UPDATE campaigns
         SET total_numbers = (
-            SELECT COUNT(*) FROM campaign_numbers
+            SELECT COALESCE(SUM(count), 0) FROM campaign_status_counts
             WHERE campaign_id = %s
-        )
+        ),
+        suppressed_numbers = suppressed_numbers + %s
         WHERE id = %s
-    """, (campaign_id, campaign_id))
+    """, (campaign_id, suppressed, campaign_id))
 
     conn.commit()
     cur.close()
@@ -380,11 +563,128 @@ async def add_numbers(campaign_id: int, file: UploadFile = File(...)):
 
     return {
         "campaign_id": campaign_id,
-        "numbers_added": len(phone_numbers),
+        "numbers_added": len(unique),
+        "duplicates_skipped": len(phone_numbers) - suppressed - len(unique),
+        "suppressed": suppressed,
+        "invalid": invalid,
+        "contact_limited": contact_limited,
         "status": "success"
     }
 
 
+# Поля номера в выдаче и в CSV-выгрузке
+NUMBER_EXPORT_FIELDS = (
+    'id', 'phone_number', 'operator', 'timezone', 'status', 'sim_used',
+    'call_attempts', 'last_attempt_time', 'answer_time', 'duration',
+    'sms_status', 'sms_sent_at', 'sms_text',
+)
+
+
+def numbers_filter(campaign_id: int, status: Optional[str] = None,
+                   operator: Optional[str] = None, timezone: Optional[str] = None,
+                   sim: Optional[int] = None):
+    """WHERE и параметры для выборки номеров кампании (индексы idx_cn_*)"""
+    conditions = ["campaign_id = %s"]
+    params = [campaign_id]
+    for column, value in (('status', status), ('operator', operator),
+                          ('timezone', timezone), ('sim_used', sim)):
+        if value is not None:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+    return ' AND '.join(conditions), params
+
+
+@app.get("/api/campaigns/{campaign_id}/numbers")
+async def list_numbers(campaign_id: int, status: Optional[str] = None,
+                       operator: Optional[str] = None, timezone: Optional[str] = None,
+                       sim: Optional[int] = None, cursor: int = 0, limit: int = 100):
+    """
+    Номера кампании с фильтрами и keyset-пагинацией по id
+
+    GET /api/campaigns/1/numbers?status=no_answer&operator=MTS&limit=100
+    GET /api/campaigns/1/numbers?status=no_answer&cursor=<next_cursor>
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    where, params = numbers_filter(campaign_id, status, operator, timezone, sim)
+
+    conn = get_db()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    cur.execute(f"""
+        SELECT {', '.join(NUMBER_EXPORT_FIELDS)}
+        FROM campaign_numbers
+        WHERE {where} AND id > %s
+        ORDER BY id ASC
+        LIMIT %s
+    """, params + [cursor, limit + 1])
+
+    numbers = cur.fetchall()
+    cur.close()
+    conn.close()
+
+    has_more = len(numbers) > limit
+    numbers = numbers[:limit]
+
+    return {
+        "campaign_id": campaign_id,
+        "numbers": numbers,
+        "next_cursor": numbers[-1]['id'] if has_more else None
+    }
+
+
+def export_numbers_csv(campaign_id: int, where: str, params: list):
+    """Генератор CSV: серверный курсор, память не зависит от размера кампании"""
+    conn = get_db()
+    cur = conn.cursor(name=f"export_campaign_{campaign_id}")
+    cur.itersize = EXPORT_BATCH_SIZE
+
+    try:
+        cur.execute(f"""
+            SELECT {', '.join(NUMBER_EXPORT_FIELDS)}
+            FROM campaign_numbers
+            WHERE {where}
+            ORDER BY id ASC
+        """, params)
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(NUMBER_EXPORT_FIELDS)
+
+        while True:
+            rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+            if not rows:
+                break
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue()
+    finally:
+        cur.close()
+        conn.close()
+
+
+@app.get("/api/campaigns/{campaign_id}/export")
+async def export_campaign(campaign_id: int, status: Optional[str] = None,
+                          operator: Optional[str] = None, timezone: Optional[str] = None,
+                          sim: Optional[int] = None):
+    """
+    Выгрузка результатов кампании в CSV (потоком)
+
+    GET /api/campaigns/1/export
+    GET /api/campaigns/1/export?status=answered
+    """
+    where, params = numbers_filter(campaign_id, status, operator, timezone, sim)
+
+    return StreamingResponse(
+        export_numbers_csv(campaign_id, where, params),
+        media_type="text/csv",
+        headers={"Content-Disposition": f"attachment; filename=campaign_{campaign_id}.csv"}
+    )
+
+
 @app.post("/api/campaigns/{campaign_id}/start")
 async def start_campaign(campaign_id: int):
     """Запустить кампанию"""
@@ -458,51 +758,82 @@ async def cancel_scheduled_campaign(campaign_id: int):
     cur.close()
     conn.close()
 
+    scheduler.notify_changed(campaign_id)
+
     return {"campaign_id": campaign_id, "status": "cancelled", "message": "Запланированный запуск отменён"}
 
 
 @app.get("/api/campaigns/{campaign_id}/stats")
 async def get_campaign_stats(campaign_id: int):
-    """Статистика кампании"""
+    """Статистика кампании (счётчики campaign_status_counts, без COUNT по номерам)"""
+    stats = fetch_campaign_stats([campaign_id]).get(campaign_id)
+
+    if not stats:
+        raise HTTPException(status_code=404, detail="Кампания не найдена")
+
+    return stats
+
+
+def fetch_campaign_stats(campaign_ids) -> dict:
+    """Статистика нескольких кампаний одним запросом: {campaign_id: stats}"""
     conn = get_db()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
     cur.execute("""
         SELECT
+            c.id,
             c.name,
             c.status,
             c.total_numbers,
             c.processed_numbers,
             c.successful_calls,
             c.failed_calls,
-            COUNT(CASE WHEN cn.status = 'pending' THEN 1 END) as pending,
-            COUNT(CASE WHEN cn.status = 'answered' THEN 1 END) as answered,
-            COUNT(CASE WHEN cn.status = 'no_answer' THEN 1 END) as no_answer,
-            COUNT(CASE WHEN cn.status = 'busy' THEN 1 END) as busy,
-            COUNT(CASE WHEN cn.status = 'failed' THEN 1 END) as failed
+            COALESCE(SUM(s.count) FILTER (WHERE s.status = 'pending'), 0) as pending,
+            COALESCE(SUM(s.count) FILTER (WHERE s.status = 'answered'), 0) as answered,
+            COALESCE(SUM(s.count) FILTER (WHERE s.status = 'no_answer'), 0) as no_answer,
+            COALESCE(SUM(s.count) FILTER (WHERE s.status = 'busy'), 0) as busy,
+            COALESCE(SUM(s.count) FILTER (WHERE s.status = 'failed'), 0) as failed
         FROM campaigns c
-        LEFT JOIN campaign_numbers cn ON c.id = cn.campaign_id
-        WHERE c.id = %s
+        LEFT JOIN campaign_status_counts s ON c.id = s.campaign_id
+        WHERE c.id = ANY(%s)
         GROUP BY c.id
-    """, (campaign_id,))
+    """, (list(campaign_ids),))
 
-    stats = cur.fetchone()
+    stats = {row['id']: row for row in cur.fetchall()}
     cur.close()
     conn.close()
 
-    if not stats:
-        raise HTTPException(status_code=404, detail="Кампания не найдена")
-
     return stats
 
 
+@app.post("/api/campaigns/{campaign_id}/stats/recheck")
+async def recheck_campaign_stats(campaign_id: int):
+    """Сверить счётчики статусов с campaign_numbers и исправить расхождения"""
+    conn = get_db()
+    cur = conn.cursor()
+
+    cur.execute("SELECT campaign_status_counts_recheck(%s)", (campaign_id,))
+    fixed = cur.fetchone()[0]
+
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    return {"campaign_id": campaign_id, "fixed_statuses": fixed}
+
+
 @app.post("/api/call")
 async def make_call(call: CallRequest):
     """Выполнить один звонок"""
-    result = await make_call_via_ami(call.phone_number, call.audio_file)
+    phone = require_phone(call.phone_number)
+    result = await make_call_via_ami(phone, call.audio_file)
 
     if result['success']:
-        return {"status": "calling", "phone_number": call.phone_number}
+        return {
+            "status": "calling",
+            "phone_number": phone,
+            "action_id": result['action_id']
+        }
     else:
         raise HTTPException(status_code=500, detail=result['error'])
 
@@ -510,6 +841,68 @@ async def make_call(call: CallRequest):
 @app.get("/api/sims")
 async def get_sims_status():
     """Статус всех SIM-карт"""
+    return {"sims": fetch_sims()}
+
+
+@app.get("/api/sims/capacity")
+async def get_sims_capacity():
+    """
+    Загрузка SIM по скользящим окнам и ближайшие свободные слоты
+
+    GET /api/sims/capacity
+    """
+    call_sim, call_wait = sim_capacity.next_available('call')
+    sms_sim, sms_wait = sim_capacity.next_available('sms')
+    return {
+        "sims": sim_capacity.status(),
+        "next_call_slot": {"sim_number": call_sim,
+                           "in_seconds": None if call_sim is None else round(call_wait, 1)},
+        "next_sms_slot": {"sim_number": sms_sim,
+                          "in_seconds": None if sms_sim is None else round(sms_wait, 1)},
+    }
+
+
+@app.get("/api/contacts/frequency")
+async def get_contact_frequency(phone: Optional[str] = None):
+    """
+    Лимит контактов по всем кампаниям; с phone - когда номеру можно звонить
+
+    GET /api/contacts/frequency?phone=79161234567
+    """
+    result = contact_frequency.status()
+    if phone:
+        phone_number = require_phone(phone)
+        conn = get_db()
+        cur = conn.cursor()
+        wait = contact_frequency.wait_time(cur, phone_number)
+        cur.close()
+        conn.close()
+        result['phone'] = {"phone_number": phone_number, "next_contact_in": round(wait, 1)}
+    return result
+
+
+@app.get("/api/logs/partitions")
+async def get_log_partitions():
+    """
+    Партиции журналов call_logs / sms_log и их размер
+
+    GET /api/logs/partitions
+    """
+    return {"retention_months": LOG_RETENTION_MONTHS, "partitions": log_partitions.status()}
+
+
+@app.get("/api/sims/routing")
+async def get_sims_routing(operator: Optional[str] = None):
+    """
+    Оценки SIM для звонка на абонента оператора (лучшая первой)
+
+    GET /api/sims/routing?operator=МТС
+    """
+    return {"operator": operator, "candidates": sim_router.rank(operator)}
+
+
+def fetch_sims():
+    """Состояние SIM-карт (API и live-обновления)"""
     conn = get_db()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
@@ -526,7 +919,22 @@ async def get_sims_status():
     cur.close()
     conn.close()
 
-    return {"sims": sims}
+    return sims
+
+
+@app.get("/api/events")
+async def live_events(request: Request):
+    """
+    Live-обновления для веб-интерфейса (Server-Sent Events)
+
+    GET /api/events
+    События: campaigns, sims, campaign_delta, campaign_stats, scheduler
+    """
+    return StreamingResponse(
+        live_hub.stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 # ============== TTS ENDPOINTS ==============
@@ -543,28 +951,109 @@ async def generate_tts(request: TTSRequest):
     }
     """
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            # Формируем тело запроса, не отправляем filename если он None
-            payload = {
-                "text": request.text,
-                "voice": request.voice,
-                "speed": request.speed
-            }
-            if request.filename:
-                payload["filename"] = request.filename
+        # Формируем тело запроса, не отправляем filename если он None
+        payload = {
+            "text": request.text,
+            "voice": request.voice,
+            "speed": request.speed
+        }
+        if request.filename:
+            payload["filename"] = request.filename
+
+        response = await tts_client.post("/api/tts/generate", json=payload, timeout=30.0)
 
-            response = await client.post(
-                f"{TTS_SERVICE_URL}/api/tts/generate",
-                json=payload
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"TTS service error: {response.text}"
             )
 
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"TTS service error: {response.text}"
-                )
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"TTS service unavailable: {str(e)}"
+        )
+
+
+@app.post("/api/tts/stream")
+async def stream_tts(request: TTSRequest):
+    """
+    Синтез длинного сообщения с отдачей потоком (первый звук - после первого предложения)
+
+    POST /api/tts/stream
+    {"text": "Длинное объявление. Из нескольких предложений.", "filename": "announcement.wav"}
+    """
+    payload = {
+        "text": request.text,
+        "voice": request.voice,
+        "speed": request.speed
+    }
+    if request.filename:
+        payload["filename"] = request.filename
+
+    try:
+        return await proxy_response(
+            tts_client, "/api/tts/stream", request.filename or "speech.wav",
+            method="POST", json=payload
+        )
+
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"TTS service unavailable: {str(e)}"
+        )
+
+
+@app.post("/api/tts/batch")
+async def create_tts_batch(request: TTSBatchRequest):
+    """
+    Пакетная генерация голосовых сообщений (задание в фоне)
+
+    POST /api/tts/batch
+    {"items": [{"text": "...", "filename": "order_1.wav", "voice": "ruslan", "speed": 1.0}, ...]}
+    """
+    try:
+        response = await tts_client.post(
+            "/api/tts/batch",
+            json={"items": [item.model_dump(exclude_none=True) for item in request.items]},
+            timeout=30.0
+        )
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail=f"TTS service error: {response.text}"
+            )
+
+    except httpx.RequestError as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"TTS service unavailable: {str(e)}"
+        )
+
+
+@app.get("/api/tts/batch/{job_id}")
+async def get_tts_batch(job_id: str, include_items: bool = True):
+    """
+    Прогресс пакетной генерации
+
+    GET /api/tts/batch/{job_id}
+    """
+    try:
+        response = await tts_client.get(
+            f"/api/tts/batch/{job_id}",
+            params={"include_items": str(include_items).lower()},
+            timeout=10.0
+        )
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise HTTPException(status_code=response.status_code, detail="Задание не найдено")
 
     except httpx.RequestError as e:
         raise HTTPException(
@@ -574,23 +1063,23 @@ async def generate_tts(request: TTSRequest):
 
 
 @app.get("/api/tts/files")
-async def list_tts_files():
+async def list_tts_files(request: Request):
     """
-    Список всех сгенерированных аудио файлов
+    Список сгенерированных аудио файлов (постранично, фильтры voice, q, text)
 
-    GET /api/tts/files
+    GET /api/tts/files?voice=irina&q=заказ&limit=50&cursor=<next_cursor>
     """
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(f"{TTS_SERVICE_URL}/api/tts/files")
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Failed to get file list"
-                )
+        response = await tts_client.get("/api/tts/files", params=dict(request.query_params),
+                                        timeout=10.0)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail="Failed to get file list"
+            )
 
     except httpx.RequestError as e:
         raise HTTPException(
@@ -600,25 +1089,21 @@ async def list_tts_files():
 
 
 @app.get("/api/tts/audio/{filename}")
-async def get_tts_audio(filename: str):
+async def get_tts_audio(filename: str, request: Request):
     """
-    Получить аудио файл из TTS сервиса
+    Получить аудио файл (потоком, с поддержкой Range)
 
     GET /api/tts/audio/message.wav
+    Файл отдаётся с общего тома /audio; если его там нет - проксируется из TTS сервиса
     """
+    file_path = safe_audio_path(AUDIO_DIR, filename)
+    range_header = request.headers.get("range")
+
+    if os.path.isfile(file_path):
+        return file_response(file_path, filename, range_header)
+
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(f"{TTS_SERVICE_URL}/api/tts/audio/{filename}")
-
-            if response.status_code == 200:
-                from fastapi.responses import Response
-                return Response(
-                    content=response.content,
-                    media_type="audio/wav",
-                    headers={"Content-Disposition": f"inline; filename={filename}"}
-                )
-            else:
-                raise HTTPException(status_code=404, detail="Audio file not found")
+        return await proxy_response(tts_client, f"/api/tts/audio/{filename}", filename, range_header)
 
     except httpx.RequestError as e:
         raise HTTPException(
@@ -635,16 +1120,15 @@ async def get_tts_voices():
     GET /api/tts/voices
     """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{TTS_SERVICE_URL}/api/tts/voices")
-
-            if response.status_code == 200:
-                return response.json()
-            else:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail="Failed to get voices"
-                )
+        response = await tts_client.get("/api/tts/voices", timeout=5.0)
+
+        if response.status_code == 200:
+            return response.json()
+        else:
+            raise HTTPException(
+                status_code=response.status_code,
+                detail="Failed to get voices"
+            )
 
     except httpx.RequestError as e:
         raise HTTPException(
@@ -661,19 +1145,18 @@ async def check_tts_health():
     GET /api/tts/health
     """
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{TTS_SERVICE_URL}/health")
-
-            if response.status_code == 200:
-                data = response.json()
-                data['url'] = TTS_SERVICE_URL
-                return data
-            else:
-                return {
-                    "status": "unhealthy",
-                    "url": TTS_SERVICE_URL,
-                    "error": response.text
-                }
+        response = await tts_client.get("/health", timeout=5.0)
+
+        if response.status_code == 200:
+            data = response.json()
+            data['url'] = TTS_SERVICE_URL
+            return data
+        else:
+            return {
+                "status": "unhealthy",
+                "url": TTS_SERVICE_URL,
+                "error": response.text
+            }
 
     except httpx.RequestError as e:
         return {
@@ -815,42 +1298,18 @@ async def send_sms(sms: SMSRequest):
         "sim_number": 1
     }
     """
-    # Определяем SIM-карту если не указана
-    sim_number = sms.sim_number if sms.sim_number else 1
-
-    # Отправляем СМС через GoIP
-    result = await send_sms_via_goip(sms.phone_number, sms.message, sim_number)
+    # SIM выбирается по оператору абонента, если не указана явно
+    phone = require_phone(sms.phone_number)
+    result = await sms_dispatcher.send(phone, sms.message, sms.sim_number)
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # Определяем статус
-    status = 'sent' if result['success'] else 'failed'
-
-    # Логируем в sms_log
-    cur.execute("""
-        INSERT INTO sms_log (phone_number, sim_number, message, status, sent_at)
-        VALUES (%s, %s, %s, %s, %s)
-        RETURNING id
-    """, (
-        sms.phone_number,
-        sim_number,
-        sms.message,
-        status,
-        datetime.now() if result['success'] else None
-    ))
-
-    sms_id = cur.fetchone()[0]
-
-    conn.commit()
-    cur.close()
-    conn.close()
+    sim_number = result.get('sim_number')
+    sms_id = result.get('sms_id')
 
     if result['success']:
         return {
             "sms_id": sms_id,
             "status": "sent",
-            "phone_number": sms.phone_number,
+            "phone_number": phone,
             "sim_number": sim_number,
             "goip_response": result.get('response', '')
         }
@@ -861,249 +1320,519 @@ async def send_sms(sms: SMSRequest):
         )
 
 
-# ============== BACKGROUND TASKS ==============
+# ============== REPORTS ==============
 
-async def process_campaign(campaign_id: int):
+# Разрезы отчётов: значение group_by -> выражение по report_hourly
+REPORT_DIMENSIONS = {
+    'hour': 'hour',
+    'day': "date_trunc('day', hour)",
+    'hour_of_day': 'EXTRACT(HOUR FROM hour)::integer',
+    'campaign': 'campaign_id',
+    'sim': 'sim_number',
+    'operator': 'operator',
+    'timezone': 'timezone',
+    'outcome': 'outcome',
+}
+
+
+def parse_report_time(value: Optional[str], default: datetime) -> datetime:
+    if not value:
+        return default
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректная дата: {value}")
+
+
+def rollup_report(group_by: str, date_from: Optional[str], date_to: Optional[str],
+                  campaign_id: Optional[int] = None, sim: Optional[int] = None,
+                  operator: Optional[str] = None, timezone: Optional[str] = None) -> dict:
     """
-    Фоновая задача для обработки кампании
-    Поддерживает: звонки, СМС, звонки+СМС
-    С антидетект-логикой (рандомные интервалы)
+    Звонки, ответы, доля ответов и средняя длительность разговора
+    в разрезах group_by - только по report_hourly
     """
+    dimensions = [d.strip() for d in group_by.split(',') if d.strip()]
+    unknown = [d for d in dimensions if d not in REPORT_DIMENSIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Неизвестный разрез: {', '.join(unknown)} (допустимые: {', '.join(REPORT_DIMENSIONS)})"
+        )
+
+    now = datetime.now()
+    since = parse_report_time(date_from, now - timedelta(days=REPORT_DEFAULT_DAYS))
+    until = parse_report_time(date_to, now)
+
+    conditions = ["hour >= %s", "hour < %s"]
+    params = [since, until]
+    for column, value in (('campaign_id', campaign_id), ('sim_number', sim),
+                          ('operator', operator), ('timezone', timezone)):
+        if value is not None:
+            conditions.append(f"{column} = %s")
+            params.append(value)
+
+    columns = [f"{REPORT_DIMENSIONS[d]} AS {d}" for d in dimensions]
+    group = f"GROUP BY {', '.join(dimensions)} ORDER BY {', '.join(dimensions)}" if dimensions else ""
+
     conn = get_db()
     cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-    while True:
-        # Проверяем статус кампании
-        cur.execute("""
-            SELECT status, audio_file, campaign_type,
-                   sms_on_no_answer, sms_on_success,
-                   send_sms_on_no_answer, send_sms_on_success
-            FROM campaigns WHERE id = %s
-        """, (campaign_id,))
+    cur.execute(f"""
+        SELECT {''.join(c + ', ' for c in columns)}
+               SUM(calls) AS calls,
+               COALESCE(SUM(calls) FILTER (WHERE outcome = 'answered'), 0) AS answered,
+               ROUND(COALESCE(SUM(calls) FILTER (WHERE outcome = 'answered'), 0)::numeric
+                     / NULLIF(SUM(calls), 0), 4)::float AS answer_rate,
+               ROUND(SUM(duration) FILTER (WHERE outcome = 'answered')::numeric
+                     / NULLIF(SUM(calls) FILTER (WHERE outcome = 'answered'), 0), 1)::float AS avg_duration
+        FROM report_hourly
+        WHERE {' AND '.join(conditions)}
+        {group}
+    """, params)
+    rows = cur.fetchall()
 
-        campaign = cur.fetchone()
+    cur.close()
+    conn.close()
 
-        if not campaign or campaign['status'] != 'running':
-            break
+    return {"from": since, "to": until, "group_by": dimensions, "rows": rows}
 
-        # Берем следующий номер
-        cur.execute("""
-            SELECT id, phone_number FROM campaign_numbers
-            WHERE campaign_id = %s AND status = 'pending'
-            ORDER BY id ASC
-            LIMIT 1
-        """, (campaign_id,))
 
-        number = cur.fetchone()
+@app.get("/api/reports/calls")
+async def report_calls(group_by: str = "day", date_from: Optional[str] = Query(None, alias="from"),
+                       date_to: Optional[str] = Query(None, alias="to"),
+                       campaign_id: Optional[int] = None, sim: Optional[int] = None,
+                       operator: Optional[str] = None, timezone: Optional[str] = None):
+    """
+    Отчёт по звонкам из почасовых агрегатов
 
-        if not number:
-            # Кампания завершена
-            cur.execute("""
-                UPDATE campaigns
-                SET status = 'completed', completed_at = %s
-                WHERE id = %s
-            """, (datetime.now(), campaign_id))
-            conn.commit()
-            break
+    group_by - через запятую: hour, day, hour_of_day, campaign, sim, operator, timezone, outcome
+    GET /api/reports/calls?group_by=operator,hour_of_day&from=2026-09-19
+    GET /api/reports/calls?group_by=outcome&campaign_id=1
+    """
+    return rollup_report(group_by, date_from, date_to, campaign_id, sim, operator, timezone)
 
-        # Обрабатываем номер в зависимости от типа кампании
-        campaign_type = campaign['campaign_type']
-        call_success = False
-        sms_sent = False
 
-        # ========== ЗВОНКИ ==========
-        if campaign_type in ['call', 'call_and_sms']:
-            # Выполняем звонок
-            cur.execute("""
-                UPDATE campaign_numbers
-                SET status = 'calling', last_attempt_time = %s, call_attempts = call_attempts + 1
-                WHERE id = %s
-            """, (datetime.now(), number['id']))
-            conn.commit()
+@app.get("/api/reports/sims")
+async def report_sims(date_from: Optional[str] = Query(None, alias="from"),
+                      date_to: Optional[str] = Query(None, alias="to"),
+                      operator: Optional[str] = None):
+    """
+    Звонки и доля ответов по SIM-картам (и операторам абонентов)
 
-            # Звоним
-            result = await make_call_via_ami(number['phone_number'], campaign['audio_file'])
+    GET /api/reports/sims?from=2026-10-01&operator=МТС
+    """
+    return rollup_report("sim,operator", date_from, date_to, operator=operator)
 
-            # Обновляем статус звонка
-            new_status = 'answered' if result['success'] else 'no_answer'
-            call_success = result['success']
 
-            cur.execute("""
-                UPDATE campaign_numbers
-                SET status = %s
-                WHERE id = %s
-            """, (new_status, number['id']))
+# ============== SUPPRESSION (СТОП-ЛИСТ) ==============
 
-            # Обновляем счетчики звонков
-            cur.execute("""
-                UPDATE campaigns
-                SET processed_numbers = processed_numbers + 1,
-                    successful_calls = successful_calls + CASE WHEN %s = 'answered' THEN 1 ELSE 0 END,
-                    failed_calls = failed_calls + CASE WHEN %s = 'no_answer' THEN 1 ELSE 0 END
-                WHERE id = %s
-            """, (new_status, new_status, campaign_id))
-            conn.commit()
+@app.get("/api/suppression")
+async def get_suppression(phone: Optional[str] = None):
+    """
+    Размер стоп-листа; с phone - есть ли номер в стоп-листе
 
-        # ========== СМС ==========
-        # Отправляем СМС если:
-        # 1. Тип кампании = 'sms' (только СМС)
-        # 2. Тип = 'call_and_sms' + недозвон + включена опция send_sms_on_no_answer
-        # 3. Тип = 'call_and_sms' + успешный звонок + включена опция send_sms_on_success
+    GET /api/suppression?phone=79161234567
+    """
+    result = suppression.status()
+    if phone:
+        key = require_phone(phone)
+        result['phone'] = {"phone_number": key, "suppressed": suppression.contains(key)}
+    return result
 
-        sms_text = None
 
-        if campaign_type == 'sms':
-            # Только СМС кампания - отправляем всегда
-            sms_text = campaign['sms_on_no_answer'] or campaign['sms_on_success'] or "SMS-сообщение"
+def count_phones(phone_numbers: list) -> dict:
+    """Разбор списка номеров: уникальные канонические, нераспознанные, повторы"""
+    keys = [parse_phone(p) for p in phone_numbers]
+    valid = [key for key in keys if key is not None]
+    unique = set(valid)
+    return {"unique": unique, "invalid": len(keys) - len(valid), "duplicates": len(valid) - len(unique)}
 
-        elif campaign_type == 'call_and_sms':
-            # Звонок + СМС
-            if not call_success and campaign['send_sms_on_no_answer']:
-                # Недозвон -> отправляем СМС при недозвоне
-                sms_text = campaign['sms_on_no_answer']
-            elif call_success and campaign['send_sms_on_success']:
-                # Успешный звонок -> отправляем СМС при успехе
-                sms_text = campaign['sms_on_success']
 
-        # Отправляем СМС если есть текст
-        if sms_text:
-            # Определяем SIM-карту (используем ту же что для звонка, или первую доступную)
-            sim_number = 1  # TODO: улучшить выбор SIM по оператору
+@app.post("/api/suppression")
+async def add_suppression(request: SuppressionRequest):
+    """
+    Добавить номера в стоп-лист
 
-            sms_result = await send_sms_via_goip(number['phone_number'], sms_text, sim_number)
-            sms_sent = sms_result['success']
+    POST /api/suppression
+    {"phone_numbers": ["79161234567"], "reason": "opt_out"}
+    """
+    counts = count_phones(request.phone_numbers)
+    added = await suppression.add(counts['unique'], reason=request.reason, source='api')
+    return {
+        "numbers_added": added,
+        "already_suppressed": len(counts['unique']) - added,
+        "duplicates": counts['duplicates'],
+        "invalid": counts['invalid'],
+    }
 
-            # Обновляем статус СМС в campaign_numbers
-            cur.execute("""
-                UPDATE campaign_numbers
-                SET sms_status = %s,
-                    sms_sent_at = %s,
-                    sms_text = %s
-                WHERE id = %s
-            """, (
-                'sent' if sms_sent else 'failed',
-                datetime.now() if sms_sent else None,
-                sms_text,
-                number['id']
-            ))
-
-            # Обновляем счетчики СМС в кампании
-            cur.execute("""
-                UPDATE campaigns
-                SET sms_sent = sms_sent + CASE WHEN %s THEN 1 ELSE 0 END,
-                    sms_failed = sms_failed + CASE WHEN NOT %s THEN 1 ELSE 0 END
-                WHERE id = %s
-            """, (sms_sent, sms_sent, campaign_id))
 
-            # Логируем в sms_log
-            cur.execute("""
-                INSERT INTO sms_log (campaign_id, phone_number, sim_number, message, status, sent_at)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
-                campaign_id,
-                number['phone_number'],
-                sim_number,
-                sms_text,
-                'sent' if sms_sent else 'failed',
-                datetime.now() if sms_sent else None
-            ))
+@app.post("/api/suppression/upload")
+async def upload_suppression(file: UploadFile = File(...), reason: str = "opt_out"):
+    """
+    Массовая загрузка стоп-листа из CSV (колонка phone_number)
 
-            conn.commit()
+    POST /api/suppression/upload?reason=blacklist
+    """
+    contents = await file.read()
+    reader = csv.DictReader(io.StringIO(contents.decode('utf-8')))
+    phones = [row['phone_number'] for row in reader if row.get('phone_number')]
 
-        # Если только СМС кампания и мы только что отправили СМС, обновляем счетчик processed
-        if campaign_type == 'sms':
-            cur.execute("""
-                UPDATE campaigns
-                SET processed_numbers = processed_numbers + 1
-                WHERE id = %s
-            """, (campaign_id,))
-            conn.commit()
+    if not phones:
+        raise HTTPException(status_code=400, detail="Нет номеров в файле")
+
+    counts = count_phones(phones)
+    loaded = await suppression.load(counts['unique'], reason=reason, source=file.filename)
+    return {
+        "numbers_loaded": loaded,
+        "already_suppressed": len(counts['unique']) - loaded,
+        "duplicates": counts['duplicates'],
+        "invalid": counts['invalid'],
+        "total": len(suppression),
+    }
+
+
+@app.delete("/api/suppression/{phone}")
+async def delete_suppression(phone: str):
+    """
+    Убрать номер из стоп-листа
 
-        # Антидетект: случайная пауза (45 сек - 3 мин)
-        delay = random.uniform(45, 180)
+    DELETE /api/suppression/79161234567
+    """
+    key = require_phone(phone)
+    if not await suppression.remove([key]):
+        raise HTTPException(status_code=404, detail="Номера нет в стоп-листе")
+    return {"phone_number": key, "status": "deleted"}
 
-        # 15% шанс длинной паузы (5-15 мин)
-        if random.random() < 0.15:
-            delay += random.uniform(300, 900)
 
-        await asyncio.sleep(delay)
+@app.get("/api/suppression/report")
+async def get_suppression_report():
+    """
+    Отсеянные стоп-листом номера по кампаниям: при загрузке и при обзвоне
+
+    GET /api/suppression/report
+    """
+    conn = get_db()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    cur.execute("""
+        SELECT c.id AS campaign_id, c.name, c.status,
+               c.suppressed_numbers AS suppressed_at_upload,
+               COALESCE(s.count, 0) AS suppressed_at_dial
+        FROM campaigns c
+        LEFT JOIN campaign_status_counts s
+            ON s.campaign_id = c.id AND s.status = 'suppressed'
+        WHERE c.suppressed_numbers > 0 OR s.count > 0
+        ORDER BY c.id DESC
+    """)
+    campaigns = cur.fetchall()
 
     cur.close()
     conn.close()
 
+    return {"campaigns": campaigns}
+
 
-# ==============================================================================
-# ПЛАНИРОВЩИК - Автоматический запуск запланированных кампаний
-# ==============================================================================
+# ============== BACKGROUND TASKS ==============
 
-async def check_scheduled_campaigns():
+async def process_campaign(campaign_id: int):
     """
-    Фоновая задача: проверяет каждую минуту запланированные кампании
-    и запускает их если пришло время
+    Фоновая задача для обработки кампании
+    Поддерживает: звонки, СМС, звонки+СМС
+    С антидетект-логикой (рандомные интервалы)
+
+    Результаты по номерам пишутся через write_behind (пачками), номера
+    выдаёт NumberFeed: порциями по NUMBERS_PREFETCH с курсором по id, а при
+    use_timezones - из очередей по часовым поясам с открытым окном обзвона.
+    Недозвоны при max_attempts > 1 получают время повтора (RedialPolicy),
+    наступившие повторы RetryQueue выдаёт вперёд новых номеров
     """
-    while True:
-        try:
-            conn = get_db()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+    conn = get_db()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
 
-            # Найти кампании со статусом 'scheduled' и временем запуска <= NOW()
-            cur.execute("""
-                SELECT id, name, scheduled_start_time
-                FROM campaigns
-                WHERE status = 'scheduled'
-                  AND scheduled_start_time IS NOT NULL
-                  AND scheduled_start_time <= NOW()
-                ORDER BY scheduled_start_time ASC
-            """)
+    campaign = None
+    status_checked_at = 0.0
+    feed = None
+    retries = None
+    policy = None
+    retries_active = False  # опрашивать ли RetryQueue
+
+    try:
+        while True:
+            # Проверяем статус кампании (не чаще раза в STATUS_CHECK_INTERVAL)
+            loop_time = asyncio.get_event_loop().time()
+            if campaign is None or loop_time - status_checked_at >= STATUS_CHECK_INTERVAL:
+                cur.execute("""
+                    SELECT status, audio_file, campaign_type,
+                           sms_on_no_answer, sms_on_success,
+                           send_sms_on_no_answer, send_sms_on_success,
+                           use_timezones, call_window_start, call_window_end,
+                           max_attempts, retry_busy_minutes, retry_no_answer_minutes,
+                           retry_failed_minutes, retry_backoff,
+                           retry_window_start, retry_window_end
+                    FROM campaigns WHERE id = %s
+                """, (campaign_id,))
+                campaign = cur.fetchone()
+                conn.commit()
+                status_checked_at = loop_time
+
+                if not campaign or campaign['status'] != 'running':
+                    break
+
+            if feed is None:
+                window = CallingWindow(
+                    parse_window_time(campaign['call_window_start'], CALL_WINDOW_START),
+                    parse_window_time(campaign['call_window_end'], CALL_WINDOW_END)
+                )
+                feed = NumberFeed(
+                    campaign_id, campaign['use_timezones'], window,
+                    default_timezone=DEFAULT_TIMEZONE, prefetch=NUMBERS_PREFETCH
+                )
+                # Повторы - в своём окне, иначе в окне обзвона (если кампания по поясам)
+                retry_window = None
+                if campaign['retry_window_start'] and campaign['retry_window_end']:
+                    retry_window = CallingWindow(campaign['retry_window_start'], campaign['retry_window_end'])
+                elif campaign['use_timezones']:
+                    retry_window = window
+                policy = RedialPolicy.from_campaign(campaign, retry_window, DEFAULT_TIMEZONE)
+                retries = RetryQueue(campaign_id, prefetch=NUMBERS_PREFETCH)
+                retries_active = retries_active or policy.enabled
+
+            # Звонки: ждём ближайший свободный слот SIM, а не звоним в исчерпанные лимиты
+            if campaign['campaign_type'] in ['call', 'call_and_sms']:
+                # (нет активных SIM - лимиты не ведутся, линия по умолчанию из dialplan)
+                sim_number, wait = sim_capacity.next_available('call')
+                if sim_number is not None and wait > 0:
+                    print(f"[Campaign #{campaign_id}] Лимиты SIM исчерпаны, ближайший слот "
+                          f"(SIM#{sim_number}) через {int(wait)} сек")
+                    await asyncio.sleep(min(wait, 300))
+                    campaign = None  # перед продолжением перечитываем статус
+                    continue
+
+            # Берем следующий номер: сначала наступившие повторы, потом новые
+            number, retry_wait = None, None
+            if retries_active:
+                number, retry_wait = retries.next_number(cur)
+            wait = None
+            if number is None:
+                number, wait = feed.next_number(cur)
+            conn.commit()
 
-            campaigns_to_start = cur.fetchall()
+            if number is None and wait is not None:
+                # Во всех оставшихся поясах сейчас нерабочее время
+                if retry_wait is not None:
+                    wait = min(wait, retry_wait)
+                print(f"[Campaign #{campaign_id}] Окна обзвона закрыты, ближайшее через {int(wait)} сек")
+                await asyncio.sleep(min(wait, 300))
+                campaign = None  # перед продолжением перечитываем статус
+                continue
+
+            if number is None and retry_wait is not None:
+                # Новые номера кончились, остались отложенные повторы
+                print(f"[Campaign #{campaign_id}] Ожидание повторов, ближайший через {int(retry_wait)} сек")
+                await asyncio.sleep(min(retry_wait, 300))
+                campaign = None  # перед продолжением перечитываем статус
+                continue
+
+            if number is None:
+                # Кампания завершена - сначала фиксируем буфер результатов
+                await write_behind.flush()
+                # (последние исходы из буфера могли назначить повторы,
+                # номера могли быть отложены лимитом контактов до паузы)
+                if retries.has_retries(cur):
+                    conn.commit()
+                    retries_active = True
+                    continue
+                cur.execute("""
+                    UPDATE campaigns
+                    SET status = 'completed', completed_at = %s
+                    WHERE id = %s AND status = 'running'
+                """, (datetime.now(), campaign_id))
+                conn.commit()
+                break
+
+            # Номер попал в стоп-лист уже после загрузки
+            if suppression.contains(number['phone_number']):
+                write_behind.record_processed(campaign_id, number['id'], status='suppressed')
+                continue
+
+            # Лимит контактов по всем кампаниям: номер откладывается, а не пропускается
+            contact_wait = contact_frequency.wait_time(cur, number['phone_number'])
+            conn.commit()
+            if contact_wait > 0:
+                write_behind.record_deferred(number['id'], datetime.now() + timedelta(seconds=contact_wait))
+                retries_active = True
+                continue
+
+            # Обрабатываем номер в зависимости от типа кампании
+            campaign_type = campaign['campaign_type']
+            call_success = False
+            next_attempt_at = None
+
+            # ========== ЗВОНКИ ==========
+            if campaign_type in ['call', 'call_and_sms']:
+                # Звоним и ждём реальный исход по событиям AMI
+                result = await make_call_via_ami(number['phone_number'], campaign['audio_file'])
+
+                if result['success']:
+                    contact_frequency.record(number['phone_number'])
+                    outcome = await ami_manager.wait_outcome(result['call'])
+                else:
+                    outcome = {
+                        'status': 'failed', 'call_log_status': 'FAILED',
+                        'answer_time': None, 'duration': 0,
+                        'sim_number': None, 'error': result['error']
+                    }
+
+                call_success = outcome['status'] == 'answered'
+                if not call_success:
+                    next_attempt_at = policy.next_attempt(
+                        outcome['status'], (number.get('call_attempts') or 0) + 1, number.get('timezone')
+                    )
+                write_behind.record_call(campaign_id, number, outcome, next_attempt_at=next_attempt_at)
+                sim_router.observe(outcome['sim_number'], number.get('operator'), call_success)
+
+            # ========== СМС ==========
+            # Отправляем СМС если:
+            # 1. Тип кампании = 'sms' (только СМС)
+            # 2. Тип = 'call_and_sms' + недозвон + включена опция send_sms_on_no_answer
+            # 3. Тип = 'call_and_sms' + успешный звонок + включена опция send_sms_on_success
+
+            sms_text = None
+
+            if campaign_type == 'sms':
+                # Только СМС кампания - отправляем всегда
+                sms_text = campaign['sms_on_no_answer'] or campaign['sms_on_success'] or "SMS-сообщение"
+
+            elif campaign_type == 'call_and_sms':
+                # Звонок + СМС
+                if not call_success and campaign['send_sms_on_no_answer'] and next_attempt_at is None:
+                    # Недозвон (после последней попытки) -> отправляем СМС при недозвоне
+                    sms_text = campaign['sms_on_no_answer']
+                elif call_success and campaign['send_sms_on_success']:
+                    # Успешный звонок -> отправляем СМС при успехе
+                    sms_text = campaign['sms_on_success']
+
+            # Ставим СМС в очередь SIM; результат попадёт в write_behind
+            if sms_text:
+                if campaign_type == 'sms':
+                    contact_frequency.record(number['phone_number'])
+                sms_dispatcher.submit(
+                    number['phone_number'], sms_text,
+                    campaign_id=campaign_id, number_id=number['id']
+                )
 
-            if campaigns_to_start:
-                print(f"[Scheduler] Найдено {len(campaigns_to_start)} кампаний для запуска")
+            # СМС-кампании темп задают лимиты SIM в диспетчере, а не паузы цикла
+            if campaign_type == 'sms':
+                write_behind.record_processed(campaign_id, number['id'])
+                await sms_dispatcher.wait_for_capacity()
+                continue
 
-            for campaign in campaigns_to_start:
-                campaign_id = campaign['id']
-                campaign_name = campaign['name']
-                scheduled_time = campaign['scheduled_start_time']
+            # Антидетект: случайная пауза (45 сек - 3 мин)
+            delay = random.uniform(45, 180)
 
-                print(f"[Scheduler] Запуск кампании #{campaign_id} '{campaign_name}' (запланировано на {scheduled_time})")
+            # 15% шанс длинной паузы (5-15 мин)
+            if random.random() < 0.15:
+                delay += random.uniform(300, 900)
 
-                try:
-                    # Меняем статус на 'running' и записываем started_at
-                    cur.execute("""
-                        UPDATE campaigns
-                        SET status = 'running',
-                            started_at = NOW()
-                        WHERE id = %s
-                    """, (campaign_id,))
+            await asyncio.sleep(delay)
 
-                    conn.commit()
+    finally:
+        # Пауза/остановка: результаты уже обработанных номеров не теряем
+        await write_behind.flush()
+        cur.close()
+        conn.close()
 
-                    print(f"[Scheduler] ✅ Кампания #{campaign_id} успешно запущена")
 
-                    # Запускаем процесс обзвона в фоне
-                    asyncio.create_task(process_campaign(campaign_id))
+# ==============================================================================
+# ПЛАНИРОВЩИК - Автоматический запуск запланированных кампаний
+# ==============================================================================
 
-                except Exception as e:
-                    print(f"[Scheduler] ❌ Ошибка запуска кампании #{campaign_id}: {e}")
-                    conn.rollback()
+async def recheck_stats_loop():
+    """
+    Фоновая сверка счётчиков статусов (STATS_RECHECK_INTERVAL > 0)
+    Проверяются только незавершённые кампании
+    """
+    while True:
+        await asyncio.sleep(STATS_RECHECK_INTERVAL)
+        try:
+            conn = get_db()
+            cur = conn.cursor()
+
+            cur.execute("""
+                SELECT id FROM campaigns
+                WHERE status IN ('running', 'paused', 'scheduled', 'draft')
+            """)
+            for (campaign_id,) in cur.fetchall():
+                cur.execute("SELECT campaign_status_counts_recheck(%s)", (campaign_id,))
+                fixed = cur.fetchone()[0]
+                conn.commit()
+                if fixed:
+                    print(f"[Stats] Кампания #{campaign_id}: исправлено счётчиков - {fixed}")
 
             cur.close()
             conn.close()
 
         except Exception as e:
-            print(f"[Scheduler] Ошибка в планировщике: {e}")
+            print(f"[Stats] Ошибка сверки счётчиков: {e}")
 
-        # Проверять каждые 60 секунд
-        await asyncio.sleep(60)
+
+def start_campaign_task(campaign_id: int):
+    """Запускает процесс обзвона в фоне (колбэк планировщика)"""
+    asyncio.create_task(process_campaign(campaign_id))
+    live_hub.publish('scheduler', {'event': 'started', 'campaign_id': campaign_id})
+
+
+# Запланированные кампании: очередь в памяти + LISTEN/NOTIFY (см. scheduler.py)
+scheduler = CampaignScheduler(get_db, on_start=start_campaign_task)
 
 
 @app.on_event("startup")
 async def startup_event():
     """Запуск фоновых задач при старте приложения"""
+    print("[Startup] Подключение к Asterisk AMI...")
+    await ami_manager.start()
+    await log_partitions.start()
+    await write_behind.start()
+    await contact_frequency.start()
+    await suppression.start()
+    await sim_capacity.start()
+    await sim_router.start()
+    await sms_dispatcher.start()
+
+    await sim_selector.start()
+    await fastagi_server.start()
+    print(f"[Startup] ✅ FastAGI слушает порт {FASTAGI_PORT} (select_sim)")
+
     print("[Startup] Запуск планировщика кампаний...")
-    asyncio.create_task(check_scheduled_campaigns())
-    print("[Startup] ✅ Планировщик запущен (проверка каждые 60 сек)")
+    await scheduler.start()
+    print("[Startup] ✅ Планировщик запущен (LISTEN campaign_schedule)")
+
+    if STATS_RECHECK_INTERVAL > 0:
+        asyncio.create_task(recheck_stats_loop())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Корректное закрытие долгоживущих подключений"""
+    await scheduler.stop()
+    await live_hub.stop()
+    await ami_manager.stop()
+    # Результаты звонков - в БД до остановки СМС: stop() диспетчера ограничен
+    # drain_timeout, но буфер не должен зависеть от него
+    try:
+        await write_behind.flush()
+    except Exception as e:
+        print(f"[Shutdown] Ошибка сброса write-behind буфера: {e}")
+    await sms_dispatcher.stop()
+    await write_behind.stop()
+    await contact_frequency.stop()
+    await suppression.stop()
+    await log_partitions.stop()
+    await fastagi_server.stop()
+    sim_selector.close()
+    await sim_router.stop()
+    await sim_capacity.stop()
+    await tts_client.aclose()
 
 
 # ============== RUN ==============
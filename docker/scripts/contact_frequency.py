@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Contact Frequency - ограничение частоты контактов с абонентом по всем кампаниям
+
+Правило: не больше max_contacts контактов (звонок или СМС-рассылка) на
+номер за window секунд, сколько бы кампаний его ни содержали.
+
+- contact_history (init.sql): по строке на номер - время последнего
+  контакта и массив последних max_contacts контактов
+- Перед таблицей - Bloom-фильтр номеров с контактами в пределах окна:
+  для номера, которого в фильтре нет (большинство номеров новой базы),
+  проверка - несколько хэшей в памяти, без БД. Только "возможно был
+  контакт" уточняется одним запросом по первичному ключу (пачкой для
+  загрузки CSV)
+- Контакты этого процесса копятся в памяти и раз в flush_interval секунд
+  пишутся в contact_history одним upsert
+- Bloom-фильтр не умеет удалять, поэтому раз в rebuild_interval он
+  строится заново из contact_history - номера, вышедшие из окна, уходят
+"""
+
+import asyncio
+import hashlib
+import math
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+import psycopg2.extras
+
+DAY = 86400.0
+
+
+class BloomFilter:
+    """Bloom-фильтр номеров (двойное хэширование blake2b)"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.capacity = max(1, capacity)
+        self.size = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: int):
+        digest = hashlib.blake2b(key.to_bytes(8, 'little'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: int):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class ContactFrequency:
+    """
+    Использование:
+        contacts = ContactFrequency(get_db, max_contacts=3)
+        await contacts.start()
+        wait = contacts.wait_time(cur, 79161234567)   # 0 - можно звонить
+        contacts.record(79161234567)
+    """
+
+    def __init__(self, get_db: Callable, max_contacts: int = 3, window: float = DAY,
+                 flush_interval: float = 5.0, rebuild_interval: float = 3600.0,
+                 error_rate: float = 0.01, min_capacity: int = 100000):
+        self.get_db = get_db
+        self.max_contacts = max_contacts
+        self.window = window
+        self.flush_interval = flush_interval
+        self.rebuild_interval = rebuild_interval
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+
+        self._bloom = BloomFilter(min_capacity, error_rate)
+        self._pending: Dict[int, List[float]] = {}  # ещё не записанные контакты
+        self._inflight: Dict[int, List[float]] = {}  # пишутся прямо сейчас
+        self._rebuilt_at = 0.0
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_contacts > 0
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        try:
+            await self.rebuild()
+        except Exception as e:
+            print(f"[Contacts] Не удалось загрузить историю контактов: {e}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                # Фильтр переполнен (растёт доля ложных срабатываний) или пора чистить окно
+                if (time.monotonic() - self._rebuilt_at >= self.rebuild_interval
+                        or self._bloom.count > self._bloom.capacity):
+                    await self.rebuild()
+            except Exception as e:
+                print(f"[Contacts] Ошибка записи истории контактов: {e}")
+
+    # ---------- Bloom-фильтр ----------
+
+    def _build(self, cutoff: datetime) -> BloomFilter:
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM contact_history WHERE last_contact_at >= %s", (cutoff,))
+        total = cur.fetchone()[0]
+        cur.close()
+
+        bloom = BloomFilter(max(self.min_capacity, total * 2), self.error_rate)
+        # Серверный курсор: номера идут порциями, а не одним списком в памяти
+        named = conn.cursor(name='contact_history_scan')
+        named.itersize = 50000
+        named.execute("SELECT phone_number FROM contact_history WHERE last_contact_at >= %s", (cutoff,))
+        for (phone_number,) in named:
+            bloom.add(phone_number)
+        named.close()
+        conn.close()
+        return bloom
+
+    async def rebuild(self):
+        """Фильтр заново из contact_history (номера с контактом в пределах окна)"""
+        async with self._flush_lock:
+            cutoff = datetime.fromtimestamp(time.time() - self.window)
+            bloom = await asyncio.to_thread(self._build, cutoff)
+            # Незаписанные контакты в таблицу ещё не попали
+            for phone_number in self._pending:
+                bloom.add(phone_number)
+            self._bloom = bloom
+            self._rebuilt_at = time.monotonic()
+        print(f"[Contacts] Bloom-фильтр: {bloom.count} номеров, {len(bloom.bits) // 1024} КБ")
+
+    # ---------- запись ----------
+
+    def record(self, phone_number: int, at: Optional[float] = None):
+        """Учитывает контакт с номером"""
+        if not self.enabled:
+            return
+        self._pending.setdefault(phone_number, []).append(at if at is not None else time.time())
+        self._bloom.add(phone_number)
+
+    def _write(self, rows: List[tuple]):
+        conn = self.get_db()
+        cur = conn.cursor()
+        psycopg2.extras.execute_values(cur, f"""
+            INSERT INTO contact_history AS h (phone_number, last_contact_at, recent_contacts)
+            VALUES %s
+            ON CONFLICT (phone_number) DO UPDATE
+            SET last_contact_at = GREATEST(h.last_contact_at, EXCLUDED.last_contact_at),
+                recent_contacts = ARRAY(
+                    SELECT t FROM unnest(h.recent_contacts || EXCLUDED.recent_contacts) AS t
+                    ORDER BY t DESC LIMIT {int(self.max_contacts)}
+                )
+        """, rows, template="(%s, %s::timestamp, %s::timestamp[])")
+        conn.commit()
+        cur.close()
+        conn.close()
+
+    async def flush(self):
+        """Пишет накопленные контакты; при ошибке они остаются в памяти"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            self._inflight = pending
+            rows = []
+            for phone_number, times in pending.items():
+                stamps = [datetime.fromtimestamp(t) for t in sorted(times)[-self.max_contacts:]]
+                rows.append((phone_number, stamps[-1], stamps))
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception:
+                for phone_number, times in pending.items():
+                    self._pending.setdefault(phone_number, [])[:0] = times
+                raise
+            finally:
+                self._inflight = {}
+
+    # ---------- проверка ----------
+
+    def _history(self, conn, phone_numbers: List[int]) -> Dict[int, List[datetime]]:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT phone_number, recent_contacts FROM contact_history
+            WHERE phone_number = ANY(%s)
+        """, (phone_numbers,))
+        history = {phone_number: list(contacts or []) for phone_number, contacts in cur.fetchall()}
+        cur.close()
+        return history
+
+    def wait_times(self, cur, phone_numbers: Iterable[int],
+                   now: Optional[float] = None) -> Dict[int, float]:
+        """
+        {номер: секунд до следующего разрешённого контакта} - только для
+        номеров, у которых лимит сейчас исчерпан
+        """
+        if not self.enabled:
+            return {}
+        now = now if now is not None else time.time()
+        candidates = [p for p in set(phone_numbers) if p in self._bloom]
+        if not candidates:
+            return {}
+
+        history = self._history(cur.connection, candidates)
+        result = {}
+        for phone_number in candidates:
+            written = history.get(phone_number, [])
+            # Пачка могла закоммититься, пока _inflight ещё не очищен: контакты,
+            # уже прочитанные из таблицы, не считаем дважды. Ключ - тот же
+            # datetime, что flush() записал в TIMESTAMP (сравнение в микросекундах, без float)
+            written_keys = set(written)
+            inflight = [t for t in self._inflight.get(phone_number, [])
+                        if datetime.fromtimestamp(t) not in written_keys]
+            stored = [t.timestamp() for t in written]
+            times = sorted(t for t in stored + inflight + self._pending.get(phone_number, [])
+                           if t > now - self.window)
+            if len(times) >= self.max_contacts:
+                # Освободится, когда из окна выйдет max_contacts-й с конца контакт
+                result[phone_number] = times[len(times) - self.max_contacts] + self.window - now
+        return result
+
+    def wait_time(self, cur, phone_number: int) -> float:
+        """Секунд до следующего разрешённого контакта (0 - можно сейчас)"""
+        return self.wait_times(cur, [phone_number]).get(phone_number, 0.0)
+
+    def status(self) -> dict:
+        return {
+            'max_contacts': self.max_contacts,
+            'window_hours': self.window / 3600,
+            'bloom_entries': self._bloom.count,
+            'bloom_capacity': self._bloom.capacity,
+            'bloom_kb': len(self._bloom.bits) // 1024,
+            'bloom_hashes': self._bloom.hashes,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FastAGI сервер - AGI-скрипты как обработчики в постоянном процессе
+
+Asterisk вызывает AGI(agi://host:4573/<скрипт>,<аргументы>) и говорит с
+сервером по TCP тем же протоколом, что с AGI-процессом по stdin/stdout.
+Вместо запуска интерпретатора, импорта psycopg2 и нового подключения к БД
+на каждый звонок - одно соединение TCP и вызов обработчика.
+
+Обработчик: async def handler(session: AGISession)
+    session.env      - переменные agi_* из заголовка запроса
+    session.args     - аргументы (agi_arg_1, agi_arg_2, ...)
+    await session.set_variable(name, value)
+    await session.verbose(message)
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+AGI_PORT = 4573
+
+
+class AGISession:
+    """Один запрос AGI от Asterisk"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 env: Dict[str, str]):
+        self.reader = reader
+        self.writer = writer
+        self.env = env
+
+    @property
+    def script(self) -> str:
+        """agi://host/select_sim?x=1 -> 'select_sim'"""
+        return self.env.get('agi_network_script', '').split('?', 1)[0].strip('/')
+
+    @property
+    def args(self) -> List[str]:
+        args = []
+        while f'agi_arg_{len(args) + 1}' in self.env:
+            args.append(self.env[f'agi_arg_{len(args) + 1}'])
+        return args
+
+    async def command(self, line: str) -> str:
+        """Отправляет команду AGI, возвращает ответ ('200 result=1')"""
+        self.writer.write(f'{line}\n'.encode('utf-8'))
+        await self.writer.drain()
+        response = await self.reader.readline()
+        if not response:
+            raise ConnectionResetError("Asterisk закрыл AGI-сессию")
+        return response.decode('utf-8', errors='replace').strip()
+
+    async def set_variable(self, name: str, value: str):
+        await self.command(f'SET VARIABLE {name} "{value}"')
+
+    async def verbose(self, message: str, level: int = 1):
+        await self.command(f'VERBOSE "{message}" {level}')
+
+
+async def read_env(reader: asyncio.StreamReader) -> Dict[str, str]:
+    """Заголовок запроса: строки 'agi_xxx: value' до пустой строки"""
+    env = {}
+    while True:
+        line = (await reader.readline()).decode('utf-8', errors='replace').strip()
+        if not line:
+            break
+        key, _, value = line.partition(':')
+        env[key.strip()] = value.strip()
+    return env
+
+
+class FastAGIServer:
+    """
+    Использование:
+        server = FastAGIServer(port=4573)
+        server.route('select_sim', handle_select_sim)
+        await server.start()
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = AGI_PORT, timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self.handlers: Dict[str, Callable[[AGISession], Awaitable[None]]] = {}
+        self.requests = 0
+        self.errors = 0
+
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, script: str, handler: Callable[[AGISession], Awaitable[None]]):
+        self.handlers[script] = handler
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        if self._server is None:
+            self._server = await asyncio.start_server(self._handle, self.host, self.port)
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # ---------- соединения ----------
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.requests += 1
+        try:
+            env = await asyncio.wait_for(read_env(reader), self.timeout)
+            session = AGISession(reader, writer, env)
+            handler = self.handlers.get(session.script)
+            if handler is None:
+                print(f"[FastAGI] Неизвестный скрипт: {session.script!r}")
+                await session.verbose(f"FastAGI: неизвестный скрипт {session.script}")
+                return
+            await asyncio.wait_for(handler(session), self.timeout)
+
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # звонок завершился раньше, чем обработчик ответил
+        except Exception as e:
+            self.errors += 1
+            print(f"[FastAGI] Ошибка обработчика: {e}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def status(self) -> dict:
+        return {
+            "listening": self._server is not None,
+            "port": self.port,
+            "scripts": sorted(self.handlers),
+            "requests": self.requests,
+            "errors": self.errors,
+        }
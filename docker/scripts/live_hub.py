@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Live Hub - рассылка обновлений веб-интерфейсу через Server-Sent Events
+
+Все открытые вкладки подписаны на один хаб в процессе. Данные из БД читает
+только сам хаб (один опрос на всех зрителей), поэтому нагрузка на БД не
+зависит от числа открытых вкладок.
+
+События:
+    campaigns       - список кампаний (при изменении)
+    sims            - состояние SIM-карт (при изменении)
+    campaign_delta  - дельты счётчиков кампании сразу после записи write-behind
+    campaign_stats  - статистика изменившихся кампаний {campaign_id: stats}
+    scheduler       - события планировщика (запуск по расписанию)
+"""
+
+import asyncio
+import json
+from typing import Callable, Dict, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+
+class LiveHub:
+    """
+    Использование:
+        hub = LiveHub({'campaigns': fetch_campaigns, 'sims': fetch_sims}, fetch_stats)
+        hub.publish('scheduler', {...})
+        return StreamingResponse(hub.stream(request), media_type='text/event-stream')
+    """
+
+    def __init__(self, snapshot_loaders: Dict[str, Callable[[], object]],
+                 stats_loader: Callable[[Set[int]], Dict[int, dict]],
+                 snapshot_interval: float = 5.0, queue_size: int = 100,
+                 keepalive_interval: float = 15.0):
+        self.snapshot_loaders = snapshot_loaders
+        self.stats_loader = stats_loader
+        self.snapshot_interval = snapshot_interval
+        self.queue_size = queue_size
+        self.keepalive_interval = keepalive_interval
+
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._snapshots: Dict[str, str] = {}
+        self._dirty_campaigns: Set[int] = set()
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- публикация ----------
+
+    @staticmethod
+    def _format(event: str, payload: str) -> str:
+        return f"event: {event}\ndata: {payload}\n\n"
+
+    def _broadcast(self, message: str):
+        for queue in list(self._subscribers):
+            if queue.full():
+                # Медленный клиент: выбрасываем самое старое сообщение
+                try:
+                    queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(message)
+
+    def publish(self, event: str, data):
+        """Отправляет событие всем подключенным клиентам"""
+        if not self._subscribers:
+            return
+        self._broadcast(self._format(event, json.dumps(jsonable_encoder(data), ensure_ascii=False)))
+
+    def campaigns_changed(self, counters: Dict[int, Dict[str, int]]):
+        """Колбэк write-behind: дельты счётчиков и пересчёт статистики кампаний"""
+        if not self._subscribers:
+            return
+        for campaign_id, deltas in counters.items():
+            self.publish('campaign_delta', dict(deltas, campaign_id=campaign_id))
+        self._dirty_campaigns.update(counters)
+        self._wake.set()
+
+    # ---------- подписчики ----------
+
+    async def stream(self, request):
+        """Генератор SSE для StreamingResponse"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        self._ensure_running()
+
+        try:
+            if not self._snapshots:
+                await self._refresh_snapshots()
+            for event, payload in self._snapshots.items():
+                yield self._format(event, payload)
+
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    message = await asyncio.wait_for(queue.get(), self.keepalive_interval)
+                except asyncio.TimeoutError:
+                    message = ": keepalive\n\n"
+                yield message
+        finally:
+            self._subscribers.discard(queue)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    # ---------- опрос БД (один на всех) ----------
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _refresh_snapshots(self):
+        for event, loader in self.snapshot_loaders.items():
+            data = await asyncio.to_thread(loader)
+            payload = json.dumps(jsonable_encoder(data), ensure_ascii=False)
+            if self._snapshots.get(event) != payload:
+                self._snapshots[event] = payload
+                self._broadcast(self._format(event, payload))
+
+    async def _refresh_stats(self):
+        campaign_ids, self._dirty_campaigns = self._dirty_campaigns, set()
+        stats = await asyncio.to_thread(self.stats_loader, campaign_ids)
+        if stats:
+            self.publish('campaign_stats', stats)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        next_snapshot = 0.0
+
+        # Пока есть зрители: снимки раз в snapshot_interval, статистика - по изменениям
+        while self._subscribers:
+            try:
+                if loop.time() >= next_snapshot:
+                    await self._refresh_snapshots()
+                    next_snapshot = loop.time() + self.snapshot_interval
+                if self._dirty_campaigns:
+                    await self._refresh_stats()
+            except Exception as e:
+                print(f"[LiveHub] Ошибка обновления данных: {e}")
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), max(0.0, next_snapshot - loop.time()))
+            except asyncio.TimeoutError:
+                pass
+
+        # Без зрителей снимок устаревает - при следующем подключении читаем заново
+        self._snapshots.clear()
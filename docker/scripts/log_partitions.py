@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Обслуживание помесячных партиций журналов call_logs и sms_log
+
+При старте и раз в interval секунд для каждого журнала вызывается
+log_partitions_maintain() (init.sql):
+    - создаются партиции текущего и months_ahead следующих месяцев
+    - удаляются месяцы старше retention_months (0 - хранить всё)
+Месяц считается по времени приложения (как call_time / created_at,
+которые пишут write_behind.py и sms_dispatcher.py).
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import psycopg2.extras
+
+LOG_TABLES = ('call_logs', 'sms_log')
+
+
+class LogPartitions:
+    """
+    Использование:
+        partitions = LogPartitions(get_db, retention_months=12)
+        await partitions.start()
+        partitions.status()   # партиции и их размер
+    """
+
+    def __init__(self, get_db: Callable, tables: Sequence[str] = LOG_TABLES,
+                 months_ahead: int = 2, retention_months: int = 0, interval: float = 86400.0):
+        self.get_db = get_db
+        self.tables = tuple(tables)
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                print(f"[LogPartitions] Ошибка обслуживания партиций: {e}")
+            await asyncio.sleep(self.interval)
+
+    # ---------- обслуживание ----------
+
+    def _maintain(self) -> Dict[str, List[str]]:
+        conn = self.get_db()
+        cur = conn.cursor()
+        actions = {}
+        for table in self.tables:
+            cur.execute("SELECT log_partitions_maintain(%s, %s, %s, %s)",
+                        (table, datetime.now(), self.months_ahead, self.retention_months))
+            actions[table] = cur.fetchone()[0] or []
+            conn.commit()
+        cur.close()
+        conn.close()
+        return actions
+
+    async def maintain(self) -> Dict[str, List[str]]:
+        actions = await asyncio.to_thread(self._maintain)
+        for table, done in actions.items():
+            for action in done:
+                print(f"[LogPartitions] {table}: {action}")
+        return actions
+
+    def status(self) -> List[dict]:
+        """Партиции журналов: границы и оценка числа строк (pg_class.reltuples)"""
+        conn = self.get_db()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("""
+            SELECT p.relname AS log_table, c.relname AS partition,
+                   pg_get_expr(c.relpartbound, c.oid) AS bounds,
+                   GREATEST(c.reltuples, 0)::bigint AS estimated_rows,
+                   pg_total_relation_size(c.oid) AS size_bytes
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = ANY(%s)
+            ORDER BY p.relname, c.relname
+        """, (list(self.tables),))
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return rows
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Номер телефона как целое число (E.164 без '+')
+
+Номер приводится к каноническому виду один раз - при загрузке CSV или на
+входе API - и дальше везде хранится как int / BIGINT: 79161234567.
+    - в БД 8 байт на номер вместо строки VARCHAR(20), индекс меньше
+    - префикс оператора - арифметикой, без срезов строк:
+      79161234567 // 10**7 % 1000 -> 916
+    - большие множества номеров в памяти - PhoneArray (отсортированный
+      array('q'), 8 байт на номер, поиск двоичным делением)
+В строку номер превращается только на выходе (Asterisk, GoIP): format_phone().
+"""
+
+import bisect
+from array import array
+from typing import Iterable, Optional, Union
+
+DEFAULT_COUNTRY_CODE = 7
+NATIONAL_DIGITS = 10  # длина номера без кода страны для +7
+
+MIN_E164_DIGITS = 10
+MAX_E164_DIGITS = 15
+
+Phone = Union[int, str]
+
+
+def parse_phone(value: Phone) -> Optional[int]:
+    """
+    '+7 (916) 123-45-67' / '89161234567' / '9161234567' / 79161234567 -> 79161234567
+
+    Номера без '+' считаются российскими: 8XXXXXXXXXX и 10 цифр приводятся
+    к 7XXXXXXXXXX. None - не номер.
+    """
+    if isinstance(value, int):
+        return value if 10 ** (MIN_E164_DIGITS - 1) <= value < 10 ** MAX_E164_DIGITS else None
+
+    text = str(value).strip()
+    digits = ''.join(ch for ch in text if ch.isdigit())
+    if not text.startswith('+'):
+        if len(digits) == NATIONAL_DIGITS:
+            digits = str(DEFAULT_COUNTRY_CODE) + digits
+        elif len(digits) == NATIONAL_DIGITS + 1 and digits[0] == '8':
+            digits = str(DEFAULT_COUNTRY_CODE) + digits[1:]
+    if not MIN_E164_DIGITS <= len(digits) <= MAX_E164_DIGITS or digits[0] == '0':
+        return None
+    return int(digits)
+
+
+def format_phone(phone: int) -> str:
+    """79161234567 -> '79161234567' (формат dialplan и GoIP)"""
+    return str(phone)
+
+
+def phone_prefix(phone: int) -> int:
+    """
+    Код оператора / региона: 79161234567 -> 916
+
+    Для +7 - три цифры после кода страны, для остальных - первые три цифры.
+    """
+    scale = 10 ** NATIONAL_DIGITS
+    if scale * DEFAULT_COUNTRY_CODE <= phone < scale * (DEFAULT_COUNTRY_CODE + 1):
+        return phone // 10 ** (NATIONAL_DIGITS - 3) % 1000
+    while phone >= 1000:
+        phone //= 10
+    return phone
+
+
+class PhoneArray:
+    """
+    Отсортированный массив номеров (array('q')): 8 байт на номер
+
+    Использование:
+        phones = PhoneArray.from_iterable(numbers)
+        79161234567 in phones
+    """
+
+    def __init__(self, numbers: Optional[array] = None):
+        # numbers должен быть уже отсортирован (например, ORDER BY в БД)
+        self.numbers = numbers if numbers is not None else array('q')
+
+    @classmethod
+    def from_iterable(cls, phones: Iterable[int]) -> 'PhoneArray':
+        return cls(array('q', sorted(set(phones))))
+
+    def __contains__(self, phone: int) -> bool:
+        i = bisect.bisect_left(self.numbers, phone)
+        return i < len(self.numbers) and self.numbers[i] == phone
+
+    def __len__(self) -> int:
+        return len(self.numbers)
+
+    @property
+    def nbytes(self) -> int:
+        return self.numbers.itemsize * len(self.numbers)
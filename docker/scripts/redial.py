@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Повторные звонки (редиал) по политике кампании
+
+Номер, до которого не дозвонились, не закрывается сразу: если попыток
+меньше max_attempts, он получает статус 'retry' и время следующей попытки
+campaign_numbers.next_attempt_at:
+    - пауза зависит от исхода (занято / не ответил / ошибка) и растёт
+      с каждой попыткой (retry_backoff - множитель)
+    - если время попадает вне окна повторов (по местному времени абонента),
+      попытка переносится на открытие окна
+Исполнитель кампании берёт наступившие повторы из RetryQueue вперёд новых
+номеров: выборка по частичному индексу (campaign_id, next_attempt_at)
+WHERE status = 'retry', без просмотра всей таблицы.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from calling_windows import CallingWindow
+
+# Исход звонка -> поле паузы кампании (минуты)
+RETRY_DELAY_FIELDS = {
+    'busy': 'retry_busy_minutes',
+    'no_answer': 'retry_no_answer_minutes',
+    'failed': 'retry_failed_minutes',
+}
+
+
+class RedialPolicy:
+    """
+    Использование:
+        policy = RedialPolicy.from_campaign(campaign, window)
+        next_at = policy.next_attempt('busy', attempts=1, tz_name='Asia/Omsk')
+        # None - попыток больше не будет
+    """
+
+    def __init__(self, max_attempts: int = 1, delays: Optional[dict] = None,
+                 backoff: float = 1.0, window: Optional[CallingWindow] = None,
+                 default_timezone: str = 'Europe/Moscow'):
+        self.max_attempts = max_attempts
+        self.delays = delays or {}  # исход -> секунды до повтора
+        self.backoff = backoff
+        self.window = window
+        self.default_tz = ZoneInfo(default_timezone)
+
+    @classmethod
+    def from_campaign(cls, campaign: dict, window: Optional[CallingWindow] = None,
+                      default_timezone: str = 'Europe/Moscow') -> 'RedialPolicy':
+        """Политика из строки campaigns; window - окно, в которое переносятся повторы"""
+        return cls(
+            max_attempts=campaign.get('max_attempts') or 1,
+            delays={
+                outcome: (campaign.get(field) or 0) * 60
+                for outcome, field in RETRY_DELAY_FIELDS.items()
+            },
+            backoff=campaign.get('retry_backoff') or 1.0,
+            window=window,
+            default_timezone=default_timezone,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_attempts > 1
+
+    def _resolve_tz(self, tz_name: Optional[str]) -> ZoneInfo:
+        if not tz_name:
+            return self.default_tz
+        try:
+            return ZoneInfo(tz_name)
+        except (ZoneInfoNotFoundError, ValueError):
+            return self.default_tz
+
+    def next_attempt(self, outcome: str, attempts: int, tz_name: Optional[str] = None,
+                     now: Optional[datetime] = None) -> Optional[datetime]:
+        """
+        Время следующей попытки (локальное время сервера, как остальные TIMESTAMP)
+
+        attempts - сколько попыток уже сделано, включая текущую.
+        """
+        if outcome not in self.delays or attempts >= self.max_attempts:
+            return None
+
+        now_utc = (now or datetime.now()).astimezone(dt_timezone.utc)
+        delay = self.delays[outcome] * self.backoff ** (attempts - 1)
+        due = now_utc + timedelta(seconds=delay)
+
+        if self.window is not None:
+            due += timedelta(seconds=self.window.seconds_until_open(self._resolve_tz(tz_name), due))
+
+        return due.astimezone().replace(tzinfo=None)
+
+
+class RetryQueue:
+    """
+    Наступившие повторы кампании (порциями по prefetch)
+
+    next_number() -> (номер, None) | (None, секунд до ближайшего повтора) | (None, None)
+    """
+
+    def __init__(self, campaign_id: int, prefetch: int = 100):
+        self.campaign_id = campaign_id
+        self.prefetch = prefetch
+        self._buffer: List[dict] = []
+        # (id, next_attempt_at) выданных повторов: пока результат лежит в
+        # write-behind буфере, строка ещё числится 'retry' с прежним временем
+        self._issued: set = set()
+
+    def has_retries(self, cur) -> bool:
+        """Остались ли номера, ждущие повтора (проверка перед завершением кампании)"""
+        cur.execute("""
+            SELECT 1 FROM campaign_numbers
+            WHERE campaign_id = %s AND status = 'retry'
+            LIMIT 1
+        """, (self.campaign_id,))
+        return cur.fetchone() is not None
+
+    def _take(self) -> Optional[dict]:
+        while self._buffer:
+            number = self._buffer.pop(0)
+            key = (number['id'], number['next_attempt_at'])
+            if key not in self._issued:
+                self._issued.add(key)
+                return number
+        return None
+
+    def next_number(self, cur):
+        number = self._take()
+        if number:
+            return number, None
+
+        now = datetime.now()
+        cur.execute("""
+            SELECT id, phone_number, operator, timezone, call_attempts, next_attempt_at
+            FROM campaign_numbers
+            WHERE campaign_id = %s AND status = 'retry' AND next_attempt_at <= %s
+            ORDER BY next_attempt_at
+            LIMIT %s
+        """, (self.campaign_id, now, self.prefetch))
+        self._buffer = cur.fetchall()
+        number = self._take()
+        if number:
+            return number, None
+
+        cur.execute("""
+            SELECT MIN(next_attempt_at) AS next_at
+            FROM campaign_numbers
+            WHERE campaign_id = %s AND status = 'retry'
+        """, (self.campaign_id,))
+        row = cur.fetchone()
+        if not row or row['next_at'] is None:
+            return None, None
+        return None, max(1.0, (row['next_at'] - now).total_seconds())
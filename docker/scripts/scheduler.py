@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Планировщик запланированных кампаний
+
+- Очередь с приоритетом (heapq) по scheduled_start_time в памяти
+- Изменения приходят через Postgres LISTEN/NOTIFY (канал campaign_schedule,
+  триггер campaigns_notify_schedule в init.sql), без периодического сканирования
+- Кампания запускается ровно в своё время: ожидание до ближайшего срока
+- Запуск через условный UPDATE ... WHERE status = 'scheduled' RETURNING:
+  при нескольких репликах кампанию запустит только одна
+- Запросы к БД - в asyncio.to_thread: медленная БД не останавливает цикл
+  событий (AMI, SSE, исполнители кампаний)
+"""
+
+import asyncio
+import heapq
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+SCHEDULE_CHANNEL = 'campaign_schedule'
+
+
+class CampaignScheduler:
+    """
+    Использование:
+        scheduler = CampaignScheduler(get_db, on_start=lambda cid: ...)
+        await scheduler.start()
+        scheduler.notify_changed(campaign_id)  # после изменений в этом процессе
+    """
+
+    def __init__(self, get_db: Callable, on_start: Callable[[int], None],
+                 resync_interval: float = 600.0, reconnect_delay: float = 5.0):
+        self.get_db = get_db
+        self.on_start = on_start
+        self.resync_interval = resync_interval
+        self.reconnect_delay = reconnect_delay
+
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._dirty: Set[int] = set()
+        self._wake = asyncio.Event()
+
+        self._listen_conn = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_resync = 0.0
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._close_listener()
+
+    def notify_changed(self, campaign_id: int):
+        """Локальное уведомление (дублирует NOTIFY, если триггер ещё не создан)"""
+        self._dirty.add(campaign_id)
+        self._wake.set()
+
+    def upcoming(self) -> List[dict]:
+        """Ближайшие запуски (для мониторинга)"""
+        loop_time = asyncio.get_event_loop().time()
+        return [
+            {'campaign_id': campaign_id, 'starts_in': round(max(0.0, due - loop_time), 1)}
+            for due, campaign_id in sorted(self._heap)
+            if self._due.get(campaign_id) == due
+        ]
+
+    # ---------- LISTEN/NOTIFY ----------
+
+    def _connect_listener(self):
+        conn = self.get_db()
+        conn.set_session(autocommit=True)
+        cur = conn.cursor()
+        cur.execute(f"LISTEN {SCHEDULE_CHANNEL}")
+        cur.close()
+        return conn
+
+    async def _open_listener(self):
+        conn = await asyncio.to_thread(self._connect_listener)
+        asyncio.get_event_loop().add_reader(conn.fileno(), self._on_notify)
+        self._listen_conn = conn
+
+    def _close_listener(self):
+        if self._listen_conn is None:
+            return
+        try:
+            asyncio.get_event_loop().remove_reader(self._listen_conn.fileno())
+        except Exception:
+            pass
+        try:
+            self._listen_conn.close()
+        except Exception:
+            pass
+        self._listen_conn = None
+
+    def _on_notify(self):
+        conn = self._listen_conn
+        try:
+            conn.poll()
+        except Exception as e:
+            print(f"[Scheduler] LISTEN-соединение потеряно: {e}")
+            self._close_listener()
+            self._wake.set()
+            return
+
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            try:
+                self._dirty.add(int(notify.payload))
+            except ValueError:
+                continue
+        self._wake.set()
+
+    # ---------- очередь ----------
+
+    def _schedule(self, campaign_id: int, delay: Optional[float]):
+        """Ставит (или снимает при delay=None) кампанию в очередь"""
+        if delay is None:
+            self._due.pop(campaign_id, None)
+            return
+
+        due = asyncio.get_event_loop().time() + max(0.0, delay)
+        self._due[campaign_id] = due
+        heapq.heappush(self._heap, (due, campaign_id))
+
+    def _fetch_scheduled(self) -> List[tuple]:
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, EXTRACT(EPOCH FROM (scheduled_start_time::timestamptz - NOW()))
+            FROM campaigns
+            WHERE status = 'scheduled' AND scheduled_start_time IS NOT NULL
+        """)
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return rows
+
+    async def _full_resync(self):
+        """Полная загрузка запланированных кампаний (старт и восстановление LISTEN)"""
+        rows = await asyncio.to_thread(self._fetch_scheduled)
+
+        self._heap = []
+        self._due = {}
+        for campaign_id, delay in rows:
+            self._schedule(campaign_id, float(delay))
+        self._last_resync = asyncio.get_event_loop().time()
+
+        if rows:
+            print(f"[Scheduler] В очереди {len(rows)} запланированных кампаний")
+
+    def _fetch_delays(self, campaign_ids: Set[int]) -> Dict[int, float]:
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT id, EXTRACT(EPOCH FROM (scheduled_start_time::timestamptz - NOW()))
+            FROM campaigns
+            WHERE id = ANY(%s) AND status = 'scheduled' AND scheduled_start_time IS NOT NULL
+        """, (list(campaign_ids),))
+        delays = {campaign_id: float(delay) for campaign_id, delay in cur.fetchall()}
+        cur.close()
+        conn.close()
+        return delays
+
+    async def _refresh(self, campaign_ids: Set[int]):
+        """Перечитывает изменившиеся кампании"""
+        try:
+            delays = await asyncio.to_thread(self._fetch_delays, campaign_ids)
+        except Exception:
+            self._dirty |= campaign_ids  # перечитаем после переподключения
+            raise
+
+        for campaign_id in campaign_ids:
+            self._schedule(campaign_id, delays.get(campaign_id))
+
+    # ---------- запуск ----------
+
+    def _claim(self, campaign_id: int) -> Optional[str]:
+        """Атомарно переводит кампанию в running; None - уже запущена другой репликой"""
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE campaigns
+            SET status = 'running',
+                started_at = NOW()
+            WHERE id = %s
+              AND status = 'scheduled'
+              AND scheduled_start_time::timestamptz <= NOW()
+            RETURNING name
+        """, (campaign_id,))
+        row = cur.fetchone()
+        conn.commit()
+        cur.close()
+        conn.close()
+        return row[0] if row else None
+
+    async def _fire_due(self):
+        loop_time = asyncio.get_event_loop().time()
+        while self._heap and self._heap[0][0] <= loop_time:
+            due, campaign_id = heapq.heappop(self._heap)
+            if self._due.get(campaign_id) != due:
+                continue  # устаревшая запись (время изменили или запуск отменён)
+            del self._due[campaign_id]
+
+            try:
+                name = await asyncio.to_thread(self._claim, campaign_id)
+            except Exception as e:
+                print(f"[Scheduler] ❌ Ошибка запуска кампании #{campaign_id}: {e}")
+                self._schedule(campaign_id, self.reconnect_delay)
+                continue
+
+            if name is None:
+                # Запущена другой репликой, отменена или часы разошлись - перечитаем
+                self._dirty.add(campaign_id)
+                continue
+
+            print(f"[Scheduler] ✅ Кампания #{campaign_id} '{name}' запущена по расписанию")
+            self.on_start(campaign_id)
+
+    def _next_timeout(self) -> float:
+        loop_time = asyncio.get_event_loop().time()
+        timeout = self._last_resync + self.resync_interval - loop_time
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if self._heap:
+            timeout = min(timeout, self._heap[0][0] - loop_time)
+        return max(0.0, timeout)
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                if self._listen_conn is None:
+                    await self._open_listener()
+                    await self._full_resync()
+                elif loop.time() - self._last_resync >= self.resync_interval:
+                    await self._full_resync()
+
+                if self._dirty:
+                    dirty, self._dirty = self._dirty, set()
+                    await self._refresh(dirty)
+
+                await self._fire_due()
+
+            except Exception as e:
+                print(f"[Scheduler] Ошибка в планировщике: {e}")
+                self._close_listener()
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._wake.clear()
+            if self._dirty:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self._next_timeout())
+            except asyncio.TimeoutError:
+                pass
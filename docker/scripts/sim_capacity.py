@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SIM Capacity - лимиты звонков и СМС по SIM-картам: копия в памяти
+
+Источник истины - счётчики sim_cards (calls_today, calls_this_hour,
+sms_today, ...), их увеличивает атомарно reserve_sim_slot() / reserve_sim()
+(init.sql). В памяти процесса - скользящие окна: время каждого звонка и СМС
+по SIM за последние 24 часа (лимит часа - события за 3600 сек, суток - за
+86400 сек). По ним SIM выбирается без полного перебора в БД, а затем
+резервируется в БД (claim_slot): при нескольких процессах лимиты не
+превышаются.
+
+- "Ближайший свободный слот": через сколько секунд SIM (или любая SIM)
+  сможет принять звонок / СМС - исполнитель кампании ждёт его, а не
+  звонит в упор в исчерпанные лимиты
+- Раз в checkpoint_interval секунд перечитываются статус, лимиты и
+  счётчики SIM: звонки и СМС других процессов добавляются в окна
+- События, учтённые только в памяти (record без БД, например пока БД
+  недоступна), пишутся в sim_cards приращениями, а не перезаписью счётчиков
+"""
+
+import asyncio
+import bisect
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import psycopg2.extras
+
+HOUR = 3600.0
+DAY = 86400.0
+
+KINDS = ('call', 'sms')
+
+# Столбцы счётчиков sim_cards: (за час, за сутки, время последнего события)
+COLUMNS = {
+    'call': ('calls_this_hour', 'calls_today', 'last_call_time'),
+    'sms': ('sms_this_hour', 'sms_today', 'last_sms_time'),
+}
+
+
+def claim_slot(conn, kind: str, sim_number: int,
+               at: datetime) -> Tuple[bool, Optional[int], Optional[int], Optional[datetime]]:
+    """
+    Атомарное резервирование слота SIM в БД (reserve_sim_slot в init.sql)
+
+    (зарезервировано, за час, за сутки, время последнего события) - счётчики
+    SIM после попытки; без commit, транзакцией управляет вызывающий.
+    """
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT reserved, slot_this_hour, slot_today, slot_last_time
+        FROM reserve_sim_slot(%s, %s, %s)
+    """, (sim_number, kind, at))
+    row = cur.fetchone()
+    cur.close()
+    return tuple(row) if row else (False, None, None, None)
+
+
+class SimState:
+    """Лимиты и окна одной SIM"""
+
+    def __init__(self, sim_number: int):
+        self.sim_number = sim_number
+        self.operator: Optional[str] = None
+        self.active = False
+        self.limits = {kind: (0, 0) for kind in KINDS}  # (в час, в сутки)
+        self.events: Dict[str, List[float]] = {kind: [] for kind in KINDS}
+
+    def prune(self, kind: str, now: float) -> List[float]:
+        events = self.events[kind]
+        expired = bisect.bisect_right(events, now - DAY)
+        if expired:
+            del events[:expired]
+        return events
+
+    def counts(self, kind: str, now: float) -> Tuple[int, int]:
+        """(за час, за сутки)"""
+        events = self.prune(kind, now)
+        return len(events) - bisect.bisect_right(events, now - HOUR), len(events)
+
+    def wait_time(self, kind: str, now: float) -> float:
+        """Секунд до свободного слота (0 - сейчас, inf - SIM не работает)"""
+        hourly_limit, daily_limit = self.limits[kind]
+        if not self.active or hourly_limit <= 0 or daily_limit <= 0:
+            return float('inf')
+
+        events = self.prune(kind, now)
+        in_hour = len(events) - bisect.bisect_right(events, now - HOUR)
+        wait = 0.0
+        if in_hour >= hourly_limit:
+            # Слот освободится, когда из окна выйдет (in_hour - limit + 1)-е событие часа
+            wait = events[len(events) - hourly_limit] + HOUR - now
+        if len(events) >= daily_limit:
+            wait = max(wait, events[len(events) - daily_limit] + DAY - now)
+        return max(0.0, wait)
+
+
+class SimCapacity:
+    """
+    Использование:
+        capacity = SimCapacity(get_db)
+        await capacity.start()
+        operator, sim = capacity.reserve('call', operator='МТС') or (None, None)
+        sim, wait = capacity.next_available('call')   # ближайший слот
+        await capacity.acquire('sms', sim_number)     # слот в БД, False - занят
+    """
+
+    def __init__(self, get_db: Callable, checkpoint_interval: float = 30.0, restore: bool = True):
+        self.get_db = get_db
+        self.checkpoint_interval = checkpoint_interval
+
+        self.sims: Dict[int, SimState] = {}
+        self.restore = restore  # False - окна с нуля, без счётчиков БД (replay_routing.py)
+        # События без резервирования в БД: (вид, SIM) -> времена, ждут записи приращением
+        self._pending: Dict[Tuple[str, int], List[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            print(f"[SimCapacity] Не удалось загрузить SIM-карты: {e}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._checkpoint_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.checkpoint()
+
+    async def _checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                print(f"[SimCapacity] Ошибка записи счётчиков: {e}")
+
+    # ---------- БД ----------
+
+    def _fetch(self) -> List[dict]:
+        conn = self.get_db()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("""
+            SELECT sim_number, operator, status,
+                   hourly_call_limit, daily_call_limit, hourly_sms_limit, daily_sms_limit,
+                   calls_this_hour, calls_today, last_call_time,
+                   sms_this_hour, sms_today, last_sms_time
+            FROM sim_cards
+        """)
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return rows
+
+    async def reload(self):
+        """Статус, лимиты и счётчики SIM: события других процессов добавляются в окна"""
+        rows = await asyncio.to_thread(self._fetch)
+
+        # Применяем в цикле событий: резервирования не видят полуобновлённое состояние
+        now = time.time()
+        seen = set()
+        for row in rows:
+            sim = self.sims.get(row['sim_number'])
+            if sim is None:
+                sim = self.sims[row['sim_number']] = SimState(row['sim_number'])
+            if self.restore:
+                for kind, (this_hour, today, last_time) in COLUMNS.items():
+                    self._merge(sim, kind, row[this_hour], row[today], row[last_time], now)
+            sim.operator = row['operator']
+            sim.active = row['status'] == 'active'
+            sim.limits = {
+                'call': (row['hourly_call_limit'] or 0, row['daily_call_limit'] or 0),
+                'sms': (row['hourly_sms_limit'] or 0, row['daily_sms_limit'] or 0),
+            }
+            seen.add(row['sim_number'])
+
+        for sim_number in set(self.sims) - seen:
+            del self.sims[sim_number]
+
+    @staticmethod
+    def _merge(sim: SimState, kind: str, this_hour: Optional[int], today: Optional[int],
+               last_time: Optional[datetime], now: float):
+        """
+        Дополняет окно до счётчиков БД (точные времена не хранятся - с запасом)
+
+        Недостающие события часа ставятся на время последнего события,
+        остальные события суток - на час раньше: лимиты освобождаются не
+        раньше, чем на самом деле. Свои события уже есть и в окне, и в БД -
+        добавляется только разница.
+        """
+        if not last_time:
+            return
+        last = last_time.timestamp()
+        # Как в reserve_sim_slot: счётчик часа старше часа и суток за прошлый день - нули
+        in_hour = (this_hour or 0) if now - last < HOUR else 0
+        in_day = (today or 0) if last_time.date() == datetime.fromtimestamp(now).date() else 0
+        in_day = max(in_day, in_hour)
+        if not in_day:
+            return
+
+        local_hour, local_day = sim.counts(kind, now)
+        missing_hour = max(0, in_hour - local_hour)
+        missing_earlier = max(0, (in_day - in_hour) - (local_day - local_hour))
+        if missing_hour or missing_earlier:
+            sim.events[kind] = sorted(sim.events[kind]
+                                      + [last - HOUR] * missing_earlier + [last] * missing_hour)
+
+    def _write_deltas(self, kind: str, rows: List[tuple]):
+        this_hour, today, last_time = COLUMNS[kind]
+        conn = self.get_db()
+        cur = conn.cursor()
+        try:
+            psycopg2.extras.execute_values(cur, f"""
+                UPDATE sim_cards AS s
+                SET {today} = CASE
+                        WHEN s.{last_time} >= date_trunc('day', v.last_time) THEN s.{today}
+                        ELSE 0
+                    END + v.today,
+                    {this_hour} = CASE
+                        WHEN s.{last_time} > v.last_time - INTERVAL '1 hour' THEN s.{this_hour}
+                        ELSE 0
+                    END + v.this_hour,
+                    {last_time} = GREATEST(s.{last_time}, v.last_time)
+                FROM (VALUES %s) AS v(sim_number, this_hour, today, last_time)
+                WHERE s.sim_number = v.sim_number
+            """, rows, template="(%s, %s, %s, %s::timestamp)")
+            conn.commit()
+        finally:
+            cur.close()
+            conn.close()
+
+    async def checkpoint(self):
+        """Приращения счётчиков без резервирования в БД и перечитывание SIM"""
+        pending, self._pending = self._pending, {}
+        try:
+            for kind in KINDS:
+                rows = []
+                for (event_kind, sim_number), events in pending.items():
+                    if event_kind != kind:
+                        continue
+                    last = events[-1]
+                    in_hour = sum(1 for at in events if at > last - HOUR)
+                    rows.append((sim_number, in_hour, len(events), datetime.fromtimestamp(last)))
+                if rows:
+                    await asyncio.to_thread(self._write_deltas, kind, rows)
+                for key in [key for key in pending if key[0] == kind]:
+                    del pending[key]
+        finally:
+            # Не записанное (ошибка БД) - обратно, к событиям после снимка
+            for key, events in pending.items():
+                self._pending[key] = sorted(events + self._pending.get(key, []))
+        await self.reload()
+
+    # ---------- лимиты ----------
+
+    def record(self, kind: str, sim_number: int, at: Optional[float] = None, reserved: bool = False):
+        """
+        Учитывает звонок / СМС через SIM
+
+        reserved=True - счётчики в БД уже увеличены (claim_slot, reserve_sim);
+        иначе событие запишется в sim_cards приращением при checkpoint.
+        """
+        at = at if at is not None else time.time()
+        sim = self.sims.get(sim_number)
+        if sim is None:
+            sim = self.sims[sim_number] = SimState(sim_number)
+        bisect.insort(sim.events[kind], at)
+        if not reserved:
+            bisect.insort(self._pending.setdefault((kind, sim_number), []), at)
+
+    def update(self, kind: str, sim_number: int, this_hour: Optional[int], today: Optional[int],
+               last_time: Optional[datetime]):
+        """Счётчики SIM из БД (ответ claim_slot при отказе): окно дополняется до них"""
+        sim = self.sims.get(sim_number)
+        if sim is not None and self.restore:
+            self._merge(sim, kind, this_hour, today, last_time, time.time())
+
+    def _claim(self, kind: str, sim_number: int, at: datetime):
+        conn = self.get_db()
+        try:
+            result = claim_slot(conn, kind, sim_number, at)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    async def acquire(self, kind: str, sim_number: int) -> bool:
+        """
+        Резервирует слот SIM в БД и учитывает его в окне
+
+        False - лимит SIM уже выбран (в том числе другими процессами), окно
+        обновлено по счётчикам БД. Если БД недоступна - событие учитывается
+        в памяти и запишется приращением при checkpoint.
+        """
+        now = time.time()
+        try:
+            reserved, this_hour, today, last_time = await asyncio.to_thread(
+                self._claim, kind, sim_number, datetime.fromtimestamp(now))
+        except Exception as e:
+            print(f"[SimCapacity] Резервирование SIM#{sim_number} без БД: {e}")
+            self.record(kind, sim_number, now)
+            return True
+
+        if not reserved:
+            self.update(kind, sim_number, this_hour, today, last_time)
+            return False
+        self.record(kind, sim_number, now, reserved=True)
+        return True
+
+    def wait_time(self, kind: str, sim_number: int) -> float:
+        sim = self.sims.get(sim_number)
+        return sim.wait_time(kind, time.time()) if sim else float('inf')
+
+    def _candidates(self, operator: Optional[str]) -> List[SimState]:
+        """SIM того же оператора, если такие есть, иначе все"""
+        active = [sim for sim in self.sims.values() if sim.active]
+        same = [sim for sim in active if operator and sim.operator == operator]
+        return same or active
+
+    def next_available(self, kind: str, operator: Optional[str] = None) -> Tuple[Optional[int], float]:
+        """
+        (SIM, секунд до слота) - SIM, которая освободится раньше всех
+
+        Своего оператора предпочитаем, пока у него есть свободный слот; иначе
+        ищем среди всех. (None, inf) - активных SIM нет.
+        """
+        now = time.time()
+        best: Tuple[Optional[int], float] = (None, float('inf'))
+        for group in (self._candidates(operator), self._candidates(None)):
+            for sim in group:
+                wait = sim.wait_time(kind, now)
+                if wait < best[1]:
+                    best = (sim.sim_number, wait)
+            if best[1] == 0:
+                break
+        return best
+
+    def free(self, kind: str, operator: Optional[str] = None,
+             now: Optional[float] = None) -> List[SimState]:
+        """
+        SIM со свободным слотом по окнам в памяти, в порядке выбора
+
+        Сначала SIM того же оператора, затем остальные; внутри - наименее
+        загруженные за сутки. Резервирование - claim_slot / acquire.
+        """
+        now = now if now is not None else time.time()
+        result: List[SimState] = []
+        for group in (self._candidates(operator), self._candidates(None)):
+            free = [sim for sim in group if sim not in result and sim.wait_time(kind, now) == 0]
+            result += sorted(free, key=lambda s: (s.counts(kind, now)[1], s.counts(kind, now)[0]))
+        return result
+
+    def reserve(self, kind: str, operator: Optional[str] = None) -> Optional[Tuple[str, int]]:
+        """
+        (оператор SIM, номер SIM) со свободным слотом только по памяти - событие
+        сразу учтено и запишется приращением. None - свободных SIM нет.
+        """
+        now = time.time()
+        free = self.free(kind, operator, now)
+        if not free:
+            return None
+        self.record(kind, free[0].sim_number, now)
+        return free[0].operator, free[0].sim_number
+
+    def status(self) -> List[dict]:
+        now = time.time()
+        result = []
+        for sim in sorted(self.sims.values(), key=lambda s: s.sim_number):
+            item = {'sim_number': sim.sim_number, 'operator': sim.operator, 'active': sim.active}
+            for kind in KINDS:
+                in_hour, in_day = sim.counts(kind, now)
+                hourly_limit, daily_limit = sim.limits[kind]
+                wait = sim.wait_time(kind, now)
+                item[kind] = {
+                    'this_hour': in_hour, 'hourly_limit': hourly_limit,
+                    'today': in_day, 'daily_limit': daily_limit,
+                    'next_slot_in': None if wait == float('inf') else round(wait, 1),
+                }
+            result.append(item)
+        return result
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SIM Routing - выбор SIM для звонка по оценке, а не только по загрузке
+
+Оценка кандидата (SIM со свободным слотом в sim_capacity):
+    on_net   - SIM того же оператора, что у абонента (звонок внутри сети)
+    asr      - доля отвеченных звонков (answer-seizure ratio) этой SIM на
+               этого оператора по call_logs, с затуханием старых звонков
+               и сглаживанием к средней по SIM при малом числе попыток
+    headroom - запас по лимитам: min(свободно в часе, свободно в сутках)
+    cooldown - время с последнего звонка SIM (до cooldown секунд)
+Итог - взвешенная сумма (weights); берётся SIM с максимальной оценкой.
+
+- ASR считается один раз при старте (агрегат call_logs за history_days) и
+  дальше обновляется по исходам звонков этого процесса (observe); раз в
+  reload_interval - полный пересчёт (звонки других процессов)
+- Постоянная часть оценки (on_net + asr) кэшируется по (SIM, оператор)
+- replay_routing.py прогоняет исторический день через тот же выбор
+"""
+
+import asyncio
+import math
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sim_capacity import SimCapacity, SimState
+
+DEFAULT_WEIGHTS = {
+    'on_net': 1.0,
+    'asr': 0.8,
+    'headroom': 0.5,
+    'cooldown': 0.3,
+}
+
+ASR_PRIOR = 0.5       # ASR без истории
+ASR_PRIOR_WEIGHT = 5  # сколько "попыток" весит априорное значение
+
+
+class AsrStats:
+    """Затухающие счётчики попыток и ответов"""
+
+    def __init__(self, half_life: float):
+        self.decay = math.log(2) / half_life
+        self.attempts: Dict[tuple, float] = {}
+        self.answered: Dict[tuple, float] = {}
+        self.updated: Dict[tuple, float] = {}
+
+    def add(self, key: tuple, attempts: float, answered: float, now: float):
+        factor = math.exp(-self.decay * (now - self.updated.get(key, now)))
+        self.attempts[key] = self.attempts.get(key, 0.0) * factor + attempts
+        self.answered[key] = self.answered.get(key, 0.0) * factor + answered
+        self.updated[key] = now
+
+    def ratio(self, key: tuple, prior: float) -> float:
+        """Сглаженная доля ответов (при малом числе попыток - ближе к prior)"""
+        attempts = self.attempts.get(key, 0.0)
+        return (self.answered.get(key, 0.0) + ASR_PRIOR_WEIGHT * prior) / (attempts + ASR_PRIOR_WEIGHT)
+
+
+class SimRouter:
+    """
+    Использование:
+        router = SimRouter(get_db, sim_capacity)
+        await router.start()
+        sims = router.free('МТС')                   # кандидаты по оценке (SimSelector)
+        operator, sim = router.reserve('МТС') or (None, None)
+        router.observe(sim, 'МТС', answered=True)   # исход звонка
+    """
+
+    def __init__(self, get_db: Callable, capacity: SimCapacity,
+                 weights: Optional[Dict[str, float]] = None,
+                 cooldown: float = 60.0, history_days: int = 7,
+                 half_life: float = 86400.0, reload_interval: float = 3600.0):
+        self.get_db = get_db
+        self.capacity = capacity
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.cooldown = cooldown
+        self.history_days = history_days
+        self.half_life = half_life
+        self.reload_interval = reload_interval
+
+        self.stats = AsrStats(half_life)
+        self._static: Dict[tuple, float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._reload_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _reload_loop(self):
+        while True:
+            try:
+                self.apply_history(await asyncio.to_thread(self.fetch_history))
+            except Exception as e:
+                print(f"[SimRouting] Не удалось загрузить ASR из call_logs: {e}")
+            await asyncio.sleep(self.reload_interval)
+
+    # ---------- ASR ----------
+
+    def fetch_history(self, until: Optional[datetime] = None) -> List[tuple]:
+        """
+        (sim_number, operator, попытки, ответы) с весом по давности
+
+        until - момент, на который считается история (по умолчанию - сейчас);
+        звонки позже until не учитываются (replay).
+        """
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.execute("""
+            WITH calls AS (
+                SELECT sim_number, operator, status,
+                       EXP(-%(decay)s * EXTRACT(EPOCH FROM (
+                           COALESCE(%(until)s::timestamp, LOCALTIMESTAMP) - call_time))) AS weight
+                FROM call_logs
+                WHERE sim_number IS NOT NULL
+                  AND call_time >= COALESCE(%(until)s::timestamp, LOCALTIMESTAMP) - %(days)s * INTERVAL '1 day'
+                  AND call_time < COALESCE(%(until)s::timestamp, LOCALTIMESTAMP)
+            )
+            SELECT sim_number, COALESCE(operator, ''),
+                   SUM(weight), SUM(CASE WHEN status = 'ANSWER' THEN weight ELSE 0 END)
+            FROM calls
+            GROUP BY 1, 2
+        """, {'decay': self.stats.decay, 'until': until, 'days': self.history_days})
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+        return rows
+
+    def apply_history(self, rows: List[tuple], now: Optional[float] = None):
+        """Заменяет статистику агрегатом из call_logs"""
+        now = now if now is not None else time.time()
+        self.stats = AsrStats(self.half_life)
+        for sim_number, operator, attempts, answered in rows:
+            self.stats.add((sim_number, operator), float(attempts), float(answered), now)
+            self.stats.add((sim_number,), float(attempts), float(answered), now)
+        self._static.clear()
+
+    def observe(self, sim_number: Optional[int], operator: Optional[str], answered: bool,
+                now: Optional[float] = None):
+        """Исход звонка через SIM (инкрементальное обновление ASR)"""
+        if sim_number is None:
+            return  # звонок не дошёл до линии - не попытка этой SIM
+        now = now if now is not None else time.time()
+        self.stats.add((sim_number, operator or ''), 1.0, 1.0 if answered else 0.0, now)
+        self.stats.add((sim_number,), 1.0, 1.0 if answered else 0.0, now)
+        for key in [key for key in self._static if key[0] == sim_number]:
+            del self._static[key]
+
+    def asr(self, sim_number: int, operator: Optional[str]) -> float:
+        sim_asr = self.stats.ratio((sim_number,), ASR_PRIOR)
+        return self.stats.ratio((sim_number, operator or ''), sim_asr)
+
+    # ---------- оценка ----------
+
+    def _static_score(self, sim: SimState, operator: Optional[str]) -> float:
+        key = (sim.sim_number, sim.operator, operator)
+        score = self._static.get(key)
+        if score is None:
+            on_net = 1.0 if operator and sim.operator == operator else 0.0
+            score = (self.weights['on_net'] * on_net
+                     + self.weights['asr'] * self.asr(sim.sim_number, operator))
+            self._static[key] = score
+        return score
+
+    def score(self, sim: SimState, operator: Optional[str], now: float) -> float:
+        hourly_limit, daily_limit = sim.limits['call']
+        in_hour, in_day = sim.counts('call', now)
+        headroom = min(1 - in_hour / hourly_limit, 1 - in_day / daily_limit) \
+            if hourly_limit > 0 and daily_limit > 0 else 0.0
+
+        events = sim.events['call']
+        idle = now - events[-1] if events else self.cooldown
+        cooldown = min(1.0, idle / self.cooldown) if self.cooldown > 0 else 1.0
+
+        return (self._static_score(sim, operator)
+                + self.weights['headroom'] * max(0.0, headroom)
+                + self.weights['cooldown'] * cooldown)
+
+    def rank(self, operator: Optional[str], now: Optional[float] = None) -> List[dict]:
+        """Кандидаты с оценками (мониторинг / отладка весов)"""
+        now = now if now is not None else time.time()
+        result = []
+        for sim in self.capacity.sims.values():
+            if not sim.active:
+                continue
+            result.append({
+                'sim_number': sim.sim_number,
+                'operator': sim.operator,
+                'score': round(self.score(sim, operator, now), 3),
+                'asr': round(self.asr(sim.sim_number, operator), 3),
+                'free': sim.wait_time('call', now) == 0,
+            })
+        return sorted(result, key=lambda item: item['score'], reverse=True)
+
+    def free(self, operator: Optional[str], now: Optional[float] = None) -> List[SimState]:
+        """Свободные SIM по окнам sim_capacity, от лучшей оценки к худшей"""
+        now = now if now is not None else time.time()
+        free = [sim for sim in self.capacity.sims.values()
+                if sim.active and sim.wait_time('call', now) == 0]
+        return sorted(free, key=lambda s: self.score(s, operator, now), reverse=True)
+
+    def reserve(self, operator: Optional[str], now: Optional[float] = None) -> Optional[Tuple[str, int]]:
+        """
+        (оператор SIM, номер SIM) с лучшей оценкой среди свободных - только по
+        памяти (replay_routing.py), звонок сразу учтён. Резервирование в БД -
+        SimSelector.select.
+        """
+        now = now if now is not None else time.time()
+        free = self.free(operator, now)
+        if not free:
+            return None
+        self.capacity.record('call', free[0].sim_number, now)
+        return free[0].operator, free[0].sim_number
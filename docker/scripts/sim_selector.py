@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Выбор SIM-карты для исходящего звонка (FastAGI-скрипт select_sim)
+
+SIM того же оператора, что у абонента, а если у него нет SIM с запасом
+по лимитам - любая. В постоянном процессе:
+- Справочник operator_ranges держится в памяти (префикс -> оператор,
+  префикс - число: phones.phone_prefix), перечитывается раз в operators_ttl секунд
+- Подключения к БД берутся из пула, а не открываются на каждый звонок
+- Резервирование всегда атомарно в БД: лимиты не превышаются при
+  параллельных звонках, в том числе из нескольких процессов. Без capacity -
+  один вызов reserve_sim() (init.sql). С capacity (sim_capacity.py) кандидаты
+  берутся из окон в памяти (с router (sim_routing.py) - по оценке: сеть, ASR,
+  запас), первый свободный резервируется reserve_sim_slot(); если все
+  кандидаты заняты другими процессами - reserve_sim()
+- Запросы к БД идут в потоке (asyncio.to_thread), цикл событий не блокируется
+
+В Asterisk результат приходит переменными SIM_ID и OPERATOR (пустые, если
+SIM не нашлось).
+"""
+
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from psycopg2.pool import ThreadedConnectionPool
+
+from fastagi import AGISession
+from phones import Phone, parse_phone, phone_prefix
+from sim_capacity import SimCapacity, claim_slot
+from sim_routing import SimRouter
+
+
+MAX_CLAIMS = 3  # кандидатов из памяти до резервирования через reserve_sim()
+
+
+class SimSelector:
+    """
+    Использование:
+        selector = SimSelector(DB_CONFIG, max_connections=4, capacity=sim_capacity, router=sim_router)
+        fastagi_server.route('select_sim', selector.handle_agi)
+        operator, sim_number = await selector.select('79161234567')
+    """
+
+    def __init__(self, db_config: dict, max_connections: int = 4, operators_ttl: float = 300.0,
+                 capacity: Optional[SimCapacity] = None, router: Optional[SimRouter] = None):
+        self.db_config = db_config
+        self.capacity = capacity
+        self.router = router
+        self.max_connections = max_connections
+        self.operators_ttl = operators_ttl
+
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._pool_lock = threading.Lock()
+        self._operators: Dict[int, str] = {}
+        self._operators_loaded = 0.0
+
+    # ---------- подключения ----------
+
+    def _get_pool(self) -> ThreadedConnectionPool:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(1, self.max_connections, **self.db_config)
+            return self._pool
+
+    async def start(self):
+        """Прогрев: пул и справочник операторов до первого звонка"""
+        try:
+            await asyncio.to_thread(self.refresh_operators)
+        except Exception as e:
+            print(f"[FastAGI] Справочник операторов не загружен: {e}")
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+    def _run(self, func, *args):
+        """func(conn, *args) на соединении из пула; битое соединение в пул не возвращается"""
+        pool = self._get_pool()
+        conn = pool.getconn()
+        broken = False
+        try:
+            result = func(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            broken = conn.closed != 0
+            if not broken:
+                conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=broken)
+
+    # ---------- справочник операторов ----------
+
+    def _load_operators(self, conn) -> Dict[int, str]:
+        cur = conn.cursor()
+        cur.execute("SELECT prefix, operator FROM operator_ranges ORDER BY id")
+        operators = {}
+        for prefix, operator in cur.fetchall():
+            if prefix.isdigit():
+                operators.setdefault(int(prefix), operator)  # как LIMIT 1 в прежнем запросе
+        cur.close()
+        return operators
+
+    def refresh_operators(self):
+        self._operators = self._run(self._load_operators)
+        self._operators_loaded = time.monotonic()
+
+    def _operators_stale(self) -> bool:
+        return time.monotonic() - self._operators_loaded > self.operators_ttl
+
+    def _lookup_operator(self, phone_number: Phone) -> Optional[str]:
+        phone = parse_phone(phone_number)
+        return self._operators.get(phone_prefix(phone)) if phone is not None else None
+
+    def operator_for(self, phone_number: Phone) -> Optional[str]:
+        if self._operators_stale():
+            self.refresh_operators()
+        return self._lookup_operator(phone_number)
+
+    # ---------- выбор SIM ----------
+
+    def _reserve_sim(self, conn, operator: Optional[str]) -> Optional[Tuple[str, int]]:
+        cur = conn.cursor()
+        cur.execute("SELECT reserved_operator, reserved_sim FROM reserve_sim(%s, %s)",
+                    (operator, datetime.now()))
+        result = cur.fetchone()
+        cur.close()
+        return result
+
+    def _claim_first(self, conn, sims: List[Tuple[str, int]], operator: Optional[str],
+                     now: datetime) -> Tuple[Optional[Tuple[str, int]], List[tuple]]:
+        """
+        Первый кандидат, чей слот зарезервирован в БД, иначе reserve_sim()
+
+        ((оператор SIM, номер SIM) или None, счётчики отказавших SIM).
+        """
+        refused = []
+        for sim_operator, sim_number in sims[:MAX_CLAIMS]:
+            reserved, this_hour, today, last_time = claim_slot(conn, 'call', sim_number, now)
+            if reserved:
+                return (sim_operator, sim_number), refused
+            refused.append((sim_number, this_hour, today, last_time))
+        return self._reserve_sim(conn, operator), refused
+
+    def select_sync(self, phone_number: Phone) -> Tuple[Optional[str], Optional[int]]:
+        result = self._run(self._reserve_sim, self.operator_for(phone_number))
+        return result if result else (None, None)
+
+    async def select(self, phone_number: Phone) -> Tuple[Optional[str], Optional[int]]:
+        """(оператор, номер SIM) или (None, None); счётчики SIM уже увеличены"""
+        if self.capacity is None:
+            return await asyncio.to_thread(self.select_sync, phone_number)
+
+        if self._operators_stale():
+            try:
+                await asyncio.to_thread(self.refresh_operators)
+            except Exception as e:
+                print(f"[FastAGI] Справочник операторов не обновлён: {e}")
+        operator = self._lookup_operator(phone_number)
+
+        now = time.time()
+        free = self.router.free(operator, now) if self.router is not None \
+            else self.capacity.free('call', operator, now)
+        try:
+            result, refused = await asyncio.to_thread(
+                self._run, self._claim_first, [(sim.operator, sim.sim_number) for sim in free],
+                operator, datetime.fromtimestamp(now))
+        except Exception as e:
+            # БД недоступна - выбор по памяти, счётчики запишутся приращением (checkpoint)
+            print(f"[FastAGI] Резервирование SIM без БД: {e}")
+            if not free:
+                return None, None
+            self.capacity.record('call', free[0].sim_number, now)
+            return free[0].operator, free[0].sim_number
+
+        # Кандидаты, выбранные другими процессами: окна - до счётчиков БД
+        for sim_number, this_hour, today, last_time in refused:
+            self.capacity.update('call', sim_number, this_hour, today, last_time)
+        if not result:
+            return None, None
+        self.capacity.record('call', result[1], now, reserved=True)
+        return result
+
+    # ---------- FastAGI ----------
+
+    async def handle_agi(self, session: AGISession):
+        """AGI(agi://host:4573/select_sim,<номер>) -> SIM_ID, OPERATOR"""
+        args = session.args
+        phone_number = args[0] if args else session.env.get('agi_extension', '')
+
+        if not phone_number:
+            await session.verbose("ERROR: Номер телефона не указан")
+            await session.set_variable("SIM_ID", "")
+            await session.set_variable("OPERATOR", "")
+            return
+
+        try:
+            operator, sim_id = await self.select(phone_number)
+        except Exception as e:
+            print(f"[FastAGI] select_sim: ошибка БД: {e}")
+            operator, sim_id = None, None
+
+        if sim_id:
+            await session.verbose(f"Выбрана SIM#{sim_id} ({operator})")
+            await session.set_variable("SIM_ID", str(sim_id))
+            await session.set_variable("OPERATOR", operator or "Unknown")
+        else:
+            await session.verbose("Нет доступных SIM-карт")
+            await session.set_variable("SIM_ID", "")
+            await session.set_variable("OPERATOR", "")
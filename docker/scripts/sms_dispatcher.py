@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SMS Dispatcher - параллельная отправка СМС через GoIP
+
+- Один общий httpx.AsyncClient с keep-alive на все отправки
+- Отдельная очередь и воркер на каждый слот SIM, отправка по слотам идёт параллельно
+- Выбор SIM по оператору абонента (префикс -> operator_ranges -> sim_cards)
+- Ограничение частоты отправки на каждую SIM; с capacity (sim_capacity.py) -
+  ещё и часовой/суточный лимит СМС: SIM выбирается с ближайшим свободным
+  слотом, воркер ждёт слот вместо отправки сверх лимита; слот резервируется
+  в БД (acquire), лимит общий для всех процессов
+- Результаты пишутся в sms_log пачками; статусы номеров кампаний
+  передаются в on_campaign_result (write-behind буфер кампаний)
+- stop() ждёт очереди не дольше drain_timeout и прерывает ожидание слота;
+  неотправленные СМС завершаются ошибкой 'SMS dispatcher stopped'
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import psycopg2.extras
+
+from phones import format_phone, phone_prefix
+from sim_capacity import SimCapacity
+
+
+class SMSDispatcher:
+    """
+    Диспетчер СМС с очередями по SIM-картам
+
+    Использование:
+        result = await sms_dispatcher.send('79991234567', 'Текст')
+        # или без ожидания (кампании):
+        sms_dispatcher.submit(phone, text, campaign_id=1, number_id=42)
+    """
+
+    def __init__(self, goip_config: dict, get_db: Callable,
+                 min_interval: float = 5.0, default_sim: int = 1,
+                 log_batch_size: int = 50, log_flush_interval: float = 1.0,
+                 routing_refresh_interval: float = 60.0,
+                 on_campaign_result: Optional[Callable] = None,
+                 capacity: Optional[SimCapacity] = None,
+                 drain_timeout: float = 10.0):
+        self.goip_config = goip_config
+        self.get_db = get_db
+        self.capacity = capacity
+        self.on_campaign_result = on_campaign_result
+        self.min_interval = min_interval
+        self.default_sim = default_sim
+        self.log_batch_size = log_batch_size
+        self.log_flush_interval = log_flush_interval
+        self.routing_refresh_interval = routing_refresh_interval
+        self.drain_timeout = drain_timeout
+
+        protocol = 'https' if goip_config['use_ssl'] else 'http'
+        self.send_url = f"{protocol}://{goip_config['host']}/default/en_US/send.html"
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._log_buffer: List[dict] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+        # Кэш маршрутизации
+        self._prefix_operator: Dict[int, str] = {}
+        self._operator_sims: Dict[str, List[int]] = {}
+        self._active_sims: List[int] = []
+        self._routing_loaded_at = 0.0
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        """Создаёт общий HTTP-клиент и запускает сброс логов"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=30.0,
+                verify=False,
+                limits=httpx.Limits(max_connections=8, max_keepalive_connections=8)
+            )
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+        self._stopping = asyncio.Event()
+
+    async def stop(self):
+        """
+        Дожидается очередей (не дольше drain_timeout), сбрасывает лог и закрывает клиент
+
+        СМС, которые ждут свободного слота SIM (лимит исчерпан), и всё,
+        что не успело уйти за drain_timeout, завершаются ошибкой.
+        """
+        if self._stopping:
+            self._stopping.set()
+
+        if self._queues:
+            try:
+                await asyncio.wait_for(
+                    asyncio.gather(*(queue.join() for queue in self._queues.values())),
+                    self.drain_timeout
+                )
+            except asyncio.TimeoutError:
+                print(f"[SMS] Очереди не разгрузились за {self.drain_timeout} сек, "
+                      f"осталось {sum(self.queue_sizes().values())} СМС")
+
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        unsent = 0
+        for sim_number, queue in self._queues.items():
+            while not queue.empty():
+                self._finish(queue.get_nowait(), self._stopped_result(sim_number))
+                unsent += 1
+        if unsent:
+            print(f"[SMS] Не отправлено при остановке: {unsent} СМС")
+        self._workers.clear()
+        self._queues.clear()
+
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self._flush_log()
+
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------- маршрутизация ----------
+
+    def _load_routing(self):
+        """Загружает справочник префиксов и активные SIM"""
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        cur.execute("SELECT prefix, operator FROM operator_ranges ORDER BY id")
+        prefix_operator = {}
+        for prefix, operator in cur.fetchall():
+            if prefix.isdigit():
+                prefix_operator.setdefault(int(prefix), operator)
+
+        cur.execute("""
+            SELECT sim_number, operator FROM sim_cards
+            WHERE status = 'active'
+            ORDER BY sim_number
+        """)
+        operator_sims: Dict[str, List[int]] = {}
+        active_sims = []
+        for sim_number, operator in cur.fetchall():
+            operator_sims.setdefault(operator, []).append(sim_number)
+            active_sims.append(sim_number)
+
+        cur.close()
+        conn.close()
+
+        self._prefix_operator = prefix_operator
+        self._operator_sims = operator_sims
+        self._active_sims = active_sims
+        self._routing_loaded_at = time.monotonic()
+
+    def resolve_sim(self, phone_number: int) -> int:
+        """Выбирает SIM того же оператора: раньше всех свободную по лимитам, с самой короткой очередью"""
+        if time.monotonic() - self._routing_loaded_at > self.routing_refresh_interval:
+            try:
+                self._load_routing()
+            except Exception as e:
+                print(f"[SMS] Ошибка загрузки маршрутизации: {e}")
+
+        operator = self._prefix_operator.get(phone_prefix(phone_number))
+
+        candidates = self._operator_sims.get(operator) or self._active_sims
+        if not candidates:
+            return self.default_sim
+
+        if self.capacity:
+            return min(candidates, key=lambda sim: (self.capacity.wait_time('sms', sim), self._queue(sim).qsize()))
+        return min(candidates, key=lambda sim: self._queue(sim).qsize())
+
+    # ---------- очереди ----------
+
+    def _queue(self, sim_number: int) -> asyncio.Queue:
+        queue = self._queues.get(sim_number)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._queues[sim_number] = queue
+            self._workers[sim_number] = asyncio.create_task(self._sim_worker(sim_number, queue))
+        return queue
+
+    def submit(self, phone_number: int, message: str, campaign_id: Optional[int] = None,
+               number_id: Optional[int] = None, sim_number: Optional[int] = None) -> asyncio.Future:
+        """
+        Ставит СМС в очередь SIM и сразу возвращает future с результатом
+
+        phone_number - канонический номер (phones.parse_phone)
+
+        Результат: {'success', 'sim_number', 'response' | 'error', 'sms_id'}
+        (sms_id появляется после записи пачки в sms_log)
+        """
+        if sim_number is None:
+            sim_number = self.resolve_sim(phone_number)
+
+        future = asyncio.get_event_loop().create_future()
+        self._queue(sim_number).put_nowait({
+            'phone_number': phone_number,
+            'message': message,
+            'campaign_id': campaign_id,
+            'number_id': number_id,
+            'sim_number': sim_number,
+            'future': future,
+        })
+        return future
+
+    async def send(self, phone_number: int, message: str,
+                   sim_number: Optional[int] = None) -> dict:
+        """Отправляет СМС и ждёт результат"""
+        return await self.submit(phone_number, message, sim_number=sim_number)
+
+    def queue_sizes(self) -> Dict[int, int]:
+        return {sim: queue.qsize() for sim, queue in self._queues.items()}
+
+    async def wait_for_capacity(self, max_per_sim: int = 10):
+        """Обратное давление для СМС-кампаний: ждём, пока очереди разгрузятся"""
+        while sum(self.queue_sizes().values()) >= max_per_sim * max(1, len(self._queues)):
+            await asyncio.sleep(self.min_interval / 2)
+
+    @staticmethod
+    def _stopped_result(sim_number: int) -> dict:
+        return {'success': False, 'error': 'SMS dispatcher stopped', 'sim_number': sim_number}
+
+    def _finish(self, item: dict, result: dict):
+        """Результат СМС: статус номера кампании и строка в буфер sms_log"""
+        item['result'] = result
+        item['created_at'] = datetime.now()
+        item['sent_at'] = item['created_at'] if result['success'] else None
+        self._log_buffer.append(item)
+        if item['number_id'] is not None and self.on_campaign_result:
+            self.on_campaign_result(item['campaign_id'], item['number_id'],
+                                    item['message'], result)
+
+    async def _wait_slot(self, delay: float) -> bool:
+        """Ждёт delay секунд; False - ожидание прервал stop()"""
+        if self._stopping is None:
+            await asyncio.sleep(delay)
+            return True
+        try:
+            await asyncio.wait_for(self._stopping.wait(), delay)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def _sim_worker(self, sim_number: int, queue: asyncio.Queue):
+        """Последовательная отправка по одной SIM с ограничением частоты"""
+        last_sent = 0.0
+        while True:
+            item = await queue.get()
+            try:
+                refused = stopped = False
+                while True:
+                    wait = self.min_interval - (time.monotonic() - last_sent)
+                    slot_wait = 0.0
+                    tracked = self.capacity is not None
+                    if tracked:
+                        # inf - SIM не активна (нет активных SIM, слот по умолчанию): лимиты не ведутся
+                        slot_wait = self.capacity.wait_time('sms', sim_number)
+                        tracked = slot_wait != float('inf')
+                        if not tracked:
+                            slot_wait = 0.0
+                        elif refused and slot_wait == 0:
+                            # БД отказала, а окно свободно (статус SIM устарел) - до перечитывания
+                            slot_wait = self.capacity.checkpoint_interval
+                    if slot_wait > max(wait, 0):
+                        # До слота могут быть часы (суточный лимит) - stop() прерывает ожидание
+                        if not await self._wait_slot(slot_wait):
+                            stopped = True
+                            break
+                    elif wait > 0:
+                        await asyncio.sleep(wait)
+
+                    # Слот выбран другими процессами - окно обновлено по БД, ждём следующий
+                    refused = tracked and not await self.capacity.acquire('sms', sim_number)
+                    if not refused:
+                        break
+                if stopped:
+                    self._finish(item, self._stopped_result(sim_number))
+                    continue
+
+                result = await self._send_goip(item['phone_number'], item['message'], sim_number)
+                last_sent = time.monotonic()
+                self._finish(item, result)
+
+                if len(self._log_buffer) >= self.log_batch_size:
+                    await self._flush_log()
+            except asyncio.CancelledError:
+                # stop() после drain_timeout: СМС в работе не теряется без результата
+                if 'result' not in item:
+                    self._finish(item, self._stopped_result(sim_number))
+                raise
+            except Exception as e:
+                # Ошибка до результата - тот же путь, что у обычного отказа
+                # (статус номера кампании, счётчик sms_failed, sms_log)
+                if 'result' not in item:
+                    self._finish(item, {'success': False, 'error': f'SMS send error: {e}',
+                                        'sim_number': sim_number})
+                else:
+                    print(f"[SMS] Ошибка обработки результата СМС: {e}")
+            finally:
+                queue.task_done()
+
+    async def _send_goip(self, phone_number: int, message: str, sim_number: int) -> dict:
+        """
+        Отправка через GoIP HTTP API
+        Формат: /default/en_US/send.html?username=admin&password=admin&smsnum=1&Memo=message&telnum=79991234567
+        """
+        params = {
+            'username': self.goip_config['username'],
+            'password': self.goip_config['password'],
+            'smsnum': str(sim_number),
+            'Memo': message,
+            'telnum': format_phone(phone_number)
+        }
+
+        try:
+            response = await self._client.get(self.send_url, params=params)
+
+            # GoIP возвращает "send success" при успехе
+            if response.status_code == 200 and 'success' in response.text.lower():
+                return {
+                    'success': True,
+                    'response': response.text,
+                    'sim_number': sim_number
+                }
+            return {
+                'success': False,
+                'error': f"GoIP response: {response.text}",
+                'status_code': response.status_code,
+                'sim_number': sim_number
+            }
+
+        except httpx.RequestError as e:
+            return {
+                'success': False,
+                'error': f'GoIP connection error: {str(e)}',
+                'sim_number': sim_number
+            }
+
+    # ---------- пакетная запись в sms_log ----------
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.log_flush_interval)
+            try:
+                await self._flush_log()
+            except Exception as e:
+                print(f"[SMS] Ошибка записи sms_log: {e}")
+
+    async def _flush_log(self):
+        if not self._log_buffer:
+            return
+
+        batch, self._log_buffer = self._log_buffer, []
+        try:
+            sms_ids = await asyncio.to_thread(self._write_batch, batch)
+        except Exception as e:
+            # Пачка возвращается в буфер и пишется следующим сбросом (как в
+            # CampaignWriteBehind); ожидающие получают результат отправки без sms_id
+            self._log_buffer = batch + self._log_buffer
+            sms_ids = [None] * len(batch)
+            print(f"[SMS] Не удалось записать {len(batch)} записей в sms_log, повтор при следующем сбросе: {e}")
+
+        for item, sms_id in zip(batch, sms_ids):
+            if not item['future'].done():
+                item['future'].set_result(dict(item['result'], sms_id=sms_id))
+
+    def _write_batch(self, batch: List[dict]) -> List[int]:
+        """Одна транзакция на пачку строк sms_log"""
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        rows = psycopg2.extras.execute_values(cur, """
+            INSERT INTO sms_log (campaign_id, phone_number, sim_number, message, status, sent_at, created_at)
+            VALUES %s
+            RETURNING id
+        """, [(
+            item['campaign_id'],
+            item['phone_number'],
+            item['sim_number'],
+            item['message'],
+            'sent' if item['result']['success'] else 'failed',
+            item['sent_at'],
+            item['created_at']
+        ) for item in batch], fetch=True)
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return [row[0] for row in rows]
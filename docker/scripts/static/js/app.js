@@ -88,100 +88,104 @@ async function loadCampaigns() {
         const response = await fetch(`${API_BASE}/campaigns`);
         const data = await response.json();
 
-        const container = document.getElementById('campaignsList');
+        renderCampaigns(data.campaigns);
 
-        if (data.campaigns.length === 0) {
-            container.innerHTML = `
-                <div class="text-center py-5">
-                    <i class="bi bi-inbox" style="font-size: 4rem; color: #CCC;"></i>
-                    <p class="mt-3 text-muted">Нет кампаний. Создайте первую!</p>
-                    <button class="btn btn-danger" onclick="showSection('newCampaign')">
-                        <i class="bi bi-plus-lg"></i> Создать кампанию
-                    </button>
-                </div>
-            `;
-            return;
-        }
+    } catch (error) {
+        console.error('Ошибка загрузки кампаний:', error);
+        showNotification('Ошибка загрузки кампаний', 'danger');
+    }
+}
 
-        container.innerHTML = data.campaigns.map(campaign => `
-            <div class="card campaign-card mb-3" onclick="showCampaignDetails(${campaign.id})">
-                <div class="card-body position-relative">
-                    <span class="badge bg-${getStatusColor(campaign.status)} campaign-status-badge">
-                        ${getStatusText(campaign.status)}
-                    </span>
+function renderCampaigns(campaigns) {
+    const container = document.getElementById('campaignsList');
 
-                    <h5 class="card-title">${campaign.name}</h5>
-                    <p class="card-text text-muted">${campaign.description || 'Без описания'}</p>
+    if (campaigns.length === 0) {
+        container.innerHTML = `
+            <div class="text-center py-5">
+                <i class="bi bi-inbox" style="font-size: 4rem; color: #CCC;"></i>
+                <p class="mt-3 text-muted">Нет кампаний. Создайте первую!</p>
+                <button class="btn btn-danger" onclick="showSection('newCampaign')">
+                    <i class="bi bi-plus-lg"></i> Создать кампанию
+                </button>
+            </div>
+        `;
+        return;
+    }
 
-                    ${campaign.status === 'scheduled' && campaign.scheduled_start_time ? `
-                        <div class="alert alert-warning mb-3">
-                            <i class="bi bi-clock-history"></i>
-                            <strong>Запланирован запуск:</strong> ${formatDate(campaign.scheduled_start_time)}
-                        </div>
-                    ` : ''}
+    container.innerHTML = campaigns.map(campaign => `
+        <div class="card campaign-card mb-3" onclick="showCampaignDetails(${campaign.id})">
+            <div class="card-body position-relative">
+                <span class="badge bg-${getStatusColor(campaign.status)} campaign-status-badge">
+                    ${getStatusText(campaign.status)}
+                </span>
 
-                    ${campaign.use_timezones ? `
-                        <div class="mb-2">
-                            <span class="badge bg-info">
-                                <i class="bi bi-globe"></i> Часовые пояса: ${campaign.timezone_mode === 'auto' ? 'Автоопределение' : 'Из CSV'}
-                            </span>
-                        </div>
-                    ` : ''}
+                <h5 class="card-title">${campaign.name}</h5>
+                <p class="card-text text-muted">${campaign.description || 'Без описания'}</p>
 
-                    <div class="row mt-3">
-                        <div class="col-md-3">
-                            <small class="text-muted">Всего номеров</small>
-                            <div class="fw-bold">${campaign.total_numbers}</div>
-                        </div>
-                        <div class="col-md-3">
-                            <small class="text-muted">Обработано</small>
-                            <div class="fw-bold text-primary">${campaign.processed_numbers}</div>
-                        </div>
-                        <div class="col-md-3">
-                            <small class="text-muted">Успешных</small>
-                            <div class="fw-bold text-success">${campaign.successful_calls}</div>
-                        </div>
-                        <div class="col-md-3">
-                            <small class="text-muted">Неудачных</small>
-                            <div class="fw-bold text-danger">${campaign.failed_calls}</div>
-                        </div>
+                ${campaign.status === 'scheduled' && campaign.scheduled_start_time ? `
+                    <div class="alert alert-warning mb-3">
+                        <i class="bi bi-clock-history"></i>
+                        <strong>Запланирован запуск:</strong> ${formatDate(campaign.scheduled_start_time)}
                     </div>
+                ` : ''}
 
-                    ${campaign.total_numbers > 0 ? `
-                        <div class="progress mt-3">
-                            <div class="progress-bar bg-success" style="width: ${(campaign.processed_numbers / campaign.total_numbers * 100).toFixed(1)}%"></div>
-                        </div>
-                        <small class="text-muted">${(campaign.processed_numbers / campaign.total_numbers * 100).toFixed(1)}% завершено</small>
-                    ` : ''}
+                ${campaign.use_timezones ? `
+                    <div class="mb-2">
+                        <span class="badge bg-info">
+                            <i class="bi bi-globe"></i> Часовые пояса: ${campaign.timezone_mode === 'auto' ? 'Автоопределение' : 'Из CSV'}
+                        </span>
+                    </div>
+                ` : ''}
 
-                    <div class="campaign-actions mt-3">
-                        ${campaign.status === 'draft' || campaign.status === 'paused' ? `
-                            <button class="btn btn-sm btn-success" onclick="event.stopPropagation(); startCampaign(${campaign.id})">
-                                <i class="bi bi-play-fill"></i> Старт
-                            </button>
-                        ` : ''}
-                        ${campaign.status === 'running' ? `
-                            <button class="btn btn-sm btn-warning" onclick="event.stopPropagation(); pauseCampaign(${campaign.id})">
-                                <i class="bi bi-pause-fill"></i> Пауза
-                            </button>
-                        ` : ''}
-                        ${campaign.status === 'scheduled' ? `
-                            <button class="btn btn-sm btn-danger" onclick="event.stopPropagation(); cancelScheduledCampaign(${campaign.id})">
-                                <i class="bi bi-x-circle"></i> Отменить запуск
-                            </button>
-                        ` : ''}
-                        <button class="btn btn-sm btn-info text-white" onclick="event.stopPropagation(); showCampaignDetails(${campaign.id})">
-                            <i class="bi bi-bar-chart"></i> Статистика
-                        </button>
+                <div class="row mt-3">
+                    <div class="col-md-3">
+                        <small class="text-muted">Всего номеров</small>
+                        <div class="fw-bold">${campaign.total_numbers}</div>
+                    </div>
+                    <div class="col-md-3">
+                        <small class="text-muted">Обработано</small>
+                        <div class="fw-bold text-primary">${campaign.processed_numbers}</div>
+                    </div>
+                    <div class="col-md-3">
+                        <small class="text-muted">Успешных</small>
+                        <div class="fw-bold text-success">${campaign.successful_calls}</div>
+                    </div>
+                    <div class="col-md-3">
+                        <small class="text-muted">Неудачных</small>
+                        <div class="fw-bold text-danger">${campaign.failed_calls}</div>
                     </div>
                 </div>
-            </div>
-        `).join('');
 
-    } catch (error) {
-        console.error('Ошибка загрузки кампаний:', error);
-        showNotification('Ошибка загрузки кампаний', 'danger');
-    }
+                ${campaign.total_numbers > 0 ? `
+                    <div class="progress mt-3">
+                        <div class="progress-bar bg-success" style="width: ${(campaign.processed_numbers / campaign.total_numbers * 100).toFixed(1)}%"></div>
+                    </div>
+                    <small class="text-muted">${(campaign.processed_numbers / campaign.total_numbers * 100).toFixed(1)}% завершено</small>
+                ` : ''}
+
+                <div class="campaign-actions mt-3">
+                    ${campaign.status === 'draft' || campaign.status === 'paused' ? `
+                        <button class="btn btn-sm btn-success" onclick="event.stopPropagation(); startCampaign(${campaign.id})">
+                            <i class="bi bi-play-fill"></i> Старт
+                        </button>
+                    ` : ''}
+                    ${campaign.status === 'running' ? `
+                        <button class="btn btn-sm btn-warning" onclick="event.stopPropagation(); pauseCampaign(${campaign.id})">
+                            <i class="bi bi-pause-fill"></i> Пауза
+                        </button>
+                    ` : ''}
+                    ${campaign.status === 'scheduled' ? `
+                        <button class="btn btn-sm btn-danger" onclick="event.stopPropagation(); cancelScheduledCampaign(${campaign.id})">
+                            <i class="bi bi-x-circle"></i> Отменить запуск
+                        </button>
+                    ` : ''}
+                    <button class="btn btn-sm btn-info text-white" onclick="event.stopPropagation(); showCampaignDetails(${campaign.id})">
+                        <i class="bi bi-bar-chart"></i> Статистика
+                    </button>
+                </div>
+            </div>
+        </div>
+    `).join('');
 }
 
 async function loadSimCards() {
@@ -189,67 +193,71 @@ async function loadSimCards() {
         const response = await fetch(`${API_BASE}/sims`);
         const data = await response.json();
 
-        const container = document.getElementById('simCardsList');
-
-        container.innerHTML = data.sims.map((sim, index) => `
-            <div class="col-md-6 mb-3">
-                <div class="card sim-card ${sim.status !== 'active' ? 'border-secondary' : ''}">
-                    <div class="card-body">
-                        <div class="d-flex justify-content-between align-items-start">
-                            <div>
-                                <h5 class="card-title">
-                                    <i class="bi bi-sim-fill operator-${sim.operator.toLowerCase()}"></i>
-                                    SIM ${sim.sim_number} - ${sim.operator}
-                                </h5>
-                                <p class="text-muted mb-1">
-                                    <i class="bi bi-telephone"></i> ${formatPhoneNumber(sim.phone_number)}
-                                </p>
-                            </div>
-                            <span class="badge bg-${sim.status === 'active' ? 'success' : 'secondary'}">
-                                ${sim.status === 'active' ? 'Активна' : 'Неактивна'}
-                            </span>
+        renderSimCards(data.sims);
+
+    } catch (error) {
+        console.error('Ошибка загрузки SIM-карт:', error);
+        showNotification('Ошибка загрузки SIM-карт', 'danger');
+    }
+}
+
+function renderSimCards(sims) {
+    const container = document.getElementById('simCardsList');
+
+    container.innerHTML = sims.map((sim, index) => `
+        <div class="col-md-6 mb-3">
+            <div class="card sim-card ${sim.status !== 'active' ? 'border-secondary' : ''}">
+                <div class="card-body">
+                    <div class="d-flex justify-content-between align-items-start">
+                        <div>
+                            <h5 class="card-title">
+                                <i class="bi bi-sim-fill operator-${sim.operator.toLowerCase()}"></i>
+                                SIM ${sim.sim_number} - ${sim.operator}
+                            </h5>
+                            <p class="text-muted mb-1">
+                                <i class="bi bi-telephone"></i> ${formatPhoneNumber(sim.phone_number)}
+                            </p>
                         </div>
+                        <span class="badge bg-${sim.status === 'active' ? 'success' : 'secondary'}">
+                            ${sim.status === 'active' ? 'Активна' : 'Неактивна'}
+                        </span>
+                    </div>
 
-                        <div class="row mt-3">
-                            <div class="col-6">
-                                <small class="text-muted">Звонков сегодня</small>
-                                <div class="progress mt-1">
-                                    <div class="progress-bar ${sim.calls_today >= sim.daily_call_limit ? 'bg-danger' : 'bg-success'}"
-                                         style="width: ${(sim.calls_today / sim.daily_call_limit * 100).toFixed(0)}%">
-                                    </div>
+                    <div class="row mt-3">
+                        <div class="col-6">
+                            <small class="text-muted">Звонков сегодня</small>
+                            <div class="progress mt-1">
+                                <div class="progress-bar ${sim.calls_today >= sim.daily_call_limit ? 'bg-danger' : 'bg-success'}"
+                                     style="width: ${(sim.calls_today / sim.daily_call_limit * 100).toFixed(0)}%">
                                 </div>
-                                <small>${sim.calls_today} / ${sim.daily_call_limit}</small>
                             </div>
-                            <div class="col-6">
-                                <small class="text-muted">Звонков за час</small>
-                                <div class="progress mt-1">
-                                    <div class="progress-bar ${sim.calls_this_hour >= sim.hourly_call_limit ? 'bg-danger' : 'bg-info'}"
-                                         style="width: ${(sim.calls_this_hour / sim.hourly_call_limit * 100).toFixed(0)}%">
-                                    </div>
+                            <small>${sim.calls_today} / ${sim.daily_call_limit}</small>
+                        </div>
+                        <div class="col-6">
+                            <small class="text-muted">Звонков за час</small>
+                            <div class="progress mt-1">
+                                <div class="progress-bar ${sim.calls_this_hour >= sim.hourly_call_limit ? 'bg-danger' : 'bg-info'}"
+                                     style="width: ${(sim.calls_this_hour / sim.hourly_call_limit * 100).toFixed(0)}%">
                                 </div>
-                                <small>${sim.calls_this_hour} / ${sim.hourly_call_limit}</small>
                             </div>
+                            <small>${sim.calls_this_hour} / ${sim.hourly_call_limit}</small>
                         </div>
-
-                        ${sim.last_call_time ? `
-                            <div class="mt-2">
-                                <small class="text-muted">
-                                    <i class="bi bi-clock"></i> Последний звонок: ${formatDate(sim.last_call_time)}
-                                </small>
-                            </div>
-                        ` : ''}
                     </div>
+
+                    ${sim.last_call_time ? `
+                        <div class="mt-2">
+                            <small class="text-muted">
+                                <i class="bi bi-clock"></i> Последний звонок: ${formatDate(sim.last_call_time)}
+                            </small>
+                        </div>
+                    ` : ''}
                 </div>
             </div>
-        `).join('');
-
-        // Обновить виджет в сайдбаре
-        updateSimWidget(data.sims);
+        </div>
+    `).join('');
 
-    } catch (error) {
-        console.error('Ошибка загрузки SIM-карт:', error);
-        showNotification('Ошибка загрузки SIM-карт', 'danger');
-    }
+    // Обновить виджет в сайдбаре
+    updateSimWidget(sims);
 }
 
 function updateSimWidget(sims) {
@@ -272,75 +280,40 @@ async function loadStatistics() {
         const response = await fetch(`${API_BASE}/campaigns`);
         const data = await response.json();
 
-        const totalCampaigns = data.campaigns.length;
-        const activeCampaigns = data.campaigns.filter(c => c.status === 'running').length;
-        const totalSuccess = data.campaigns.reduce((sum, c) => sum + (c.successful_calls || 0), 0);
-        const totalFailed = data.campaigns.reduce((sum, c) => sum + (c.failed_calls || 0), 0);
-
-        document.getElementById('totalCampaigns').textContent = totalCampaigns;
-        document.getElementById('activeCampaigns').textContent = activeCampaigns;
-        document.getElementById('totalSuccess').textContent = totalSuccess;
-        document.getElementById('totalFailed').textContent = totalFailed;
+        renderStatistics(data.campaigns);
 
     } catch (error) {
         console.error('Ошибка загрузки статистики:', error);
     }
 }
 
+function renderStatistics(campaigns) {
+    const totalCampaigns = campaigns.length;
+    const activeCampaigns = campaigns.filter(c => c.status === 'running').length;
+    const totalSuccess = campaigns.reduce((sum, c) => sum + (c.successful_calls || 0), 0);
+    const totalFailed = campaigns.reduce((sum, c) => sum + (c.failed_calls || 0), 0);
+
+    document.getElementById('totalCampaigns').textContent = totalCampaigns;
+    document.getElementById('activeCampaigns').textContent = activeCampaigns;
+    document.getElementById('totalSuccess').textContent = totalSuccess;
+    document.getElementById('totalFailed').textContent = totalFailed;
+}
+
+// Кампания, статистика которой открыта в модальном окне (для live-обновлений)
+let openCampaignId = null;
+
 async function showCampaignDetails(campaignId) {
     try {
         const response = await fetch(`${API_BASE}/campaigns/${campaignId}/stats`);
         const stats = await response.json();
 
-        const modalTitle = document.getElementById('campaignModalTitle');
-        const modalBody = document.getElementById('campaignModalBody');
+        renderCampaignDetails(stats);
+        openCampaignId = campaignId;
 
-        modalTitle.textContent = stats.name;
-
-        modalBody.innerHTML = `
-            <div class="row">
-                <div class="col-md-4 text-center">
-                    <h6 class="text-muted">Всего номеров</h6>
-                    <h3>${stats.total_numbers}</h3>
-                </div>
-                <div class="col-md-4 text-center">
-                    <h6 class="text-muted">Обработано</h6>
-                    <h3 class="text-primary">${stats.processed_numbers}</h3>
-                </div>
-                <div class="col-md-4 text-center">
-                    <h6 class="text-muted">Успешных</h6>
-                    <h3 class="text-success">${stats.successful_calls}</h3>
-                </div>
-            </div>
+        const modalElement = document.getElementById('campaignModal');
+        modalElement.addEventListener('hidden.bs.modal', () => { openCampaignId = null; }, { once: true });
 
-            <hr>
-
-            <h6>Детальная статистика:</h6>
-            <ul class="list-group">
-                <li class="list-group-item d-flex justify-content-between">
-                    <span><i class="bi bi-hourglass-split text-warning"></i> В ожидании</span>
-                    <strong>${stats.pending || 0}</strong>
-                </li>
-                <li class="list-group-item d-flex justify-content-between">
-                    <span><i class="bi bi-check-circle text-success"></i> Ответили</span>
-                    <strong>${stats.answered || 0}</strong>
-                </li>
-                <li class="list-group-item d-flex justify-content-between">
-                    <span><i class="bi bi-x-circle text-danger"></i> Не ответили</span>
-                    <strong>${stats.no_answer || 0}</strong>
-                </li>
-                <li class="list-group-item d-flex justify-content-between">
-                    <span><i class="bi bi-telephone-x text-warning"></i> Занято</span>
-                    <strong>${stats.busy || 0}</strong>
-                </li>
-                <li class="list-group-item d-flex justify-content-between">
-                    <span><i class="bi bi-exclamation-triangle text-danger"></i> Ошибка</span>
-                    <strong>${stats.failed || 0}</strong>
-                </li>
-            </ul>
-        `;
-
-        const modal = new bootstrap.Modal(document.getElementById('campaignModal'));
+        const modal = new bootstrap.Modal(modalElement);
         modal.show();
 
     } catch (error) {
@@ -349,6 +322,56 @@ async function showCampaignDetails(campaignId) {
     }
 }
 
+function renderCampaignDetails(stats) {
+    const modalTitle = document.getElementById('campaignModalTitle');
+    const modalBody = document.getElementById('campaignModalBody');
+
+    modalTitle.textContent = stats.name;
+
+    modalBody.innerHTML = `
+        <div class="row">
+            <div class="col-md-4 text-center">
+                <h6 class="text-muted">Всего номеров</h6>
+                <h3>${stats.total_numbers}</h3>
+            </div>
+            <div class="col-md-4 text-center">
+                <h6 class="text-muted">Обработано</h6>
+                <h3 class="text-primary">${stats.processed_numbers}</h3>
+            </div>
+            <div class="col-md-4 text-center">
+                <h6 class="text-muted">Успешных</h6>
+                <h3 class="text-success">${stats.successful_calls}</h3>
+            </div>
+        </div>
+
+        <hr>
+
+        <h6>Детальная статистика:</h6>
+        <ul class="list-group">
+            <li class="list-group-item d-flex justify-content-between">
+                <span><i class="bi bi-hourglass-split text-warning"></i> В ожидании</span>
+                <strong>${stats.pending || 0}</strong>
+            </li>
+            <li class="list-group-item d-flex justify-content-between">
+                <span><i class="bi bi-check-circle text-success"></i> Ответили</span>
+                <strong>${stats.answered || 0}</strong>
+            </li>
+            <li class="list-group-item d-flex justify-content-between">
+                <span><i class="bi bi-x-circle text-danger"></i> Не ответили</span>
+                <strong>${stats.no_answer || 0}</strong>
+            </li>
+            <li class="list-group-item d-flex justify-content-between">
+                <span><i class="bi bi-telephone-x text-warning"></i> Занято</span>
+                <strong>${stats.busy || 0}</strong>
+            </li>
+            <li class="list-group-item d-flex justify-content-between">
+                <span><i class="bi bi-exclamation-triangle text-danger"></i> Ошибка</span>
+                <strong>${stats.failed || 0}</strong>
+            </li>
+        </ul>
+    `;
+}
+
 // ============================================
 // Действия с кампаниями
 // ============================================
@@ -505,7 +528,7 @@ async function loadAudioFilesForCampaign() {
      * Загружает список аудио файлов для выбора при создании кампании
      */
     try {
-        const response = await fetch(`${API_BASE}/tts/files`);
+        const response = await fetch(`${API_BASE}/tts/files?limit=1000`);
         const data = await response.json();
 
         const select = document.getElementById('audioFile');
@@ -956,16 +979,63 @@ function getStatusText(status) {
 // Автообновление данных
 // ============================================
 
-// Обновление каждые 5 секунд
-setInterval(() => {
-    loadSimCards();
+function isSectionVisible(sectionName) {
+    const section = document.getElementById(sectionName + 'Section');
+    return section && section.style.display !== 'none';
+}
 
-    // Если открыта секция с кампаниями - обновляем
-    const campaignsSection = document.getElementById('campaignsSection');
-    if (campaignsSection.style.display !== 'none') {
-        loadCampaigns();
+// Резервный вариант без EventSource: опрос каждые 5 секунд
+function startPolling() {
+    setInterval(() => {
+        loadSimCards();
+
+        // Если открыта секция с кампаниями - обновляем
+        if (isSectionVisible('campaigns')) {
+            loadCampaigns();
+        }
+    }, 5000);
+}
+
+// Live-обновления с сервера (Server-Sent Events, GET /api/events)
+function connectLiveUpdates() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
     }
-}, 5000);
+
+    const source = new EventSource(`${API_BASE}/events`);
+
+    source.addEventListener('campaigns', event => {
+        const campaigns = JSON.parse(event.data);
+        if (isSectionVisible('campaigns')) {
+            renderCampaigns(campaigns);
+        }
+        if (isSectionVisible('stats')) {
+            renderStatistics(campaigns);
+        }
+    });
+
+    source.addEventListener('sims', event => {
+        renderSimCards(JSON.parse(event.data));
+    });
+
+    source.addEventListener('campaign_stats', event => {
+        const stats = JSON.parse(event.data);
+        if (openCampaignId !== null && stats[openCampaignId]) {
+            renderCampaignDetails(stats[openCampaignId]);
+        }
+    });
+
+    source.addEventListener('scheduler', event => {
+        const data = JSON.parse(event.data);
+        if (data.event === 'started') {
+            showNotification(`Кампания #${data.campaign_id} запущена по расписанию`, 'info');
+        }
+    });
+
+    // При обрыве EventSource переподключается сам
+    source.onerror = () => console.warn('Live-обновления: соединение потеряно, переподключение...');
+}
 
 // ============================================
 // Инициализация
@@ -975,4 +1045,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // Загружаем начальные данные
     loadCampaigns();
     loadSimCards();
+
+    // Дальше данные приходят с сервера
+    connectLiveUpdates();
 });
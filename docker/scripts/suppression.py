@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Suppression - стоп-лист номеров (отказ от звонков, чёрный список)
+
+Номера из suppression_list не попадают в кампанию при загрузке CSV и не
+обзваниваются, если оказались в стоп-листе уже после загрузки.
+
+- В памяти стоп-лист - PhoneArray (phones.py): отсортированный array('q')
+  номеров как 64-битных чисел (8 байт на номер, миллионы номеров - десятки
+  МБ), проверка - двоичный поиск без обращения к БД
+- Добавления и удаления через API сразу пишутся в БД и попадают в
+  небольшие множества поверх массива; раз в reload_interval массив
+  строится заново (ORDER BY phone - уже отсортирован) и множества очищаются
+- Массовая загрузка из CSV пишется пачками и перестраивает массив
+"""
+
+import asyncio
+from array import array
+from typing import Callable, Iterable, List, Optional, Set
+
+import psycopg2.extras
+
+from phones import Phone, PhoneArray, parse_phone
+
+LOAD_BATCH_SIZE = 10000  # номеров на один INSERT при загрузке
+
+
+class SuppressionList:
+    """
+    Использование:
+        suppression = SuppressionList(get_db)
+        await suppression.start()
+        if suppression.contains('79161234567'): ...
+        await suppression.add(['79161234567'], reason='opt_out')
+    """
+
+    def __init__(self, get_db: Callable, reload_interval: float = 600.0):
+        self.get_db = get_db
+        self.reload_interval = reload_interval
+
+        self._numbers = PhoneArray()
+        self._added: Set[int] = set()
+        self._removed: Set[int] = set()
+        self._reload_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        try:
+            await self.reload()
+        except Exception as e:
+            print(f"[Suppression] Не удалось загрузить стоп-лист: {e}")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._reload_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _reload_loop(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                print(f"[Suppression] Ошибка перечитывания стоп-листа: {e}")
+
+    # ---------- загрузка ----------
+
+    def _fetch(self) -> PhoneArray:
+        conn = self.get_db()
+        # Серверный курсор: номера идут порциями прямо в массив
+        cur = conn.cursor(name='suppression_scan')
+        cur.itersize = 100000
+        cur.execute("SELECT phone FROM suppression_list ORDER BY phone")
+        numbers = array('q')
+        for (phone,) in cur:
+            numbers.append(phone)
+        cur.close()
+        conn.close()
+        return PhoneArray(numbers)
+
+    async def reload(self):
+        """Массив заново из suppression_list"""
+        async with self._reload_lock:
+            # Изменения, сделанные до начала чтения, уже в БД - их множества не нужны
+            added, removed = set(self._added), set(self._removed)
+            numbers = await asyncio.to_thread(self._fetch)
+            self._numbers = numbers
+            self._added -= added
+            self._removed -= removed
+        print(f"[Suppression] Стоп-лист: {len(numbers)} номеров")
+
+    # ---------- проверка ----------
+
+    def _in_array(self, key: int) -> bool:
+        return key in self._numbers
+
+    def contains(self, phone_number: Phone) -> bool:
+        key = parse_phone(phone_number)
+        if key is None:
+            return False
+        if key in self._added:
+            return True
+        return key not in self._removed and self._in_array(key)
+
+    def __len__(self) -> int:
+        return len(self._numbers) + len(self._added) - len(self._removed)
+
+    # ---------- изменения ----------
+
+    def _insert(self, rows: List[tuple]) -> int:
+        """Пишет номера; возвращает число новых (уже бывшие в стоп-листе не считаются)"""
+        conn = self.get_db()
+        cur = conn.cursor()
+        inserted = 0
+        for i in range(0, len(rows), LOAD_BATCH_SIZE):
+            # page_size = пачке: один INSERT, rowcount - по всей пачке
+            psycopg2.extras.execute_values(cur, """
+                INSERT INTO suppression_list (phone, reason, source)
+                VALUES %s
+                ON CONFLICT (phone) DO NOTHING
+            """, rows[i:i + LOAD_BATCH_SIZE], page_size=LOAD_BATCH_SIZE)
+            inserted += cur.rowcount
+        conn.commit()
+        cur.close()
+        conn.close()
+        return inserted
+
+    def _delete(self, keys: List[int]) -> int:
+        conn = self.get_db()
+        cur = conn.cursor()
+        cur.execute("DELETE FROM suppression_list WHERE phone = ANY(%s)", (keys,))
+        deleted = cur.rowcount
+        conn.commit()
+        cur.close()
+        conn.close()
+        return deleted
+
+    async def add(self, phone_numbers: Iterable, reason: str = 'opt_out',
+                  source: Optional[str] = None) -> int:
+        """Добавляет номера; возвращает число новых в стоп-листе"""
+        keys = {key for key in map(parse_phone, phone_numbers) if key is not None}
+        if not keys:
+            return 0
+        inserted = await asyncio.to_thread(self._insert, [(key, reason, source) for key in keys])
+        self._removed -= keys
+        self._added |= {key for key in keys if not self._in_array(key)}
+        return inserted
+
+    async def remove(self, phone_numbers: Iterable) -> int:
+        """Убирает номера; возвращает число удалённых из БД"""
+        keys = {key for key in map(parse_phone, phone_numbers) if key is not None}
+        if not keys:
+            return 0
+        deleted = await asyncio.to_thread(self._delete, list(keys))
+        self._added -= keys
+        self._removed |= {key for key in keys if self._in_array(key)}
+        return deleted
+
+    async def load(self, phone_numbers: Iterable, reason: str = 'opt_out',
+                   source: Optional[str] = None) -> int:
+        """Массовая загрузка (CSV): пачками в БД, затем массив заново; возвращает число новых"""
+        keys = {key for key in map(parse_phone, phone_numbers) if key is not None}
+        if not keys:
+            return 0
+        inserted = await asyncio.to_thread(self._insert, [(key, reason, source) for key in keys])
+        await self.reload()
+        return inserted
+
+    def status(self) -> dict:
+        return {
+            'numbers': len(self),
+            'array_kb': self._numbers.nbytes // 1024,
+            'pending_added': len(self._added),
+            'pending_removed': len(self._removed),
+        }
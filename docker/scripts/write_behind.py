@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Write-behind буфер результатов кампаний
+
+Вместо нескольких UPDATE/INSERT с commit() на каждый номер исполнитель
+кампании складывает результаты сюда, а буфер раз в flush_interval секунд
+(или при накоплении batch_size записей) пишет всё одной транзакцией:
+    - campaign_numbers: статус звонка/СМС, попытки, длительность
+    - call_logs: строки журнала звонков (call_time - время приложения,
+      по нему строка попадает в месячную партицию)
+    - campaigns: дельты счётчиков (одно UPDATE на кампанию)
+    - report_hourly: почасовые агрегаты звонков (кампания, SIM, оператор,
+      часовой пояс, исход) для /api/reports/...
+При паузе кампании и остановке сервиса вызывается flush() - данные не теряются.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import psycopg2.extras
+
+
+# Поля campaign_numbers, которые может обновлять буфер, и их типы в VALUES
+NUMBER_FIELDS = {
+    'status': 'varchar',
+    'last_attempt_time': 'timestamp',
+    'answer_time': 'timestamp',
+    'duration': 'integer',
+    'sim_used': 'integer',
+    'sms_status': 'varchar',
+    'sms_sent_at': 'timestamp',
+    'sms_text': 'text',
+    'next_attempt_at': 'timestamp',
+}
+
+COUNTER_FIELDS = (
+    'processed_numbers', 'successful_calls', 'failed_calls',
+    'sms_sent', 'sms_failed',
+)
+
+
+class CampaignWriteBehind:
+    """Буферизует изменения номеров и счётчиков кампаний"""
+
+    def __init__(self, get_db: Callable, flush_interval: float = 2.0,
+                 batch_size: int = 200,
+                 on_flush: Optional[Callable[[Dict[int, Dict[str, int]]], None]] = None):
+        self.get_db = get_db
+        self.on_flush = on_flush
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._numbers: Dict[int, dict] = {}
+        self._attempts: Dict[int, int] = {}
+        self._call_logs: List[tuple] = []
+        self._counters: Dict[int, Dict[str, int]] = {}
+        self._rollups: Dict[tuple, List[int]] = {}  # ключ report_hourly -> [звонки, секунды]
+
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Финальный сброс буфера"""
+        if self._flusher:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"[WriteBehind] Ошибка сброса, повтор через {self.flush_interval} сек: {e}")
+
+    # ---------- запись в буфер ----------
+
+    def _pending_count(self) -> int:
+        return len(self._numbers) + len(self._call_logs)
+
+    def _add_rollup(self, campaign_id: int, number: dict, outcome: dict, at: datetime):
+        key = (
+            at.replace(minute=0, second=0, microsecond=0), campaign_id,
+            outcome['sim_number'] or 0, number.get('operator') or '',
+            number.get('timezone') or '', outcome['status'],
+        )
+        totals = self._rollups.setdefault(key, [0, 0])
+        totals[0] += 1
+        totals[1] += outcome['duration'] or 0
+
+    def _maybe_flush(self):
+        if self._pending_count() >= self.batch_size:
+            asyncio.create_task(self._safe_flush())
+
+    async def _safe_flush(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"[WriteBehind] Ошибка сброса: {e}")
+
+    def _update_number(self, number_id: int, **fields):
+        """Переданные поля пишутся как есть, None - в NULL; остальные не трогаются"""
+        self._numbers.setdefault(number_id, {}).update(fields)
+
+    def _add_counters(self, campaign_id: int, **deltas):
+        counters = self._counters.setdefault(campaign_id, dict.fromkeys(COUNTER_FIELDS, 0))
+        for key, value in deltas.items():
+            counters[key] += value
+
+    def record_call(self, campaign_id: int, number: dict, outcome: dict,
+                    next_attempt_at: Optional[datetime] = None):
+        """
+        Результат звонка по номеру
+
+        Args:
+            number: строка campaign_numbers (id, phone_number, operator)
+            outcome: результат ami_manager.wait_outcome()
+            next_attempt_at: назначен повтор (redial.py) - номер получает статус
+                'retry', в счётчики кампании попадёт после последней попытки
+        """
+        answered = outcome['status'] == 'answered'
+        retry = next_attempt_at is not None
+        now = datetime.now()
+
+        self._update_number(
+            number['id'],
+            status='retry' if retry else outcome['status'],
+            last_attempt_time=now,
+            answer_time=outcome['answer_time'],
+            duration=outcome['duration'],
+            sim_used=outcome['sim_number'],
+            next_attempt_at=next_attempt_at,
+        )
+        self._attempts[number['id']] = self._attempts.get(number['id'], 0) + 1
+
+        self._call_logs.append((
+            campaign_id, number['phone_number'], outcome['sim_number'],
+            number.get('operator'), outcome['call_log_status'],
+            outcome['duration'], outcome['error'], now,
+        ))
+        self._add_rollup(campaign_id, number, outcome, now)
+
+        if not retry:
+            self._add_counters(
+                campaign_id,
+                processed_numbers=1,
+                successful_calls=1 if answered else 0,
+                failed_calls=0 if answered else 1,
+            )
+        self._maybe_flush()
+
+    def record_deferred(self, number_id: int, next_attempt_at: datetime):
+        """Номер отложен без звонка (лимит контактов) - вернётся через RetryQueue"""
+        self._update_number(number_id, status='retry', next_attempt_at=next_attempt_at)
+        self._maybe_flush()
+
+    def record_processed(self, campaign_id: int, number_id: int, status: str = 'processed'):
+        """Номер обработан без звонка (СМС-кампания, стоп-лист)"""
+        self._update_number(number_id, status=status, last_attempt_time=datetime.now(),
+                            next_attempt_at=None)
+        self._add_counters(campaign_id, processed_numbers=1)
+        self._maybe_flush()
+
+    def record_sms(self, campaign_id: int, number_id: int, message: str, result: dict):
+        """Результат СМС по номеру кампании (колбэк SMSDispatcher)"""
+        sent = result['success']
+        self._update_number(
+            number_id,
+            sms_status='sent' if sent else 'failed',
+            sms_sent_at=datetime.now() if sent else None,
+            sms_text=message,
+        )
+        self._add_counters(
+            campaign_id,
+            sms_sent=1 if sent else 0,
+            sms_failed=0 if sent else 1,
+        )
+        self._maybe_flush()
+
+    # ---------- сброс ----------
+
+    async def flush(self):
+        """Пишет накопленное одной транзакцией; при ошибке данные возвращаются в буфер"""
+        async with self._flush_lock:
+            if not self._numbers and not self._call_logs and not self._counters:
+                return
+
+            numbers, self._numbers = self._numbers, {}
+            attempts, self._attempts = self._attempts, {}
+            call_logs, self._call_logs = self._call_logs, []
+            counters, self._counters = self._counters, {}
+            rollups, self._rollups = self._rollups, {}
+
+            try:
+                await asyncio.to_thread(self._write, numbers, attempts, call_logs, counters, rollups)
+            except Exception:
+                self._restore(numbers, attempts, call_logs, counters, rollups)
+                raise
+
+            # Дельты счётчиков после коммита (live-обновления интерфейса)
+            if counters and self.on_flush:
+                self.on_flush(counters)
+
+    def _restore(self, numbers, attempts, call_logs, counters, rollups):
+        """Возвращает несохранённую пачку в буфер (новые значения приоритетнее)"""
+        for number_id, fields in numbers.items():
+            merged = dict(fields)
+            merged.update(self._numbers.get(number_id, {}))
+            self._numbers[number_id] = merged
+        for number_id, count in attempts.items():
+            self._attempts[number_id] = self._attempts.get(number_id, 0) + count
+        self._call_logs = call_logs + self._call_logs
+        for campaign_id, deltas in counters.items():
+            self._add_counters(campaign_id, **deltas)
+        for key, (calls, duration) in rollups.items():
+            totals = self._rollups.setdefault(key, [0, 0])
+            totals[0] += calls
+            totals[1] += duration
+
+    def _write(self, numbers, attempts, call_logs, counters, rollups):
+        conn = self.get_db()
+        cur = conn.cursor()
+
+        try:
+            # Один UPDATE на каждый набор изменённых полей (их несколько:
+            # звонок, повтор, СМС) - поле пишется только там, где его задали
+            groups: Dict[tuple, List[tuple]] = {}
+            for number_id, fields in numbers.items():
+                names = tuple(f for f in NUMBER_FIELDS if f in fields)
+                groups.setdefault(names, []).append(
+                    (number_id, *(fields[f] for f in names), attempts.get(number_id, 0))
+                )
+            for names, rows in groups.items():
+                psycopg2.extras.execute_values(cur, f"""
+                    UPDATE campaign_numbers AS cn
+                    SET {''.join(f'{f} = v.{f}, ' for f in names)}
+                        call_attempts = cn.call_attempts + v.attempts
+                    FROM (VALUES %s) AS v(id, {''.join(f + ', ' for f in names)}attempts)
+                    WHERE cn.id = v.id
+                """, rows, template=f"(%s, {''.join(f'%s::{NUMBER_FIELDS[f]}, ' for f in names)}%s::integer)")
+
+            if call_logs:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO call_logs (campaign_id, phone_number, sim_number, operator,
+                                           status, duration, error_message, call_time)
+                    VALUES %s
+                """, call_logs)
+
+            if rollups:
+                psycopg2.extras.execute_values(cur, """
+                    INSERT INTO report_hourly AS r (hour, campaign_id, sim_number, operator,
+                                                   timezone, outcome, calls, duration)
+                    VALUES %s
+                    ON CONFLICT (hour, campaign_id, sim_number, operator, timezone, outcome) DO UPDATE
+                    SET calls = r.calls + EXCLUDED.calls,
+                        duration = r.duration + EXCLUDED.duration
+                """, [(*key, calls, duration) for key, (calls, duration) in rollups.items()])
+
+            if counters:
+                psycopg2.extras.execute_values(cur, f"""
+                    UPDATE campaigns AS c
+                    SET {', '.join(f'{f} = c.{f} + v.{f}' for f in COUNTER_FIELDS)}
+                    FROM (VALUES %s) AS v(id, {', '.join(COUNTER_FIELDS)})
+                    WHERE c.id = v.id
+                """, [
+                    (campaign_id, *(deltas[f] for f in COUNTER_FIELDS))
+                    for campaign_id, deltas in counters.items()
+                ])
+
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            conn.close()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Piper Engine - резидентные процессы Piper с загруженной моделью
+
+Вместо запуска piper на каждый запрос (с загрузкой ONNX-модели с диска)
+держим долгоживущий процесс на каждую пару (голос, length_scale) в режиме
+--json-input: текст передаётся строкой JSON в stdin, piper пишет wav и
+печатает путь к нему в stdout. Модель загружается один раз.
+
+- Процессы создаются по требованию, неиспользуемые выгружаются (LRU)
+- Один запрос на процесс одновременно, общее число синтезов ограничено
+  пулом воркеров (семафор, по умолчанию = лимит CPU контейнера),
+  очередь ожидания тоже ограничена
+- Упавший или зависший процесс убивается и перезапускается при следующем запросе
+"""
+
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+
+class EngineBusy(Exception):
+    """Очередь синтеза переполнена"""
+
+
+class SynthesisError(Exception):
+    """Ошибка синтеза (процесс piper упал или не ответил)"""
+
+
+class PiperProcess:
+    """Один долгоживущий процесс piper для голоса и скорости"""
+
+    def __init__(self, piper_path: str, model_path: str, length_scale: float, output_dir: str):
+        self.piper_path = piper_path
+        self.model_path = model_path
+        self.length_scale = length_scale
+        self.output_dir = output_dir
+
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._stderr_tail = deque(maxlen=20)
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.returncode is None
+
+    async def start(self):
+        self._process = await asyncio.create_subprocess_exec(
+            self.piper_path,
+            '--model', self.model_path,
+            '--length_scale', str(self.length_scale),
+            '--json-input',
+            '--output_dir', self.output_dir,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self._stderr_tail.clear()
+        self._stderr_task = asyncio.create_task(self._drain_stderr())
+
+    async def _drain_stderr(self):
+        """Логи piper читаем постоянно, иначе процесс встанет на заполненном pipe"""
+        while True:
+            line = await self._process.stderr.readline()
+            if not line:
+                break
+            self._stderr_tail.append(line.decode(errors='replace').rstrip())
+
+    async def stop(self):
+        if self._process is None:
+            return
+        if self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        if self._stderr_task:
+            self._stderr_task.cancel()
+        self._process = None
+
+    async def synthesize(self, text: str, output_path: str, timeout: float) -> str:
+        """Синтез одной фразы (вызывать под self.lock); возвращает путь, который напечатал piper"""
+        if not self.alive:
+            await self.start()
+
+        self.last_used = time.monotonic()
+        line = json.dumps({"text": text, "output_file": output_path}) + "\n"
+
+        try:
+            self._process.stdin.write(line.encode())
+            await self._process.stdin.drain()
+            result = await asyncio.wait_for(self._process.stdout.readline(), timeout)
+        except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError) as e:
+            await self.stop()
+            raise SynthesisError(f"Piper не ответил: {e or 'timeout'}")
+
+        if not result:
+            details = '; '.join(self._stderr_tail)
+            await self.stop()
+            raise SynthesisError(f"Piper завершился: {details}")
+
+        self.requests += 1
+        self.last_used = time.monotonic()
+        return result.decode().strip() or output_path
+
+
+def cpu_limit() -> int:
+    """Число CPU, доступных контейнеру (квота cgroup, иначе os.cpu_count())"""
+    try:
+        # cgroup v2: "<quota> <period>" или "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return max(1, int(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    return os.cpu_count() or 1
+
+
+class PiperEngine:
+    """
+    Использование:
+        engine = PiperEngine(PIPER_PATH, {'ruslan': '/app/models/...onnx'}, AUDIO_DIR)
+        await engine.start(warm=['ruslan'])
+        await engine.synthesize('ruslan', 'Текст', '/audio/message.wav', length_scale=1.0)
+
+    На один голос может быть до workers процессов: параллельные синтезы
+    одного голоса (пакетная генерация) не ждут друг друга.
+    """
+
+    def __init__(self, piper_path: str, voice_models: Dict[str, str], output_dir: str,
+                 workers: int = 1, max_processes: int = 4, max_pending: int = 32,
+                 timeout: float = 120.0):
+        self.piper_path = piper_path
+        self.voice_models = voice_models
+        self.output_dir = output_dir
+        self.workers = workers
+        self.max_processes = max(max_processes, workers)
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._processes: "OrderedDict[Tuple[str, float], List[PiperProcess]]" = OrderedDict()
+        self._slots = asyncio.Semaphore(workers)
+        self._pending = 0
+
+    # ---------- жизненный цикл ----------
+
+    async def start(self, warm=()):
+        """Заранее поднимает процессы для голосов (скорость 1.0)"""
+        for voice in warm:
+            process = self._get_process(voice, 1.0)
+            if not process.alive:
+                await process.start()
+
+    async def stop(self):
+        for pool in self._processes.values():
+            for process in pool:
+                await process.stop()
+        self._processes.clear()
+
+    # ---------- процессы ----------
+
+    def _get_process(self, voice: str, length_scale: float) -> PiperProcess:
+        """Свободный процесс для голоса и скорости (новый, если все заняты)"""
+        key = (voice, round(length_scale, 3))
+        pool = self._processes.setdefault(key, [])
+        self._processes.move_to_end(key)
+
+        for process in pool:
+            if not process.lock.locked():
+                return process
+
+        process = PiperProcess(self.piper_path, self.voice_models[voice], key[1], self.output_dir)
+        pool.append(process)
+        self._evict(keep=process)
+        return process
+
+    def _evict(self, keep: PiperProcess):
+        """Выгружает свободные процессы давно не использованных голосов сверх max_processes"""
+        total = sum(len(pool) for pool in self._processes.values())
+        for key in list(self._processes):
+            pool = self._processes[key]
+            for process in list(pool):
+                if total <= self.max_processes:
+                    return
+                if process is keep or process.lock.locked():
+                    continue
+                pool.remove(process)
+                total -= 1
+                asyncio.create_task(process.stop())
+            if not pool:
+                del self._processes[key]
+
+    # ---------- синтез ----------
+
+    async def synthesize(self, voice: str, text: str, output_path: str, length_scale: float = 1.0):
+        """
+        Синтезирует text в output_path (атомарно: пишем во временный файл и переименовываем)
+
+        Raises:
+            EngineBusy: очередь переполнена
+            SynthesisError: piper упал или не ответил за timeout
+        """
+        if self._pending >= self.max_pending:
+            raise EngineBusy(f"В очереди синтеза {self._pending} запросов")
+
+        tmp_path = os.path.join(os.path.dirname(output_path),
+                                f".tmp_{uuid.uuid4().hex}_{os.path.basename(output_path)}")
+
+        self._pending += 1
+        try:
+            async with self._slots:
+                process = self._get_process(voice, length_scale)
+                async with process.lock:
+                    written_path = await process.synthesize(text, tmp_path, self.timeout)
+
+            if not os.path.exists(written_path):
+                raise SynthesisError("Output file was not created")
+            os.replace(written_path, output_path)
+        finally:
+            self._pending -= 1
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def status(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "processes": [
+                {
+                    "voice": voice,
+                    "length_scale": length_scale,
+                    "alive": process.alive,
+                    "busy": process.lock.locked(),
+                    "requests": process.requests,
+                }
+                for (voice, length_scale), pool in self._processes.items()
+                for process in pool
+            ]
+        }
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS Batch - пакетная генерация аудио (тысячи коротких роликов для кампаний)
+
+POST /api/tts/batch создаёт задание и сразу возвращает job_id. Элементы
+обрабатываются параллельно (concurrency воркеров на задание, общий предел
+синтезов задаёт пул PiperEngine). Каждый файл пишется атомарно (временный
+файл + rename), поэтому по имени никогда не виден недописанный wav.
+
+Прогресс: опрос GET /api/tts/batch/{job_id} или поток событий
+GET /api/tts/batch/{job_id}/events (Server-Sent Events: item, done).
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Set
+
+# Пауза перед повтором, если очередь синтеза переполнена
+BUSY_RETRY_DELAY = 0.5
+
+
+class BatchJob:
+    """Задание пакетной генерации и состояние каждого элемента"""
+
+    def __init__(self, requests: list):
+        self.id = uuid.uuid4().hex[:12]
+        self.requests = requests
+        self.items: List[dict] = [
+            {"index": index, "filename": request.filename, "status": "pending"}
+            for index, request in enumerate(requests)
+        ]
+        self.status = "queued"  # queued, running, completed, cancelled
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.counts = {"pending": len(requests), "done": 0, "failed": 0}
+
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "cancelled")
+
+    def summary(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "total": len(self.items),
+            **self.counts,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+    def publish(self, event: str, data: dict):
+        message = f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        for queue in list(self.subscribers):
+            queue.put_nowait(message)
+
+
+class BatchManager:
+    """
+    Использование:
+        batches = BatchManager(generate_file, concurrency=TTS_WORKERS)
+        job = batches.submit([TTSRequest(...), ...])
+    """
+
+    def __init__(self, process_item: Callable[[object], Awaitable[dict]],
+                 busy_errors: tuple = (), concurrency: int = 1, max_jobs: int = 50):
+        self.process_item = process_item
+        self.busy_errors = busy_errors
+        self.concurrency = concurrency
+        self.max_jobs = max_jobs
+
+        self._jobs: "OrderedDict[str, BatchJob]" = OrderedDict()
+
+    # ---------- задания ----------
+
+    def submit(self, requests: list) -> BatchJob:
+        job = BatchJob(requests)
+        self._jobs[job.id] = job
+        self._forget_old()
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[BatchJob]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[BatchJob]:
+        job = self._jobs.get(job_id)
+        if job and not job.finished and job.task:
+            job.task.cancel()
+        return job
+
+    def _forget_old(self):
+        """Хранит не больше max_jobs заданий (выбрасываются старые завершённые)"""
+        for job_id in list(self._jobs):
+            if len(self._jobs) <= self.max_jobs:
+                break
+            if self._jobs[job_id].finished:
+                del self._jobs[job_id]
+
+    async def stop(self):
+        for job in self._jobs.values():
+            if job.task and not job.task.done():
+                job.task.cancel()
+
+    # ---------- выполнение ----------
+
+    async def _process(self, job: BatchJob, index: int):
+        item = job.items[index]
+        item["status"] = "running"
+
+        while True:
+            try:
+                result = await self.process_item(job.requests[index])
+            except self.busy_errors:
+                await asyncio.sleep(BUSY_RETRY_DELAY)
+                continue
+            except Exception as e:
+                item.update(status="failed", error=str(e))
+                job.counts["failed"] += 1
+                job.counts["pending"] -= 1
+                return
+            break
+
+        item.update(status="done", filename=result["filename"],
+                    size=result["size"], cached=result.get("cached", False))
+        job.counts["done"] += 1
+        job.counts["pending"] -= 1
+
+    async def _worker(self, job: BatchJob, queue: asyncio.Queue):
+        while True:
+            try:
+                index = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await self._process(job, index)
+            job.publish("item", job.items[index])
+
+    async def _run(self, job: BatchJob):
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(job.items)):
+            queue.put_nowait(index)
+
+        job.status = "running"
+        try:
+            await asyncio.gather(*[
+                self._worker(job, queue)
+                for _ in range(min(self.concurrency, len(job.items)))
+            ])
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        finally:
+            job.finished_at = time.time()
+            job.publish("done", job.summary())
+
+    # ---------- поток событий ----------
+
+    async def stream(self, job: BatchJob, request, keepalive_interval: float = 15.0):
+        """SSE: сначала уже завершённые элементы, затем новые по мере готовности"""
+        queue: asyncio.Queue = asyncio.Queue()
+        job.subscribers.add(queue)
+        try:
+            for item in job.items:
+                if item["status"] in ("done", "failed"):
+                    yield f"event: item\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+            if job.finished:
+                yield f"event: done\ndata: {json.dumps(job.summary(), ensure_ascii=False)}\n\n"
+                return
+
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    message = await asyncio.wait_for(queue.get(), keepalive_interval)
+                except asyncio.TimeoutError:
+                    message = ": keepalive\n\n"
+                yield message
+                if message.startswith("event: done"):
+                    break
+        finally:
+            job.subscribers.discard(queue)
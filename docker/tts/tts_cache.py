@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS Cache - кэш синтезированных файлов по содержимому
+
+Ключ - sha256 от нормализованного текста, голоса, версии модели и
+length_scale. Одинаковые формулировки (типовые уведомления кампаний)
+синтезируются один раз, повторный запрос получает готовый файл.
+
+- Файлы лежат на томе /audio в скрытом каталоге .tts_cache/<ключ>.wav
+- Метаданные (текст, голос, размер, время обращения) - индекс SQLite рядом
+- Файл для пользователя - жёсткая ссылка на файл кэша: вытеснение из кэша
+  не ломает кампании, которые ссылаются на выданное имя
+- Вытеснение LRU по суммарному размеру (max_bytes); размер записи - wav
+  вместе с производными файлами (<ключ>.ulaw и т.п.), удаляются они тоже вместе
+- Запись, выданная с pin=True, не вытесняется до release(): вызывающий
+  успевает сделать ссылку или прочитать файл
+- Одновременные одинаковые запросы ждут один синтез
+"""
+
+import asyncio
+import glob
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+import unicodedata
+import uuid
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+INDEX_FILE = 'index.sqlite'
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для ключа: NFC и схлопывание пробелов"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def model_version(model_path: str) -> str:
+    """Версия модели: имя + размер + время изменения файла (меняется при обновлении модели)"""
+    try:
+        stat = os.stat(model_path)
+        return f"{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        return os.path.basename(model_path)
+
+
+def link_file(src: str, dest: str):
+    """Атомарно кладёт src под именем dest (жёсткая ссылка, копия - если ссылка невозможна)"""
+    if os.path.exists(dest) and os.path.samefile(src, dest):
+        return  # уже ссылка на этот файл (rename между ссылками на один файл ничего не делает)
+
+    tmp = os.path.join(os.path.dirname(dest), f".tmp_{uuid.uuid4().hex}")
+    try:
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class TTSCache:
+    """
+    Использование:
+        cache = TTSCache('/audio/.tts_cache', max_bytes=500 * 1024 * 1024,
+                         model_versions={'ruslan': model_version(path)})
+        path, hit = await cache.get_or_create(text, voice, length_scale,
+                                              lambda out: engine.synthesize(voice, text, out, length_scale),
+                                              pin=True)
+        try:
+            link_file(path, dest)
+        finally:
+            cache.release(path)
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, model_versions: Dict[str, str]):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.model_versions = model_versions
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pins: Dict[str, int] = {}  # ключ -> число выданных и ещё не отпущенных путей
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(cache_dir, INDEX_FILE), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                voice TEXT NOT NULL,
+                length_scale REAL NOT NULL,
+                text TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+        self._db.commit()
+
+    # ---------- ключи ----------
+
+    def key(self, text: str, voice: str, length_scale: float) -> str:
+        parts = (normalize_text(text), voice, self.model_versions.get(voice, ''), f"{length_scale:.3f}")
+        return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.wav")
+
+    def key_for(self, path: str) -> str:
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def _files_size(self, key: str) -> int:
+        """Размер wav записи вместе с производными файлами"""
+        size = 0
+        for path in glob.glob(os.path.join(self.cache_dir, f"{key}.*")):
+            try:
+                size += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        return size
+
+    def _remove_files(self, key: str):
+        """Удаляет wav записи и производные от него файлы"""
+        for path in glob.glob(os.path.join(self.cache_dir, f"{key}.*")):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # ---------- индекс ----------
+
+    def _lookup(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT key FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            # Файл удалили вручную - запись устарела
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._db.commit()
+            return None
+
+        self._db.execute(
+            "UPDATE entries SET last_used = ?, hits = hits + 1 WHERE key = ?",
+            (time.time(), key)
+        )
+        self._db.commit()
+        return path
+
+    def _register(self, key: str, text: str, voice: str, length_scale: float):
+        now = time.time()
+        self._db.execute("""
+            INSERT OR REPLACE INTO entries (key, voice, length_scale, text, size, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (key, voice, length_scale, normalize_text(text), self._files_size(key), now, now))
+        self._db.commit()
+        self._evict()
+
+    def update_size(self, path: str):
+        """Пересчитывает размер записи после добавления производных файлов (варианты 8 кГц)"""
+        key = self.key_for(path)
+        self._db.execute("UPDATE entries SET size = ? WHERE key = ?", (self._files_size(key), key))
+        self._db.commit()
+        self._evict()
+
+    def _evict(self):
+        """Удаляет давно не использованные записи, пока кэш больше max_bytes"""
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            if key in self._inflight or key in self._pins:
+                # Запись ещё синтезируется или выдана и используется - берём следующую по давности
+                continue
+            self._remove_files(key)
+            self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+        self._db.commit()
+
+    # ---------- выдача ----------
+
+    async def get_or_create(self, text: str, voice: str, length_scale: float,
+                            synthesize: Callable[[str], Awaitable[None]],
+                            pin: bool = False) -> Tuple[str, bool]:
+        """
+        Путь к файлу кэша и признак попадания
+
+        synthesize(path) вызывается только при промахе; одинаковые
+        одновременные запросы ждут один синтез. pin=True - запись не
+        вытесняется до release(path).
+        """
+        key = self.key(text, voice, length_scale)
+
+        while True:
+            path = self._lookup(key)
+            if path:
+                self.hits += 1
+                if pin:
+                    self._pin(key)
+                return path, True
+
+            inflight = self._inflight.get(key)
+            if not inflight:
+                break
+            # Дождались чужого синтеза - снова через индекс: запись могли
+            # вытеснить, пока этот запрос ждал своей очереди в цикле событий
+            await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._inflight[key] = future
+        try:
+            path = self.path_for(key)
+            await synthesize(path)
+            self._register(key, text, voice, length_scale)
+            if pin:
+                self._pin(key)
+            future.set_result(path)
+            return path, False
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # не логировать "exception was never retrieved"
+            raise
+        finally:
+            del self._inflight[key]
+
+    def _pin(self, key: str):
+        self._pins[key] = self._pins.get(key, 0) + 1
+
+    def release(self, path: str):
+        """Отпускает путь, выданный get_or_create(pin=True)"""
+        key = self.key_for(path)
+        count = self._pins.get(key, 0) - 1
+        if count > 0:
+            self._pins[key] = count
+            return
+        self._pins.pop(key, None)
+        self._evict()  # пока запись была занята, кэш мог остаться больше max_bytes
+
+    def stats(self) -> dict:
+        entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        requests = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else None,
+            "evictions": self.evictions,
+        }
+
+    def clear(self) -> int:
+        """Очищает кэш (выданные пользователям файлы остаются)"""
+        keys = [row[0] for row in self._db.execute("SELECT key FROM entries").fetchall()]
+        for key in keys:
+            self._remove_files(key)
+        self._db.execute("DELETE FROM entries")
+        self._db.commit()
+        return len(keys)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Audio Catalog - индекс аудиофайлов /audio в SQLite
+
+Список файлов читается из индекса, а не сканированием каталога на каждый
+запрос. Индекс обновляется при генерации и удалении через API; файлы,
+положенные в /audio в обход API (или удалённые вручную), подхватывает
+reconcile() - при старте и периодически.
+
+Выборка - keyset-пагинация по id (новые первыми), фильтры по голосу и тексту.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import wave
+from typing import List, Optional, Tuple
+
+from tts_cache import normalize_text
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+def wav_duration(path: str) -> Optional[float]:
+    try:
+        with wave.open(path, 'rb') as wav:
+            return round(wav.getnframes() / float(wav.getframerate()), 3)
+    except (wave.Error, EOFError, OSError):
+        return None
+
+
+class AudioCatalog:
+    """
+    Использование:
+        catalog = AudioCatalog('/audio/.catalog.sqlite', '/audio')
+        catalog.add('message.wav', voice='ruslan', text='...', speed=1.0)
+        files, next_cursor, total = catalog.list(voice='irina', limit=50)
+    """
+
+    def __init__(self, db_path: str, audio_dir: str, extension: str = '.wav'):
+        self.audio_dir = audio_dir
+        self.extension = extension
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                filename TEXT NOT NULL UNIQUE,
+                size INTEGER NOT NULL,
+                duration REAL,
+                voice TEXT,
+                speed REAL,
+                text TEXT,
+                text_hash TEXT,
+                created_at REAL NOT NULL,
+                source TEXT NOT NULL DEFAULT 'api'  -- api, external (найден reconcile)
+            );
+            CREATE INDEX IF NOT EXISTS idx_files_voice_id ON files(voice, id);
+            CREATE INDEX IF NOT EXISTS idx_files_text_hash ON files(text_hash);
+        """)
+        self._db.commit()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.audio_dir, filename)
+
+    # ---------- изменения ----------
+
+    def add(self, filename: str, voice: Optional[str] = None, text: Optional[str] = None,
+            speed: Optional[float] = None, source: str = 'api'):
+        """Добавляет или обновляет файл (перегенерированный файл поднимается в начало списка)"""
+        path = self._path(filename)
+        stat = os.stat(path)
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+            self._db.execute("""
+                INSERT INTO files (filename, size, duration, voice, speed, text, text_hash, created_at, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (filename, stat.st_size, wav_duration(path), voice, speed, text,
+                  text_hash(text) if text else None, time.time(), source))
+            self._db.commit()
+
+    def remove(self, filename: str):
+        with self._lock:
+            self._db.execute("DELETE FROM files WHERE filename = ?", (filename,))
+            self._db.commit()
+
+    # ---------- выборка ----------
+
+    def list(self, voice: Optional[str] = None, query: Optional[str] = None,
+             text: Optional[str] = None, cursor: Optional[int] = None,
+             limit: int = 100) -> Tuple[List[dict], Optional[int], int]:
+        """
+        (файлы, next_cursor, всего по фильтру)
+
+        query - подстрока в имени файла или тексте; text - точный текст (по хэшу)
+        """
+        conditions, params = [], []
+        if voice:
+            conditions.append("voice = ?")
+            params.append(voice)
+        if query:
+            conditions.append("(filename LIKE ? OR text LIKE ?)")
+            params += [f"%{query}%", f"%{query}%"]
+        if text:
+            conditions.append("text_hash = ?")
+            params.append(text_hash(text))
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        page_where = where + (" AND " if where else "WHERE ") + "id < ?" if cursor else where
+        page_params = params + [cursor] if cursor else list(params)
+
+        with self._lock:
+            total = self._db.execute(f"SELECT COUNT(*) FROM files {where}", params).fetchone()[0]
+            rows = self._db.execute(f"""
+                SELECT id, filename, size, duration, voice, speed, text, created_at, source
+                FROM files {page_where}
+                ORDER BY id DESC
+                LIMIT ?
+            """, page_params + [limit + 1]).fetchall()
+
+        files = [
+            dict(row, created=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(row['created_at'])))
+            for row in rows[:limit]
+        ]
+        next_cursor = files[-1]['id'] if len(rows) > limit else None
+        return files, next_cursor, total
+
+    # ---------- сверка с каталогом ----------
+
+    def reconcile(self) -> dict:
+        """Сверяет индекс с содержимым audio_dir (новые, удалённые, изменённые файлы)"""
+        # Сначала индекс, потом каталог: файл, сгенерированный через API между
+        # ними, окажется на диске и не будет принят за удалённый
+        started = time.time()
+        with self._lock:
+            indexed = {row['filename']: row['size']
+                       for row in self._db.execute("SELECT filename, size FROM files")}
+
+        on_disk = {}
+        with os.scandir(self.audio_dir) as entries:
+            for entry in entries:
+                # .tmp_* и служебные файлы пропускаем
+                if entry.name.startswith('.') or not entry.name.endswith(self.extension):
+                    continue
+                if entry.is_file():
+                    on_disk[entry.name] = entry.stat()
+
+        added = updated = 0
+        for filename, stat in on_disk.items():
+            if filename not in indexed:
+                added += self._insert_external(filename, stat)
+            elif indexed[filename] != stat.st_size:
+                with self._lock:
+                    self._db.execute("UPDATE files SET size = ?, duration = ? WHERE filename = ?",
+                                     (stat.st_size, wav_duration(self._path(filename)), filename))
+                updated += 1
+
+        missing = [filename for filename in indexed if filename not in on_disk]
+        with self._lock:
+            # Записи, добавленные после начала сверки (файл перегенерирован), не трогаем
+            removed = 0
+            for filename in missing:
+                removed += self._db.execute("DELETE FROM files WHERE filename = ? AND created_at < ?",
+                                            (filename, started)).rowcount
+            self._db.commit()
+
+        return {"added": added, "removed": removed, "updated": updated, "total": len(on_disk)}
+
+    def _insert_external(self, filename: str, stat: os.stat_result) -> int:
+        """Файл, положенный в audio_dir в обход API; 0 - уже есть в индексе"""
+        with self._lock:
+            return self._db.execute("""
+                INSERT OR IGNORE INTO files (filename, size, duration, created_at, source)
+                VALUES (?, ?, ?, ?, 'external')
+            """, (filename, stat.st_size, wav_duration(self._path(filename)), stat.st_ctime)).rowcount
@@ -4,19 +4,45 @@
 Piper TTS Service - API для генерации речи из текста
 """
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-import subprocess
+from typing import List, Optional
+import asyncio
 import os
-import uuid
-from datetime import datetime
+
+from piper_engine import PiperEngine, EngineBusy, SynthesisError, cpu_limit
+from tts_batch import BatchManager
+from tts_stream import split_sentences, stream_speech
+from tts_telephony import make_variants, parse_formats, remove_variants, variant_path
+from tts_catalog import AudioCatalog
+from tts_cache import TTSCache, link_file, model_version
 
 app = FastAPI(title="Piper TTS Service")
 
 # Конфигурация
 PIPER_PATH = os.getenv('PIPER_PATH', '/app/piper/piper')
 AUDIO_DIR = os.getenv('AUDIO_DIR', '/audio')
+DEFAULT_VOICE = 'ruslan'
+
+# Пул синтеза: одновременных синтезов (по умолчанию = лимит CPU контейнера),
+# резидентных процессов piper, запросов в очереди
+TTS_WORKERS = int(os.getenv('TTS_WORKERS', 0)) or cpu_limit()
+TTS_MAX_PROCESSES = int(os.getenv('TTS_MAX_PROCESSES', 3))
+TTS_MAX_PENDING = int(os.getenv('TTS_MAX_PENDING', 32))
+TTS_TIMEOUT = float(os.getenv('TTS_TIMEOUT', 120))
+TTS_BATCH_MAX_ITEMS = int(os.getenv('TTS_BATCH_MAX_ITEMS', 10000))
+
+# Телефонные варианты 8 кГц рядом с wav (см. tts_telephony.py)
+TELEPHONY_FORMATS = parse_formats(os.getenv('TELEPHONY_FORMATS', 'sln,ulaw,alaw,gsm'))
+
+# Каталог файлов /audio (см. tts_catalog.py)
+TTS_CATALOG_PATH = os.getenv('TTS_CATALOG_PATH', os.path.join(AUDIO_DIR, '.catalog.sqlite'))
+TTS_CATALOG_RECONCILE_INTERVAL = float(os.getenv('TTS_CATALOG_RECONCILE_INTERVAL', 600))
+
+# Кэш синтеза по содержимому (см. tts_cache.py)
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', os.path.join(AUDIO_DIR, '.tts_cache'))
+TTS_CACHE_MAX_MB = int(os.getenv('TTS_CACHE_MAX_MB', 500))
 
 # Доступные голосовые модели
 VOICE_MODELS = {
@@ -41,6 +67,26 @@ VOICE_MODELS = {
 }
 
 
+# Резидентные процессы piper: модель загружается один раз (см. piper_engine.py)
+engine = PiperEngine(
+    PIPER_PATH,
+    {voice_id: voice_data["path"] for voice_id, voice_data in VOICE_MODELS.items()},
+    AUDIO_DIR,
+    workers=TTS_WORKERS,
+    max_processes=TTS_MAX_PROCESSES,
+    max_pending=TTS_MAX_PENDING,
+    timeout=TTS_TIMEOUT
+)
+
+cache = TTSCache(
+    TTS_CACHE_DIR,
+    max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024,
+    model_versions={voice_id: model_version(voice_data["path"]) for voice_id, voice_data in VOICE_MODELS.items()}
+)
+
+catalog = AudioCatalog(TTS_CATALOG_PATH, AUDIO_DIR)
+
+
 class TTSRequest(BaseModel):
     text: str
     filename: str = None  # Опционально: имя файла (иначе генерируется автоматически)
@@ -48,6 +94,10 @@ class TTSRequest(BaseModel):
     speed: float = 1.0  # Скорость: 0.5 (медленно) - 2.0 (быстро)
 
 
+class TTSBatchRequest(BaseModel):
+    items: List[TTSRequest]
+
+
 @app.get("/")
 async def root():
     """Статус сервиса"""
@@ -80,7 +130,7 @@ async def health_check():
     """Проверка здоровья сервиса"""
     # Проверяем наличие Piper и модели
     piper_exists = os.path.exists(PIPER_PATH)
-    model_exists = os.path.exists(MODEL_PATH)
+    model_exists = all(os.path.exists(voice_data["path"]) for voice_data in VOICE_MODELS.values())
 
     if not piper_exists:
         raise HTTPException(status_code=500, detail="Piper binary not found")
@@ -91,21 +141,14 @@ async def health_check():
     return {
         "status": "healthy",
         "piper": piper_exists,
-        "model": model_exists
+        "model": model_exists,
+        "engine": engine.status(),
+        "cache": cache.stats()
     }
 
 
-@app.post("/api/tts/generate")
-async def generate_speech(request: TTSRequest):
-    """
-    Генерирует речь из текста и возвращает путь к файлу
-
-    POST /api/tts/generate
-    {
-        "text": "Привет, это тестовое сообщение",
-        "filename": "message.wav"  // опционально
-    }
-    """
+def validate_request(request: TTSRequest):
+    """Проверка параметров синтеза (HTTPException 400)"""
     if not request.text or len(request.text.strip()) == 0:
         raise HTTPException(status_code=400, detail="Текст не может быть пустым")
 
@@ -117,67 +160,257 @@ async def generate_speech(request: TTSRequest):
     if not (0.5 <= request.speed <= 2.0):
         raise HTTPException(status_code=400, detail="Скорость должна быть от 0.5 до 2.0")
 
-    # Выбираем модель голоса
-    model_path = VOICE_MODELS[request.voice]["path"]
+    # Имя файла - только внутри AUDIO_DIR
+    if request.filename and (os.path.basename(request.filename) != request.filename
+                             or request.filename.startswith('.')):
+        raise HTTPException(status_code=400, detail=f"Некорректное имя файла: {request.filename}")
+
+
+async def generate_file(request: TTSRequest) -> dict:
+    """
+    Синтез одного файла (из кэша или piper) в AUDIO_DIR
+
+    Raises:
+        EngineBusy, SynthesisError, OSError
+    """
+    # Вычисляем length_scale (обратно скорости: меньше = быстрее)
+    length_scale = 1.0 / request.speed
 
     # Генерируем имя файла
     if request.filename:
         # Убираем расширение если есть и добавляем .wav
         filename = request.filename.replace('.wav', '') + '.wav'
     else:
-        # Автоматическая генерация имени
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"tts_{timestamp}_{unique_id}.wav"
+        # Одинаковый текст/голос/скорость - одно и то же имя
+        filename = f"tts_{cache.key(request.text, request.voice, length_scale)[:16]}.wav"
 
     output_path = os.path.join(AUDIO_DIR, filename)
 
+    # Из кэша, иначе синтез в резидентном процессе piper; запись закреплена,
+    # пока с неё не сделаны ссылки
+    cache_path, cached = await cache.get_or_create(
+        request.text, request.voice, length_scale,
+        lambda path: engine.synthesize(request.voice, request.text, path, length_scale),
+        pin=True
+    )
     try:
-        # Вычисляем length_scale (обратно скорости: меньше = быстрее)
-        length_scale = 1.0 / request.speed
-
-        # Запускаем Piper для генерации речи
-        # echo "текст" | piper --model model.onnx --length_scale 1.0 --output_file output.wav
-        piper_command = [
-            PIPER_PATH,
-            '--model', model_path,
-            '--length_scale', str(length_scale),
-            '--output_file', output_path
-        ]
+        link_file(cache_path, output_path)
 
-        process = subprocess.Popen(
-            piper_command,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        # Варианты 8 кГц делаются один раз на запись кэша и раздаются ссылками
+        variants = await make_variants(cache_path, TELEPHONY_FORMATS)
+        for fmt, path in variants.items():
+            link_file(path, variant_path(output_path, fmt))
+        cache.update_size(cache_path)
+    finally:
+        cache.release(cache_path)
 
-        stdout, stderr = process.communicate(input=request.text)
+    catalog.add(filename, voice=request.voice, text=request.text, speed=request.speed)
 
-        if process.returncode != 0:
-            raise Exception(f"Piper error: {stderr}")
+    return {
+        "success": True,
+        "filename": filename,
+        "path": output_path,
+        "size": os.path.getsize(output_path),
+        "text_length": len(request.text),
+        "voice": request.voice,
+        "speed": request.speed,
+        "cached": cached,
+        "variants": {fmt: os.path.basename(variant_path(output_path, fmt)) for fmt in variants}
+    }
 
-        # Проверяем что файл создан
-        if not os.path.exists(output_path):
-            raise Exception("Output file was not created")
 
-        file_size = os.path.getsize(output_path)
+@app.post("/api/tts/generate")
+async def generate_speech(request: TTSRequest):
+    """
+    Генерирует речь из текста и возвращает путь к файлу
 
-        return {
-            "success": True,
-            "filename": filename,
-            "path": output_path,
-            "size": file_size,
-            "text_length": len(request.text),
-            "voice": request.voice,
-            "speed": request.speed
-        }
+    POST /api/tts/generate
+    {
+        "text": "Привет, это тестовое сообщение",
+        "filename": "message.wav"  // опционально
+    }
+    """
+    validate_request(request)
 
-    except Exception as e:
+    try:
+        return await generate_file(request)
+
+    except EngineBusy as e:
+        raise HTTPException(status_code=503, detail=f"TTS engine busy: {str(e)}")
+    except (SynthesisError, OSError) as e:
         raise HTTPException(status_code=500, detail=f"TTS generation failed: {str(e)}")
 
 
+@app.post("/api/tts/stream")
+async def stream_speech_endpoint(request: TTSRequest):
+    """
+    Синтез по предложениям с отдачей потоком (chunked WAV)
+
+    POST /api/tts/stream
+    {
+        "text": "Длинное объявление. Из нескольких предложений.",
+        "filename": "announcement.wav"  // опционально
+    }
+    Звук начинает приходить после синтеза первого предложения. Параллельно
+    файл в AUDIO_DIR дописывается по мере готовности предложений
+    (имя - в заголовке X-Audio-Filename).
+    """
+    validate_request(request)
+
+    length_scale = 1.0 / request.speed
+    sentences = split_sentences(request.text)
+    if not sentences:
+        # Только знаки препинания ("...", "!!!") - синтезировать нечего
+        raise HTTPException(status_code=400, detail="В тексте нет предложений для синтеза")
+
+    if request.filename:
+        filename = request.filename.replace('.wav', '') + '.wav'
+    else:
+        filename = f"tts_{cache.key(request.text, request.voice, length_scale)[:16]}.wav"
+
+    pinned = []
+
+    async def synthesize_sentence(sentence: str) -> str:
+        # Каждое предложение кэшируется отдельно: типовые фразы не синтезируются повторно.
+        # Файл закреплён в кэше до конца потока (читается позже, в порядке очереди)
+        path, _ = await cache.get_or_create(
+            sentence, request.voice, length_scale,
+            lambda out: engine.synthesize(request.voice, sentence, out, length_scale),
+            pin=True
+        )
+        pinned.append(path)
+        return path
+
+    output_path = os.path.join(AUDIO_DIR, filename)
+
+    async def stream_and_convert():
+        # Файл перезаписывается - варианты прежнего текста (или жёсткие ссылки
+        # на чужую запись кэша) больше не соответствуют ему
+        remove_variants(output_path)
+        try:
+            async for chunk in stream_speech(sentences, synthesize_sentence, output_path):
+                yield chunk
+        finally:
+            for path in pinned:
+                cache.release(path)
+        # Файл дописан - делаем телефонные варианты для Asterisk
+        await make_variants(output_path, TELEPHONY_FORMATS)
+        catalog.add(filename, voice=request.voice, text=request.text, speed=request.speed)
+
+    return StreamingResponse(
+        stream_and_convert(),
+        media_type="audio/wav",
+        headers={
+            "X-Audio-Filename": filename,
+            "X-Sentences": str(len(sentences)),
+            "Cache-Control": "no-cache"
+        }
+    )
+
+
+# Пакетная генерация (см. tts_batch.py)
+batches = BatchManager(generate_file, busy_errors=(EngineBusy,), concurrency=TTS_WORKERS)
+
+
+@app.post("/api/tts/batch")
+async def create_batch(request: TTSBatchRequest):
+    """
+    Пакетная генерация: задание выполняется в фоне
+
+    POST /api/tts/batch
+    {
+        "items": [
+            {"text": "Иван, ваш заказ готов", "filename": "order_1.wav"},
+            {"text": "Мария, ваш заказ готов", "filename": "order_2.wav", "voice": "irina"}
+        ]
+    }
+    Прогресс: GET /api/tts/batch/{job_id} или GET /api/tts/batch/{job_id}/events (SSE)
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="Пустое задание")
+    if len(request.items) > TTS_BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Не больше {TTS_BATCH_MAX_ITEMS} элементов в задании")
+
+    for index, item in enumerate(request.items):
+        try:
+            validate_request(item)
+        except HTTPException as e:
+            raise HTTPException(status_code=400, detail=f"Элемент {index}: {e.detail}")
+
+    job = batches.submit(request.items)
+    return job.summary()
+
+
+@app.get("/api/tts/batch/{job_id}")
+async def get_batch(job_id: str, include_items: bool = True):
+    """
+    Статус задания и каждого элемента
+
+    GET /api/tts/batch/{job_id}
+    GET /api/tts/batch/{job_id}?include_items=false  - только счётчики
+    """
+    job = batches.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+
+    result = job.summary()
+    if include_items:
+        result["items"] = job.items
+    return result
+
+
+@app.get("/api/tts/batch/{job_id}/events")
+async def stream_batch(job_id: str, request: Request):
+    """
+    Готовые элементы задания по мере синтеза (Server-Sent Events)
+
+    GET /api/tts/batch/{job_id}/events
+    События: item (элемент готов или ошибка), done (задание завершено)
+    """
+    job = batches.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+
+    return StreamingResponse(
+        batches.stream(job, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.delete("/api/tts/batch/{job_id}")
+async def cancel_batch(job_id: str):
+    """
+    Отменить задание (готовые файлы остаются)
+
+    DELETE /api/tts/batch/{job_id}
+    """
+    job = batches.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job.summary()
+
+
+@app.get("/api/tts/cache")
+async def get_cache_stats():
+    """
+    Статистика кэша синтеза (попадания, промахи, размер)
+
+    GET /api/tts/cache
+    """
+    return cache.stats()
+
+
+@app.delete("/api/tts/cache")
+async def clear_cache():
+    """
+    Очистить кэш синтеза (сгенерированные файлы в /audio остаются)
+
+    DELETE /api/tts/cache
+    """
+    return {"success": True, "removed": cache.clear()}
+
+
 @app.get("/api/tts/audio/{filename}")
 async def get_audio_file(filename: str):
     """
@@ -198,36 +431,34 @@ async def get_audio_file(filename: str):
 
 
 @app.get("/api/tts/files")
-async def list_audio_files():
+async def list_audio_files(voice: Optional[str] = None, q: Optional[str] = None,
+                           text: Optional[str] = None, cursor: Optional[int] = None,
+                           limit: int = 100):
     """
-    Список всех сгенерированных аудио файлов
+    Список сгенерированных аудио файлов (из каталога, новые первыми)
 
     GET /api/tts/files
+    GET /api/tts/files?voice=irina&q=заказ&limit=50
+    GET /api/tts/files?cursor=<next_cursor>
     """
-    try:
-        files = []
-
-        for filename in os.listdir(AUDIO_DIR):
-            if filename.endswith('.wav'):
-                file_path = os.path.join(AUDIO_DIR, filename)
-                file_stat = os.stat(file_path)
-
-                files.append({
-                    "filename": filename,
-                    "size": file_stat.st_size,
-                    "created": datetime.fromtimestamp(file_stat.st_ctime).isoformat()
-                })
+    limit = max(1, min(limit, 1000))
+    files, next_cursor, total = catalog.list(voice=voice, query=q, text=text,
+                                             cursor=cursor, limit=limit)
+    return {
+        "total": total,
+        "files": files,
+        "next_cursor": next_cursor
+    }
 
-        # Сортируем по дате создания (новые первыми)
-        files.sort(key=lambda x: x['created'], reverse=True)
 
-        return {
-            "total": len(files),
-            "files": files
-        }
+@app.post("/api/tts/files/reconcile")
+async def reconcile_audio_files():
+    """
+    Сверить каталог с содержимым /audio (файлы, добавленные или удалённые в обход API)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    POST /api/tts/files/reconcile
+    """
+    return await asyncio.to_thread(catalog.reconcile)
 
 
 @app.delete("/api/tts/audio/{filename}")
@@ -244,11 +475,43 @@ async def delete_audio_file(filename: str):
 
     try:
         os.remove(file_path)
+        catalog.remove(filename)
+        # Вместе с wav - его телефонные варианты
+        if file_path.endswith('.wav'):
+            remove_variants(file_path)
         return {"success": True, "message": f"File {filename} deleted"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to delete file: {str(e)}")
 
 
+async def reconcile_loop():
+    """Периодическая сверка каталога с /audio (первая - сразу при старте)"""
+    while True:
+        try:
+            result = await asyncio.to_thread(catalog.reconcile)
+            if result["added"] or result["removed"] or result["updated"]:
+                print(f"[TTS] Каталог сверен: {result}")
+        except Exception as e:
+            print(f"[TTS] Ошибка сверки каталога: {e}")
+        await asyncio.sleep(TTS_CATALOG_RECONCILE_INTERVAL)
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Прогрев: процесс piper для голоса по умолчанию поднимается заранее"""
+    asyncio.create_task(reconcile_loop())
+    try:
+        await engine.start(warm=[DEFAULT_VOICE])
+    except OSError as e:
+        print(f"[TTS] Не удалось запустить piper: {e}")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await batches.stop()
+    await engine.stop()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+TTS Stream - синтез длинных сообщений по предложениям с отдачей потоком
+
+Текст делится на предложения, они синтезируются по порядку (следующее -
+пока отдаётся текущее). PCM каждого готового предложения сразу уходит:
+    - в HTTP-ответ (chunked, WAV с "бесконечным" заголовком)
+    - в файл, который дописывается по мере синтеза; после последнего
+      предложения размеры в заголовке исправляются
+Время до первого звука - синтез одного предложения, а не всего текста.
+"""
+
+import asyncio
+import os
+import re
+import struct
+import wave
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+# Предложение: до .!?… (с кавычками/скобками после них) или до перевода строки
+SENTENCE_RE = re.compile(r'[^.!?…\n]+(?:[.!?…]+["»)\]]*|\n|$)')
+
+# Размер в заголовке WAV, пока длина неизвестна
+UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def split_sentences(text: str, max_length: int = 400) -> List[str]:
+    """Делит текст на предложения; слишком длинные режет по , ; :"""
+    sentences = []
+    for match in SENTENCE_RE.finditer(text):
+        sentence = match.group(0).strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_length:
+            cut = max(sentence.rfind(sep, 0, max_length) for sep in (',', ';', ':', ' '))
+            if cut <= 0:
+                cut = max_length
+            sentences.append(sentence[:cut + 1].strip())
+            sentence = sentence[cut + 1:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+
+def wav_header(sample_rate: int, channels: int, sample_width: int,
+               data_size: int = UNKNOWN_SIZE) -> bytes:
+    """Заголовок PCM WAV (44 байта)"""
+    riff_size = UNKNOWN_SIZE if data_size == UNKNOWN_SIZE else 36 + data_size
+    byte_rate = sample_rate * channels * sample_width
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate,
+                                byte_rate, channels * sample_width, sample_width * 8)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+
+def read_wav(path: str) -> Tuple[Tuple[int, int, int], bytes]:
+    """((sample_rate, channels, sample_width), pcm)"""
+    with wave.open(path, 'rb') as wav:
+        params = (wav.getframerate(), wav.getnchannels(), wav.getsampwidth())
+        return params, wav.readframes(wav.getnframes())
+
+
+class ProgressiveWav:
+    """WAV-файл, который дописывается по предложениям"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.params: Optional[Tuple[int, int, int]] = None
+        self.data_size = 0
+        # Файл может быть жёсткой ссылкой на кэш - не перезаписываем его содержимое
+        if os.path.exists(path):
+            os.remove(path)
+        self._file = open(path, 'wb')
+
+    def write(self, params: Tuple[int, int, int], pcm: bytes):
+        if self.params is None:
+            self.params = params
+            self._file.write(wav_header(*params))
+        self._file.write(pcm)
+        self._file.flush()
+        self.data_size += len(pcm)
+
+    def close(self, complete: bool = True):
+        """Записывает настоящие размеры в заголовок; недописанный файл удаляется"""
+        if complete and self.params is not None:
+            self._file.seek(0)
+            self._file.write(wav_header(*self.params, data_size=self.data_size))
+        self._file.close()
+        if not complete:
+            os.remove(self.path)
+
+
+async def stream_speech(sentences: List[str], synthesize: Callable[[str], Awaitable[str]],
+                        output_path: Optional[str] = None, prefetch: int = 1) -> AsyncIterator[bytes]:
+    """
+    Асинхронный генератор байтов WAV
+
+    synthesize(sentence) -> путь к wav одного предложения. Синтез идёт
+    впереди отдачи на prefetch предложений.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=prefetch)
+
+    async def produce():
+        try:
+            for sentence in sentences:
+                await queue.put(await synthesize(sentence))
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    progressive = ProgressiveWav(output_path) if output_path else None
+    header_sent = False
+    complete = False
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            params, pcm = await asyncio.to_thread(read_wav, item)
+            if progressive:
+                progressive.write(params, pcm)
+            if not header_sent:
+                yield wav_header(*params)
+                header_sent = True
+            yield pcm
+        complete = True
+    finally:
+        producer.cancel()
+        if progressive:
+            progressive.close(complete)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Телефонные варианты аудио (8 кГц) для Asterisk
+
+Piper пишет WAV 22050 Гц, а транк GoIP работает в ulaw/alaw 8 кГц. Чтобы
+Asterisk не перекодировал каждое проигрывание, при генерации рядом с
+message.wav кладутся готовые варианты:
+    message.sln   - signed linear 16 бит 8 кГц
+    message.ulaw  - G.711 u-law
+    message.alaw  - G.711 a-law
+    message.gsm   - GSM 06.10 (только если установлен sox)
+Playback(/audio/message) без расширения сам выбирает вариант, который не
+требует перекодирования для кодека канала.
+
+Передискретизация - один раз: sox (качественный фильтр), без sox - audioop.ratecv.
+"""
+
+import asyncio
+import audioop
+import os
+import shutil
+import uuid
+import wave
+from typing import Dict, Iterable, Optional
+
+TELEPHONY_RATE = 8000
+SUPPORTED_FORMATS = ('sln', 'ulaw', 'alaw', 'gsm')
+
+SOX_PATH = shutil.which('sox')
+
+
+def variant_path(wav_path: str, fmt: str) -> str:
+    return f"{os.path.splitext(wav_path)[0]}.{fmt}"
+
+
+def remove_variants(wav_path: str):
+    """
+    Удаляет варианты рядом с wav_path (перед перезаписью wav): иначе
+    Playback без расширения проиграет старые .ulaw/.sln вместо нового текста
+    """
+    for fmt in SUPPORTED_FORMATS:
+        path = variant_path(wav_path, fmt)
+        if os.path.lexists(path):
+            os.remove(path)
+
+
+def _read_mono_pcm(wav_path: str):
+    with wave.open(wav_path, 'rb') as wav:
+        rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+        pcm = wav.readframes(wav.getnframes())
+    if width != 2:
+        pcm = audioop.lin2lin(pcm, width, 2)
+    if channels == 2:
+        pcm = audioop.tomono(pcm, 2, 0.5, 0.5)
+    return pcm, rate
+
+
+async def _sox(*args: str) -> bool:
+    process = await asyncio.create_subprocess_exec(
+        SOX_PATH, *args,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        print(f"[TTS] sox: {stderr.decode(errors='replace').strip()}")
+    return process.returncode == 0
+
+
+async def _to_slin8k(wav_path: str, sln_path: str):
+    """WAV -> raw signed linear 8 кГц моно"""
+    if SOX_PATH and await _sox(wav_path, '-t', 'raw', '-e', 'signed-integer', '-b', '16',
+                               '-c', '1', '-r', str(TELEPHONY_RATE), sln_path):
+        return
+
+    def convert():
+        pcm, rate = _read_mono_pcm(wav_path)
+        if rate != TELEPHONY_RATE:
+            pcm, _ = audioop.ratecv(pcm, 2, 1, rate, TELEPHONY_RATE, None)
+        with open(sln_path, 'wb') as f:
+            f.write(pcm)
+
+    await asyncio.to_thread(convert)
+
+
+def _encode_g711(sln_path: str, out_path: str, fmt: str):
+    with open(sln_path, 'rb') as f:
+        pcm = f.read()
+    encoded = audioop.lin2ulaw(pcm, 2) if fmt == 'ulaw' else audioop.lin2alaw(pcm, 2)
+    with open(out_path, 'wb') as f:
+        f.write(encoded)
+
+
+async def make_variants(wav_path: str, formats: Iterable[str]) -> Dict[str, str]:
+    """
+    Создаёт недостающие варианты рядом с wav_path; {формат: путь}
+
+    Файлы пишутся во временные и переименовываются (Asterisk не увидит недописанный).
+    """
+    formats = [fmt for fmt in formats if fmt in SUPPORTED_FORMATS]
+    if 'gsm' in formats and not SOX_PATH:
+        formats.remove('gsm')
+
+    result = {fmt: variant_path(wav_path, fmt) for fmt in formats}
+    missing = [fmt for fmt, path in result.items() if not os.path.exists(path)]
+    if not missing:
+        return result
+
+    tmp_prefix = os.path.join(os.path.dirname(wav_path), f".tmp_{uuid.uuid4().hex}")
+    sln_tmp = f"{tmp_prefix}_8k.raw"
+    try:
+        await _to_slin8k(wav_path, sln_tmp)
+
+        for fmt in missing:
+            out_tmp = f"{tmp_prefix}.{fmt}"
+            if fmt == 'sln':
+                shutil.copyfile(sln_tmp, out_tmp)
+            elif fmt in ('ulaw', 'alaw'):
+                await asyncio.to_thread(_encode_g711, sln_tmp, out_tmp, fmt)
+            elif not await _sox('-t', 'raw', '-e', 'signed-integer', '-b', '16', '-c', '1',
+                                '-r', str(TELEPHONY_RATE), sln_tmp, '-t', 'gsm', out_tmp):
+                result.pop(fmt)
+                continue
+            os.replace(out_tmp, result[fmt])
+    finally:
+        for path in [sln_tmp] + [f"{tmp_prefix}.{fmt}" for fmt in missing]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    return result
+
+
+def parse_formats(value: Optional[str]) -> list:
+    """'sln,ulaw,alaw,gsm' -> список поддерживаемых форматов"""
+    if not value:
+        return []
+    return [fmt.strip() for fmt in value.split(',') if fmt.strip() in SUPPORTED_FORMATS]